@@ -0,0 +1,70 @@
+"""Download throughput benchmark against the local fake Mega server.
+
+    python benchmarks/bench_download.py --size-mb 256 --connections 1 4 8
+"""
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_mega import FakeMegaServer  # noqa: E402
+from mega_downloader import MegaDownloader, parse_mega_link  # noqa: E402
+
+
+class BenchConfig:
+    """The subset of Config the download engine reads"""
+
+    def __init__(self, api_url, connections, segment_mb):
+        self.MEGA_API_URL = api_url
+        self.MEGA_CONNECTIONS = connections
+        self.MEGA_MAX_CONNECTIONS = max(connections, 1)
+        self.MEGA_SEGMENT_SIZE = segment_mb * 1024 * 1024
+        self.MEGA_RETRIES = 3
+        self.MEGA_MAX_BANDWIDTH = 0  # no cap
+
+
+async def run_once(server, link, connections, segment_mb, workdir):
+    downloader = MegaDownloader(BenchConfig(server.url, connections, segment_mb))
+    try:
+        mega_file = await downloader.get_file_info(*parse_mega_link(link))
+        path = os.path.join(workdir, mega_file.name)
+        started = time.perf_counter()
+        await downloader.download(mega_file, path)
+        elapsed = time.perf_counter() - started
+        os.remove(path)
+        return mega_file.size / elapsed / (1024 * 1024)
+    finally:
+        downloader.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=128)
+    parser.add_argument('--segment-mb', type=int, default=8)
+    parser.add_argument('--connections', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--bandwidth-mbps', type=float, default=0,
+                        help='per-connection cap on the fake server in MB/s')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds of delay before each range response')
+    args = parser.parse_args()
+
+    bandwidth = int(args.bandwidth_mbps * 1024 * 1024) or None
+    server = FakeMegaServer(bandwidth=bandwidth, latency=args.latency).start()
+    fake = server.add_file('BENCH000', args.size_mb * 1024 * 1024)
+
+    print(f"📦 {args.size_mb}MB file, {args.segment_mb}MB segments")
+    with tempfile.TemporaryDirectory() as workdir:
+        for connections in args.connections:
+            speed = asyncio.run(run_once(server, fake.link, connections, args.segment_mb, workdir))
+            peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            print(f"⬇️ connections={connections:<3} {speed:8.1f} MB/s   peak RSS {peak_mb:.0f}MB")
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
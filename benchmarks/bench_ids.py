@@ -0,0 +1,109 @@
+"""Insert throughput of random vs time-ordered download IDs.
+
+Inserts download records keyed by the old 8-character random IDs and by
+IdGenerator IDs, into the local SQLite store and, with --mongo-uri, into a
+scratch MongoDB collection with the same unique index.
+
+    python benchmarks/bench_ids.py --count 100000 --mongo-uri mongodb://localhost
+"""
+import argparse
+import datetime
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ids import IdGenerator, id_at  # noqa: E402
+from local_store import SQLiteStore  # noqa: E402
+
+BATCH = 1000
+
+
+def random_ids():
+    while True:
+        yield ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+
+
+def time_ids():
+    generator = IdGenerator(1)
+    while True:
+        yield generator.next_id()
+
+
+def records(ids, count):
+    now = datetime.datetime.now()
+    for _ in range(count):
+        yield {'download_id': next(ids), 'user_id': random.randrange(1000), 'status': 'queued',
+               'started_at': now, 'mega_link': 'https://mega.nz/file/BENCH'}
+
+
+def batches(docs):
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) == BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def bench_sqlite(make_ids, count, workdir):
+    store = SQLiteStore(os.path.join(workdir, f'{make_ids.__name__}.db'))
+    started = time.perf_counter()
+    for batch in batches(records(make_ids(), count)):
+        store.insert_many('downloads', batch)
+    elapsed = time.perf_counter() - started
+    store.close()
+    return count / elapsed
+
+
+def bench_mongo(make_ids, count, uri):
+    import pymongo
+    collection = pymongo.MongoClient(uri)['bench_ids'][make_ids.__name__]
+    collection.drop()
+    collection.create_index('download_id', unique=True)
+    started = time.perf_counter()
+    for batch in batches(records(make_ids(), count)):
+        collection.insert_many(batch, ordered=False)
+    elapsed = time.perf_counter() - started
+    collection.drop()
+    return count / elapsed
+
+
+def bench_range_scan(count, workdir):
+    """Time a one-minute window query on time-ordered IDs"""
+    store = SQLiteStore(os.path.join(workdir, 'scan.db'))
+    for batch in batches(records(time_ids(), count)):
+        store.insert_many('downloads', batch)
+    end = datetime.datetime.now()
+    query = {'download_id': {'$gte': id_at(end - datetime.timedelta(minutes=1)), '$lt': id_at(end)}}
+    started = time.perf_counter()
+    found = store.find('downloads', query, sort=[('download_id', 1)], limit=100)
+    elapsed = time.perf_counter() - started
+    store.close()
+    return len(found), elapsed * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--mongo-uri', default=os.environ.get('BENCH_MONGO_URI'))
+    args = parser.parse_args()
+
+    print(f"🆔 {args.count} inserts in batches of {BATCH}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for make_ids in (random_ids, time_ids):
+            print(f"💾 sqlite {make_ids.__name__:<11} {bench_sqlite(make_ids, args.count, workdir):10.0f} inserts/s")
+            if args.mongo_uri:
+                print(f"🍃 mongo  {make_ids.__name__:<11} {bench_mongo(make_ids, args.count, args.mongo_uri):10.0f} inserts/s")
+        found, ms = bench_range_scan(args.count, workdir)
+        print(f"🔎 last-minute range scan: {found} rows in {ms:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+"""Load test: synthetic users driving the bot's handlers end to end.
+
+Builds the real Application (build_application -> setup_handlers) against
+the fake Bot API and the fake Mega server, grants premium to --users users
+through /premium add, then has every user send the same script of
+messages at once: /start, a Mega link, /myfiles, plain text, a second
+link. Links are drawn from --files files with a fixed --seed, so repeats
+exercise the file cache and runs are comparable.
+
+Each storage backend runs in its own process, so memory figures are not
+shared between them. Reported per backend: p50/p99 handler latency,
+messages/s through the handlers, MB/s downloaded until the queue drains,
+and peak RSS. The first user starts with LEGACY_FILES files stored the
+way the pre-queue bot saved them (downloaded_at 'now()'). The run fails
+if /stats disagrees with itself (last-hour rollups vs all-time counters)
+or /myfiles does not list those files. --output saves the results as JSON;
+--compare flags any figure more than --tolerance worse than a saved run.
+
+    python benchmarks/bench_load.py --users 50 --files 20 --size-mb 4
+    python benchmarks/bench_load.py --backends sqlite mongo --mongo-uri mongodb://localhost
+
+Without --mongo-uri the mongo backend runs against mongomock, which
+exercises the bot's MongoDB code paths but not a real server's speed.
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import itertools
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_mega import FakeMegaServer  # noqa: E402
+from fake_telegram import FakeBotApi  # noqa: E402
+
+BACKENDS = ('sqlite', 'json', 'mongo')
+OWNER_ID = 1
+FIRST_USER_ID = 1000
+STATS_CHECKED = ('queued', 'completed', 'failed', 'cache_hits', 'bytes')
+LEGACY_FILES = 3
+# name -> True when a larger value is worse
+FIGURES = {'p50_ms': True, 'p99_ms': True, 'messages_per_s': False, 'download_mb_s': False, 'peak_rss_mb': True}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class UpdateFactory:
+    """Telegram Update payloads for synthetic users"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+
+    def message(self, user_id, text):
+        from telegram import Update
+
+        data = {
+            'update_id': next(self.update_ids),
+            'message': {
+                'message_id': next(self.message_ids),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}",
+                         'username': f"user{user_id}"},
+                'text': text,
+            }
+        }
+        if text.startswith('/'):
+            command = text.split()[0]
+            data['message']['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        return Update.de_json(data, self.bot)
+
+
+def legacy_files():
+    """user_files rows as the original bot wrote them"""
+    return [{'user_id': FIRST_USER_ID, 'file_name': f"Legacy {index}.zip", 'file_size': '150MB',
+             'download_id': f"LEG{index:05d}", 'downloaded_at': 'now()', 'active': True}
+            for index in range(LEGACY_FILES)]
+
+
+def seed_legacy_files(args, db_name):
+    if args.backend == 'mongo':
+        import pymongo
+        pymongo.MongoClient(args.mongo_uri)[db_name].user_files.insert_many(legacy_files())
+        return
+    # Read by the JSON backend, migrated by the SQLite one
+    os.makedirs('data', exist_ok=True)
+    with open(os.path.join('data', 'user_files.json'), 'w') as f:
+        json.dump(legacy_files(), f)
+
+
+def user_script(links, rng):
+    return ['/start', rng.choice(links), '/myfiles', 'hello', rng.choice(links)]
+
+
+async def drive(args, mega, telegram):
+    import bot as botmod
+
+    bot = botmod.SimpleCourseBot()
+    application = botmod.build_application(bot)
+    await application.initialize()
+    await bot.post_init(application)
+    updates = UpdateFactory(application.bot)
+
+    links = [mega.add_file(f"LOAD{index:04d}", args.size_mb * 1024 * 1024).link for index in range(args.files)]
+    users = range(FIRST_USER_ID, FIRST_USER_ID + args.users)
+    for user_id in users:
+        await application.process_update(updates.message(OWNER_ID, f"/premium add {user_id}"))
+
+    rng = random.Random(args.seed)
+    scripts = {user_id: user_script(links, rng) for user_id in users}
+    latencies = []
+
+    async def run_user(user_id):
+        for text in scripts[user_id]:
+            update = updates.message(user_id, text)
+            started = time.perf_counter()
+            await application.process_update(update)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(user_id) for user_id in users))
+    handled = time.perf_counter() - started
+    while bot.queue.running or bot.queue.waiting:
+        await asyncio.sleep(0.05)
+    drained = time.perf_counter() - started
+
+    downloaded = sum(mega.transferred.values())
+    summary = await bot.stats.summary()
+    legacy_text, _ = await bot._files_page(FIRST_USER_ID, 'Legacy', LEGACY_FILES)
+    await bot.shutdown(application)
+    await application.shutdown()
+    return {
+        'messages': len(latencies),
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'messages_per_s': len(latencies) / handled,
+        'downloaded_mb': downloaded / (1024 * 1024),
+        'uploaded_mb': telegram.uploaded / (1024 * 1024),
+        'download_mb_s': downloaded / (1024 * 1024) / drained,
+        'seconds': drained,
+        'api_calls': sum(telegram.calls.values()),
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        # /stats consistency: a fresh store's last hour must hold every event counted
+        'stats_totals': {name: summary['totals'].get(name, 0) for name in STATS_CHECKED},
+        'stats_last_hour': {name: summary['last_hour'].get(name, 0) for name in STATS_CHECKED},
+        'legacy_files_listed': legacy_text.count('📁 Legacy'),
+    }
+
+
+def mongomock_installed():
+    try:
+        import mongomock  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def mock_mongo(args):
+    """Patch pymongo with mongomock when the mongo backend has no --mongo-uri"""
+    if args.backend != 'mongo' or args.mongo_uri:
+        return contextlib.nullcontext()
+    import mongomock
+    args.mongo_uri = 'mongodb://localhost:27017'
+    return mongomock.patch(servers=(('localhost', 27017),))
+
+
+def run_backend(args):
+    """Child process: one backend, result printed as a JSON line"""
+    with mock_mongo(args):
+        _run_backend(args)
+
+
+def _run_backend(args):
+    mega = FakeMegaServer(bandwidth=int(args.bandwidth_mbps * 1024 * 1024) or None).start()
+    telegram = FakeBotApi(latency=args.api_latency).start()
+    db_name = f"bench_load_{os.getpid()}"
+    os.environ.update({
+        'BOT_TOKEN': '123456:BENCH',
+        'OWNER_ID': str(OWNER_ID),
+        'ADMINS': '',
+        'BOT_API_URL': f"{telegram.url}/bot",
+        'BOT_API_LOCAL_MODE': 'false',
+        'MEGA_API_URL': mega.url,
+        'MEGA_EMAIL': '',
+        'MEGA_ACCOUNTS': '',
+        'MONGO_URI': args.mongo_uri if args.backend == 'mongo' else '',
+        'DB_NAME': db_name,
+        'LOCAL_DB_BACKEND': args.backend if args.backend != 'mongo' else 'sqlite',
+        'MONGO_HEALTH_INTERVAL': '0',
+        'DOWNLOAD_WORKERS': str(args.workers),
+        'DOWNLOADS_PER_USER': '1',
+    })
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)  # data/ and downloads/ are relative
+        try:
+            seed_legacy_files(args, db_name)
+            result = asyncio.run(drive(args, mega, telegram))
+        finally:
+            os.chdir(ROOT)
+            mega.stop()
+            telegram.stop()
+            if args.backend == 'mongo':
+                import pymongo
+                pymongo.MongoClient(args.mongo_uri).drop_database(db_name)
+    print(json.dumps(result))
+
+
+def spawn(backend, argv):
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), *argv, '--backend', backend],
+        capture_output=True, text=True
+    )
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode or not lines:
+        print(f"❌ {backend} failed:\n{completed.stderr[-2000:]}")
+        return None
+    return json.loads(lines[-1])
+
+
+def compare(results, baseline, tolerance):
+    """Print figures that got worse than the baseline by more than ``tolerance``"""
+    regressions = 0
+    for backend, result in results.items():
+        for name, higher_is_worse in FIGURES.items():
+            old = baseline.get(backend, {}).get(name)
+            if not old:
+                continue
+            change = (result[name] - old) / old
+            if (change if higher_is_worse else -change) > tolerance:
+                regressions += 1
+                print(f"⚠️ {backend} {name}: {old:.1f} -> {result[name]:.1f} ({change:+.0%})")
+    if not regressions:
+        print(f"✅ No figure worse than the baseline by more than {tolerance:.0%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--files', type=int, default=20, help='distinct files the links are drawn from')
+    parser.add_argument('--size-mb', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=3, help='DOWNLOAD_WORKERS')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--bandwidth-mbps', type=float, default=0,
+                        help='per-connection cap on the fake Mega server in MB/s')
+    parser.add_argument('--api-latency', type=float, default=0.0,
+                        help='seconds of delay on every Bot API call')
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument('--mongo-uri', default=os.environ.get('BENCH_MONGO_URI'))
+    parser.add_argument('--output', help='save results to this JSON file')
+    parser.add_argument('--compare', help='JSON file from an earlier --output run')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--backend', choices=BACKENDS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.backend:
+        run_backend(args)
+        return
+
+    argv = sys.argv[1:]
+    print(f"👥 {args.users} users x {len(user_script([''], random.Random()))} messages, "
+          f"{args.files} files of {args.size_mb}MB, {args.workers} download workers")
+    print(f"{'backend':<8} {'p50 ms':>8} {'p99 ms':>8} {'msg/s':>8} {'MB/s':>8} {'peak RSS':>9}")
+    results = {}
+    failures = 0
+    for backend in args.backends:
+        if backend == 'mongo' and not args.mongo_uri and not mongomock_installed():
+            print(f"{backend:<8} skipped (no --mongo-uri and mongomock is not installed)")
+            continue
+        result = spawn(backend, argv)
+        if result is None:
+            continue
+        results[backend] = result
+        print(f"{backend:<8} {result['p50_ms']:8.1f} {result['p99_ms']:8.1f} {result['messages_per_s']:8.0f} "
+              f"{result['download_mb_s']:8.1f} {result['peak_rss_mb']:8.0f}M")
+        if result['stats_last_hour'] != result['stats_totals']:
+            failures += 1
+            print(f"❌ {backend} /stats last hour {result['stats_last_hour']} != totals {result['stats_totals']}")
+        if result['legacy_files_listed'] != LEGACY_FILES:
+            failures += 1
+            print(f"❌ {backend} /myfiles listed {result['legacy_files_listed']} of {LEGACY_FILES} legacy files")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'date': datetime.datetime.now().isoformat(), 'args': vars(args), 'results': results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        failures += compare(results, baseline, args.tolerance)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+"""Local fake of the Mega API and file CDN for offline benchmarks.
+
+Files are generated from a seed instead of stored, and every range request is
+encrypted on the fly, so multi-GB files cost no disk or memory here.
+
+    python benchmarks/fake_mega.py --size-mb 512 --port 8088
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from Crypto.Cipher import AES
+from Crypto.Util import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mega_downloader import (  # noqa: E402
+    ChunkMac, a32_to_bytes, base64_url_encode, bytes_to_a32, condense_macs, get_chunks
+)
+
+PATTERN_SIZE = 1024 * 1024
+RANGE_RE = re.compile(r'^/dl/([\w-]+)(?:~([\w-]+))?(?:/(\d+)-(\d+))?$')
+ANONYMOUS = 'anon'
+
+
+class FakeFile:
+    """Deterministic plaintext with a real Mega key, IV and meta-MAC"""
+
+    def __init__(self, handle, size, name=None, seed=0):
+        self.handle = handle
+        self.size = size
+        self.name = name or f"{handle}.bin"
+        digest = hashlib.sha256(f"{handle}:{seed}".encode()).digest()
+        self.k = bytes_to_a32(digest[:16])
+        self.iv = bytes_to_a32(digest[16:24])
+        self.pattern = (digest * (PATTERN_SIZE // len(digest) + 1))[:PATTERN_SIZE]
+        self.aes_key = a32_to_bytes(self.k)
+        self.meta_mac = self._meta_mac()
+        k, iv, mac = self.k, self.iv, self.meta_mac
+        self.key = (k[0] ^ iv[0], k[1] ^ iv[1], k[2] ^ mac[0], k[3] ^ mac[1],
+                    iv[0], iv[1], mac[0], mac[1])
+
+    @property
+    def link(self):
+        return f"https://mega.nz/file/{self.handle}#{base64_url_encode(a32_to_bytes(self.key))}"
+
+    def plaintext(self, start, end):
+        """Yield plaintext blocks covering [start, end)"""
+        offset = start
+        while offset < end:
+            pos = offset % PATTERN_SIZE
+            block = self.pattern[pos:pos + min(end - offset, PATTERN_SIZE - pos)]
+            yield block
+            offset += len(block)
+
+    def _meta_mac(self):
+        mac = ChunkMac(self.aes_key, self.iv, list(get_chunks(self.size)))
+        for block in self.plaintext(0, self.size):
+            mac.update(block)
+        return condense_macs(mac.macs, self.aes_key)
+
+    def encrypted(self, start, end):
+        counter = Counter.new(64, prefix=a32_to_bytes(self.iv), initial_value=start // 16)
+        cipher = AES.new(self.aes_key, AES.MODE_CTR, counter=counter)
+        # CTR ranges must begin on a block boundary; skip the lead-in bytes
+        skip = start % 16
+        for block in self.plaintext(start - skip, end):
+            data = cipher.encrypt(block)
+            if skip:
+                data, skip = data[skip:], 0
+            yield data
+
+    def attributes(self):
+        attr = b'MEGA' + json.dumps({'n': self.name}).encode()
+        attr += b'\0' * (-len(attr) % 16)
+        return base64_url_encode(AES.new(self.aes_key, AES.MODE_CBC, b'\0' * 16).encrypt(attr))
+
+
+def encrypt_attr(attr, key):
+    data = b'MEGA' + json.dumps(attr).encode()
+    data += b'\0' * (-len(data) % 16)
+    return base64_url_encode(AES.new(a32_to_bytes(key), AES.MODE_CBC, b'\0' * 16).encrypt(data))
+
+
+class FakeFolder:
+    """A public folder link over FakeFiles, optionally nested one level"""
+
+    def __init__(self, handle, name, files, subfolders=None):
+        self.handle = handle
+        self.name = name
+        digest = hashlib.sha256(f"folder:{handle}".encode()).digest()
+        self.master_key = bytes_to_a32(digest[:16])
+        self.files = files
+        self.subfolders = subfolders or {}  # folder name -> [FakeFile]
+
+    @property
+    def link(self):
+        return f"https://mega.nz/folder/{self.handle}#{base64_url_encode(a32_to_bytes(self.master_key))}"
+
+    def _node_key(self, key):
+        cipher = AES.new(a32_to_bytes(self.master_key), AES.MODE_ECB)
+        return f"{self.handle}:{base64_url_encode(cipher.encrypt(a32_to_bytes(key)))}"
+
+    def nodes(self):
+        root_key = self.master_key
+        nodes = [{'h': self.handle, 'p': 'ROOT', 't': 1, 'a': encrypt_attr({'n': self.name}, root_key),
+                  'k': self._node_key(root_key)}]
+        groups = [(self.handle, self.files)]
+        for index, (name, files) in enumerate(sorted(self.subfolders.items())):
+            handle = f"{self.handle}d{index}"
+            nodes.append({'h': handle, 'p': self.handle, 't': 1,
+                          'a': encrypt_attr({'n': name}, root_key), 'k': self._node_key(root_key)})
+            groups.append((handle, files))
+        for parent, files in groups:
+            for fake in files:
+                nodes.append({'h': fake.handle, 'p': parent, 't': 0, 's': fake.size,
+                              'a': fake.attributes(), 'k': self._node_key(fake.key)})
+        return nodes
+
+    def all_files(self):
+        return self.files + [fake for files in self.subfolders.values() for fake in files]
+
+
+class FakeAccount:
+    """A v2 login whose session tsid the client can verify"""
+
+    def __init__(self, email, password, quota=None):
+        self.email = email
+        self.salt = hashlib.sha256(f"salt:{email}".encode()).digest()
+        derived = hashlib.pbkdf2_hmac('sha512', password.encode(), self.salt, 100000, 32)
+        self.password_key = derived[:16]
+        self.user_hash = base64_url_encode(derived[16:])
+        self.master_key = hashlib.sha256(f"master:{email}".encode()).digest()[:16]
+        check = os.urandom(16)
+        self.tsid = base64_url_encode(check + AES.new(self.master_key, AES.MODE_ECB).encrypt(check))
+        self.quota = quota
+
+    def login(self):
+        k = AES.new(self.password_key, AES.MODE_ECB).encrypt(self.master_key)
+        return {'k': base64_url_encode(k), 'tsid': self.tsid}
+
+
+class FakeMegaServer:
+    """Threaded HTTP server speaking enough of the Mega protocol for downloads"""
+
+    def __init__(self, host='127.0.0.1', port=0, bandwidth=None, latency=0.0):
+        self.files = {}
+        self.folders = {}
+        self.bandwidth = bandwidth  # bytes/s per connection, None = unlimited
+        self.latency = latency
+        self.requests = 0
+        self.accounts = {}  # email -> FakeAccount
+        self.quotas = {}  # session (tsid or 'anon') -> bytes it may transfer, missing = unlimited
+        self.transferred = {}  # session -> bytes served
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def add_file(self, handle, size, name=None):
+        fake = FakeFile(handle, size, name)
+        self.files[handle] = fake
+        return fake
+
+    def add_folder(self, handle, name, files, subfolders=None):
+        """files/subfolders are FakeFiles made with add_file"""
+        folder = FakeFolder(handle, name, files, subfolders)
+        self.folders[handle] = folder
+        return folder
+
+    def add_account(self, email, password, quota=None):
+        account = FakeAccount(email, password, quota)
+        self.accounts[email] = account
+        if quota is not None:
+            self.quotas[account.tsid] = quota
+        return account
+
+    def _charge(self, session, count):
+        """Count served bytes; False once the session is over its quota"""
+        with self.lock:
+            used = self.transferred.get(session, 0)
+            if used + count > self.quotas.get(session, float('inf')):
+                return False
+            self.transferred[session] = used + count
+            return True
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def handle(self):
+                try:
+                    super().handle()
+                except ConnectionError:
+                    pass  # client went away mid-range (cancelled or retried)
+
+            def _json(self, payload, status=200):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                server.requests += 1
+                length = int(self.headers.get('Content-Length', 0))
+                commands = json.loads(self.rfile.read(length) or b'[]')
+                if urlparse(self.path).path != '/cs':
+                    return self._json(-2, 404)
+                self._json([server.api_command(command, self) for command in commands])
+
+            def do_GET(self):
+                server.requests += 1
+                match = RANGE_RE.match(urlparse(self.path).path)
+                fake = server.files.get(match.group(1)) if match else None
+                if not fake:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                start = int(match.group(3) or 0)
+                end = int(match.group(4)) + 1 if match.group(4) else fake.size
+                end = min(end, fake.size)
+                if not server._charge(match.group(2) or ANONYMOUS, end - start):
+                    self.send_response(509)  # bandwidth limit exceeded
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if server.latency:
+                    time.sleep(server.latency)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(end - start))
+                self.end_headers()
+                sent_at = time.monotonic()
+                sent = 0
+                try:
+                    for block in fake.encrypted(start, end):
+                        self.wfile.write(block)
+                        sent += len(block)
+                        if server.bandwidth:
+                            ahead = sent / server.bandwidth - (time.monotonic() - sent_at)
+                            if ahead > 0:
+                                time.sleep(ahead)
+                except ConnectionError:
+                    pass
+
+        return Handler
+
+    def api_command(self, command, handler):
+        query = parse_qs(urlparse(handler.path).query)
+        folder = self.folders.get(query.get('n', [None])[0])
+        session = query.get('sid', [ANONYMOUS])[0]
+        if command.get('a') == 'us0':
+            account = self.accounts.get(command.get('user'))
+            return {'v': 2, 's': base64_url_encode(account.salt)} if account else {'v': 2, 's': ''}
+        if command.get('a') == 'us':
+            account = self.accounts.get(command.get('user'))
+            if not account or command.get('uh') != account.user_hash:
+                return -9
+            return account.login()
+        if command.get('a') == 'uq':
+            quota = self.quotas.get(session)
+            if quota is None:
+                return {}
+            return {'mxfer': quota, 'caxfer': self.transferred.get(session, 0), 'csxfer': 0}
+        if command.get('a') == 'g' and session != ANONYMOUS and session not in (
+                account.tsid for account in self.accounts.values()):
+            return -15  # ESID
+        if command.get('a') == 'f':
+            return {'f': folder.nodes()} if folder else -9
+        if command.get('a') == 'g' and folder:
+            fake = next((f for f in folder.all_files() if f.handle == command.get('n')), None)
+            if not fake:
+                return -9
+            return {'s': fake.size, 'at': fake.attributes(), 'g': f"{self.url}/dl/{fake.handle}~{session}"}
+        if command.get('a') == 'g':
+            fake = self.files.get(command.get('p'))
+            if not fake:
+                return -9  # ENOENT
+            return {'s': fake.size, 'at': fake.attributes(), 'g': f"{self.url}/dl/{fake.handle}~{session}"}
+        return -2  # EARGS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8088)
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--bandwidth-mbps', type=float, default=0,
+                        help='per-connection cap in MB/s (0 = unlimited)')
+    args = parser.parse_args()
+
+    bandwidth = int(args.bandwidth_mbps * 1024 * 1024) or None
+    server = FakeMegaServer(args.host, args.port, bandwidth=bandwidth)
+    fake = server.add_file('BENCH000', args.size_mb * 1024 * 1024)
+    print(f"🧪 Fake Mega API: {server.url}  (set MEGA_API_URL to this)")
+    print(f"🔗 {fake.link}")
+    server.httpd.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""Local fake of the Telegram Bot API for offline load tests.
+
+Answers the methods the bot calls with well-formed results, reads and
+counts uploaded documents, and keeps per-method call counts. Point the bot
+at it with BOT_API_URL=<url>/bot and BOT_API_LOCAL_MODE=false so uploads
+are sent as multipart data, as they are against api.telegram.org.
+
+    python benchmarks/fake_telegram.py --port 8081
+"""
+import argparse
+import collections
+import email
+import email.policy
+import itertools
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PATH_RE = re.compile(r'^/bot([^/]+)/(\w+)$')
+
+
+def parse_body(content_type, body):
+    """Request parameters -> (fields, {field: uploaded bytes})"""
+    if content_type.startswith('multipart/form-data'):
+        message = email.message_from_bytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body, policy=email.policy.HTTP
+        )
+        fields, files = {}, {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            payload = part.get_payload(decode=True) or b''
+            if part.get_filename():
+                files[name] = payload
+            else:
+                fields[name] = payload.decode()
+        return fields, files
+    if content_type.startswith('application/json'):
+        return {k: v if isinstance(v, str) else json.dumps(v) for k, v in json.loads(body or b'{}').items()}, {}
+    return {k: v[0] for k, v in parse_qs(body.decode()).items()}, {}
+
+
+class FakeBotApi:
+    """Threaded HTTP server speaking enough of the Bot API for the bot's handlers"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, username='bench_bot'):
+        self.latency = latency  # seconds added to every call
+        self.username = username
+        self.calls = collections.Counter()  # method -> count
+        self.uploaded = 0  # document bytes received
+        self.documents = {}  # file_id -> size
+        self.message_ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _message(self, fields, **extra):
+        chat_id = fields.get('chat_id', '0')
+        message = {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id) if chat_id.lstrip('-').isdigit() else 0, 'type': 'private'},
+        }
+        if 'text' in fields:
+            message['text'] = fields['text']
+        message.update(extra)
+        return message
+
+    def _document(self, fields, files):
+        upload = files.get('document')
+        with self.lock:
+            if upload is None:
+                # Resend by file_id
+                file_id = fields.get('document', '')
+                size = self.documents.get(file_id, 0)
+            else:
+                file_id = f"BENCH{len(self.documents):08d}"
+                size = len(upload)
+                self.documents[file_id] = size
+                self.uploaded += size
+        return {'file_id': file_id, 'file_unique_id': file_id, 'file_size': size,
+                'file_name': fields.get('filename', file_id)}
+
+    def api_call(self, method, fields, files):
+        with self.lock:
+            self.calls[method] += 1
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': self.username,
+                    'can_join_groups': False, 'can_read_all_group_messages': False,
+                    'supports_inline_queries': False}
+        if method in ('sendMessage', 'editMessageText'):
+            return self._message(fields)
+        if method == 'sendDocument':
+            return self._message(fields, document=self._document(fields, files))
+        if method == 'copyMessage':
+            return {'message_id': next(self.message_ids)}
+        if method == 'getFile':
+            file_id = fields.get('file_id', '')
+            return {'file_id': file_id, 'file_unique_id': file_id,
+                    'file_size': self.documents.get(file_id, 0), 'file_path': f"documents/{file_id}"}
+        return True
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, payload, status=200):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                match = PATH_RE.match(urlparse(self.path).path)
+                if not match:
+                    self._json({'ok': False, 'error_code': 404, 'description': 'Not Found'}, 404)
+                    return
+                if server.latency:
+                    time.sleep(server.latency)
+                fields, files = parse_body(self.headers.get('Content-Type', ''), body)
+                self._json({'ok': True, 'result': server.api_call(match.group(2), fields, files)})
+
+            do_GET = do_POST
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds of delay before each response')
+    args = parser.parse_args()
+
+    server = FakeBotApi(args.host, args.port, latency=args.latency)
+    print(f"🧪 Fake Bot API: {server.url}/bot  (set BOT_API_URL to this and BOT_API_LOCAL_MODE=false)")
+    server.httpd.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
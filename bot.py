@@ -1,10 +1,30 @@
 import os
 import logging
 import asyncio
-from telegram import Update, InputFile
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext
+import datetime
+import time
+import uuid
+from telegram import Update, InputFile, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from telegram.ext import Application, CallbackQueryHandler, CommandHandler, MessageHandler, filters, CallbackContext
 from config import Config
-from database import MongoDB
+from database import MongoDB, AsyncMongoDB, LEGACY_DATE, RESUMABLE_STATUSES
+from broadcast import Broadcaster
+from download_queue import DownloadBatch, DownloadQueue
+from file_cache import FileCache
+from premium import PremiumCache
+import metrics
+from metrics import IN_FLIGHT, QUEUE_WAITING, STAGE_SECONDS, TRANSFER_BYTES, instrument_handler, upload_stage
+from stats import StatsRecorder, average_speed, failure_rate
+from progress import ProgressReporter, SpeedMeter, progress_text
+from mega_accounts import AccountPool
+from mega_downloader import (
+    MegaDownloader, MegaError, MegaQuotaError, DownloadProgress, DownloadState, SplitSink,
+    extract_mega_links, folder_file_link, is_partial_file, link_id, parse_mega_folder, plan_segments
+)
+from uploader import ChannelFanout, PartUploader, open_document, send_document
+from ids import id_timestamp
+from utils import human_size, format_eta
 
 # Setup logging
 logging.basicConfig(
@@ -13,13 +33,32 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class QuietStatus:
+    """Stands in for a per-file status message that should stay silent"""
+    
+    async def edit_text(self, text, **kwargs):
+        return self
+
+
 class SimpleCourseBot:
     def __init__(self):
         self.config = Config()
-        self.db = MongoDB()
+        metrics.configure(self.config)
+        self.db = AsyncMongoDB(MongoDB(self.config))
+        self.downloader = MegaDownloader(self.config)
+        self.accounts = AccountPool(self.db, self.config, self.downloader)
+        self.broadcaster = Broadcaster(self.db, self.config)
+        self.queue = DownloadQueue(self.db, self.config, self.run_download)
+        self.file_cache = FileCache(self.db, self.config)
+        self.uploader = PartUploader(self.db, self.config.BOT_API_LOCAL_MODE)
+        self.fanout = ChannelFanout(self.db, self.config)
+        self.reporter = ProgressReporter(self.config.PROGRESS_INTERVAL, self.config.PROGRESS_EDIT_RATE)
+        self.application = None
+        self.background_tasks = set()
+        self.batches = {}  # batch_id -> DownloadBatch of a folder or link list being downloaded
         
-        # For testing - simple premium users list
-        self.premium_users = [self.config.OWNER_ID] + self.config.ADMINS
+        self.premium_users = PremiumCache(self.db, self.config)
+        self.stats = StatsRecorder(self.db, self.config)
         
         print("🤖 Bot initialized successfully!")
     
@@ -28,7 +67,7 @@ class SimpleCourseBot:
         user_id = user.id
         
         # Save user to database
-        self.db.save_user({
+        await self.db.save_user({
             'user_id': user_id,
             'first_name': user.first_name,
             'username': user.username,
@@ -42,6 +81,7 @@ class SimpleCourseBot:
                 "💎 /premium - Manage premium users\n"
                 "📢 /broadcast - Broadcast message\n"
                 "📊 /stats - Bot statistics\n"
+                "🕒 /history - Recent downloads\n"
                 "📁 /myfiles - Your downloaded files\n"
                 "🔗 /add_channel - Add upload channel"
             )
@@ -51,6 +91,7 @@ class SimpleCourseBot:
                 "Welcome! Admin commands available.\n\n"
                 "💎 /premium - Manage users\n"
                 "📊 /stats - Statistics\n"
+                "🕒 /history - Recent downloads\n"
                 "👑 Owner: @" + self.config.OWNER_USERNAME
             )
         elif user_id in self.premium_users:
@@ -62,7 +103,8 @@ class SimpleCourseBot:
                 "• Get files in your storage\n"
                 "• Auto upload to channels\n\n"
                 "💡 **Just send any Mega.nz link to start!**\n\n"
-                "📁 /myfiles - Your downloaded files"
+                "📁 /myfiles - Your downloaded files\n"
+                "📥 /queue - Your download queue"
             )
         else:
             await update.message.reply_text(
@@ -88,16 +130,14 @@ class SimpleCourseBot:
         
         if not context.args:
             # Show premium management panel
-            premium_count = len([u for u in self.premium_users if u not in [self.config.OWNER_ID] + self.config.ADMINS])
-            
             premium_text = f"""
 💎 **PREMIUM USER MANAGEMENT**
 
 👑 **Owner:** @{self.config.OWNER_USERNAME}
-📊 **Total Premium Users:** {premium_count}
+📊 **Total Premium Users:** {self.premium_users.count}
 
 🛠 **Commands:**
-/premium add <user_id> - Add premium user
+/premium add <user_id> [days] - Add premium user
 /premium remove <user_id> - Remove premium user
 /premium list - List all premium users
 /premium check <user_id> - Check user status
@@ -110,17 +150,12 @@ class SimpleCourseBot:
         if action == 'add' and len(context.args) >= 2:
             try:
                 target_user_id = int(context.args[1])
+                days = int(context.args[2]) if len(context.args) >= 3 else None
                 if target_user_id not in self.premium_users:
-                    self.premium_users.append(target_user_id)
-                    
-                    # Save to database
-                    self.db.save_premium_user({
-                        'user_id': target_user_id,
-                        'added_by': user_id,
-                        'added_date': 'now()',
-                        'active': True,
-                        'downloads_count': 0
-                    })
+                    expires_at = datetime.datetime.now() + datetime.timedelta(days=days) if days else None
+                    if not await self.premium_users.grant(target_user_id, user_id, expires_at):
+                        await update.message.reply_text("❌ Could not save premium access, try again.")
+                        return
                     
                     # Try to notify the user
                     try:
@@ -144,18 +179,18 @@ You've been granted **PREMIUM ACCESS** to the course bot!
                     except:
                         pass
                     
-                    await update.message.reply_text(f"✅ Premium access granted to user {target_user_id}")
+                    duration = f" for {days} days" if days else ""
+                    await update.message.reply_text(f"✅ Premium access granted to user {target_user_id}{duration}")
                 else:
                     await update.message.reply_text("✅ User already has premium access")
             except ValueError:
-                await update.message.reply_text("❌ Invalid user ID. Please provide a numeric ID.")
+                await update.message.reply_text("❌ Invalid user ID or days. Please provide numbers.")
         
         elif action == 'remove' and len(context.args) >= 2:
             try:
                 target_user_id = int(context.args[1])
-                if target_user_id in self.premium_users and target_user_id not in [self.config.OWNER_ID] + self.config.ADMINS:
-                    self.premium_users.remove(target_user_id)
-                    self.db.deactivate_premium_user(target_user_id)
+                if target_user_id in self.premium_users and target_user_id not in self.premium_users.staff:
+                    await self.premium_users.revoke(target_user_id)
                     await update.message.reply_text(f"✅ Premium access removed from user {target_user_id}")
                 else:
                     await update.message.reply_text("❌ User not found or cannot remove owner/admin")
@@ -163,26 +198,15 @@ You've been granted **PREMIUM ACCESS** to the course bot!
                 await update.message.reply_text("❌ Invalid user ID")
         
         elif action == 'list':
-            premium_text = "📋 **Premium Users:**\n\n"
-            
-            for user_id in self.premium_users:
-                user_info = self.db.get_user(user_id) or {}
-                username = user_info.get('username', 'N/A')
-                
-                if user_id == self.config.OWNER_ID:
-                    premium_text += f"👑 Owner: @{username} (ID: {user_id})\n"
-                elif user_id in self.config.ADMINS:
-                    premium_text += f"⚡ Admin: @{username} (ID: {user_id})\n"
-                else:
-                    premium_text += f"💎 User: @{username} (ID: {user_id})\n"
-            
-            await update.message.reply_text(premium_text)
+            premium_text, markup = await self._premium_page()
+            await update.message.reply_text(premium_text, reply_markup=markup)
         
         elif action == 'check' and len(context.args) >= 2:
             try:
                 target_user_id = int(context.args[1])
                 is_premium = target_user_id in self.premium_users
-                user_info = self.db.get_user(target_user_id) or {}
+                expires_at = self.premium_users.expires_at(target_user_id)
+                user_info = await self.db.get_user(target_user_id) or {}
                 
                 check_text = f"""
 📋 **User Check**
@@ -190,11 +214,71 @@ You've been granted **PREMIUM ACCESS** to the course bot!
 🆔 **User ID:** {target_user_id}
 👤 **Username:** @{user_info.get('username', 'N/A')}
 💎 **Premium Status:** {'✅ ACTIVE' if is_premium else '❌ INACTIVE'}
+⏳ **Expires:** {f"{expires_at:%Y-%m-%d %H:%M}" if is_premium and expires_at else 'never' if is_premium else '-'}
 """
                 await update.message.reply_text(check_text)
             except ValueError:
                 await update.message.reply_text("❌ Invalid user ID")
     
+    async def premium_page_callback(self, update: Update, context: CallbackContext):
+        """Next/previous buttons of /premium list"""
+        query = update.callback_query
+        if query.from_user.id not in self.config.ADMINS:
+            await query.answer("❌ Admin access required.")
+            return
+        _, direction, cursor = query.data.split(':')
+        if direction == 'next':
+            premium_text, markup = await self._premium_page(after_id=int(cursor))
+        else:
+            premium_text, markup = await self._premium_page(before_id=int(cursor))
+        await query.answer()
+        try:
+            await query.edit_message_text(premium_text, reply_markup=markup)
+        except BadRequest:
+            pass  # same page clicked twice: "message is not modified"
+    
+    async def _premium_page(self, after_id=None, before_id=None):
+        """One page of /premium list: keyset-paginated on user_id"""
+        limit = self.config.LIST_PAGE_SIZE
+        rows = await self.db.get_premium_users_page(after_id, before_id, limit + 1)
+        if before_id is not None:
+            has_prev, has_next = len(rows) > limit, True
+            rows = rows[:limit][::-1]
+        else:
+            has_prev, has_next = after_id is not None, len(rows) > limit
+            rows = rows[:limit]
+        
+        staff = [] if has_prev else self.premium_users.staff
+        member_ids = [row['user_id'] for row in rows if row['user_id'] not in self.premium_users.staff]
+        users = await self.db.get_users(staff + member_ids)
+        
+        premium_text = f"📋 **Premium Users:** {self.premium_users.count}\n\n"
+        for user_id in staff:
+            username = users.get(user_id, {}).get('username', 'N/A')
+            role = "👑 Owner" if user_id == self.config.OWNER_ID else "⚡ Admin"
+            premium_text += f"{role}: @{username} (ID: {user_id})\n"
+        for user_id in member_ids:
+            username = users.get(user_id, {}).get('username', 'N/A')
+            expires_at = self.premium_users.expires_at(user_id)
+            until = f" until {expires_at:%Y-%m-%d}" if expires_at else ""
+            premium_text += f"💎 User: @{username} (ID: {user_id}){until}\n"
+        if not staff and not member_ids:
+            premium_text += "No premium users on this page.\n"
+        
+        first = rows[0]['user_id'] if rows else after_id
+        last = rows[-1]['user_id'] if rows else before_id
+        return premium_text, self._page_buttons('premium', first if has_prev else None, last if has_next else None)
+    
+    @staticmethod
+    def _page_buttons(prefix, prev_cursor, next_cursor):
+        """Inline ◀️/▶️ buttons carrying keyset cursors, None when there is no such page"""
+        buttons = []
+        if prev_cursor is not None:
+            buttons.append(InlineKeyboardButton("◀️ Prev", callback_data=f"{prefix}:prev:{prev_cursor}"))
+        if next_cursor is not None:
+            buttons.append(InlineKeyboardButton("Next ▶️", callback_data=f"{prefix}:next:{next_cursor}"))
+        return InlineKeyboardMarkup([buttons]) if buttons else None
+    
     async def stats_command(self, update: Update, context: CallbackContext):
         """Show bot statistics"""
         user_id = update.effective_user.id
@@ -203,8 +287,41 @@ You've been granted **PREMIUM ACCESS** to the course bot!
             await update.message.reply_text("❌ Admin access required.")
             return
         
-        total_users = self.db.get_total_users()
-        premium_count = len([u for u in self.premium_users if u not in [self.config.OWNER_ID] + self.config.ADMINS])
+        summary = await self.stats.summary()
+        totals, last_hour = summary['totals'], summary['last_hour']
+        total_users = totals['users']
+        premium_count = self.premium_users.count
+        
+        indexes = await self.db.index_health()
+        healthy = sum(1 for index in indexes if index['ok'])
+        latency = await self.db.ping()
+        if self.db.is_local:
+            db_text = "💾 **Database:** local fallback"
+        elif latency is None:
+            db_text = "🔴 **Database:** MongoDB unreachable"
+        else:
+            db_text = f"🟢 **Database:** MongoDB ({latency:.0f} ms)"
+        cache = self.file_cache.stats()
+        cache_text = (
+            f"⚡ **Cache:** {cache['hits']} hits / {cache['misses']} misses ({cache['hit_rate']:.0f}%)\n"
+            f"💽 **Cached on disk:** {cache['disk_files']} files, {human_size(cache['disk_usage'])}"
+        )
+        downloads_text = (
+            f"📥 **Downloads:** {totals['completed']} done, {totals['failed']} failed "
+            f"({failure_rate(totals):.1f}% failure), {totals['queued']} queued in total\n"
+            f"📦 **Transferred:** {human_size(totals['bytes'])}, "
+            f"avg {human_size(average_speed(totals))}/s\n"
+            f"🕐 **Last hour:** {last_hour['completed']} done, {last_hour['failed']} failed, "
+            f"{human_size(last_hour['bytes'])} at {human_size(average_speed(last_hour))}/s\n"
+            f"📈 **24h traffic:** {summary['trend']}"
+        )
+        accounts_text = "🔑 **Mega quota:**\n" + '\n'.join(f"   {line}" for line in self.accounts.status())
+        index_text = f"🗂 **Indexes:** {healthy}/{len(indexes)} healthy"
+        for index in indexes:
+            if not index['ok']:
+                index_text += f"\n   ⚠️ {index['collection']}.{index['index']}"
+                if index['error']:
+                    index_text += f" ({index['error'][:80]})"
         
         stats_text = f"""
 📊 **BOT STATISTICS**
@@ -214,6 +331,14 @@ You've been granted **PREMIUM ACCESS** to the course bot!
 ⚡ **Admins:** {len(self.config.ADMINS)}
 👑 **Owner:** @{self.config.OWNER_USERNAME}
 
+{downloads_text}
+
+{cache_text}
+{accounts_text}
+
+{db_text}
+{index_text}
+
 🤖 **Bot:** @{self.config.BOT_USERNAME}
 """
         await update.message.reply_text(stats_text)
@@ -226,9 +351,11 @@ You've been granted **PREMIUM ACCESS** to the course bot!
             await update.message.reply_text(f"❌ Premium feature. Contact @{self.config.OWNER_USERNAME} for access.")
             return
         
-        user_files = self.db.get_user_files(user_id)
+        search = ' '.join(context.args).strip() or None
+        context.user_data['files_search'] = search
+        total = await self.db.count_user_files(user_id, search)
         
-        if not user_files:
+        if not total and not search:
             await update.message.reply_text("""
 📭 **Your File Storage**
 
@@ -243,19 +370,180 @@ You haven't downloaded any files yet.
             """)
             return
         
+        files_text, markup = await self._files_page(user_id, search, total)
+        await update.message.reply_text(files_text, reply_markup=markup)
+    
+    async def files_page_callback(self, update: Update, context: CallbackContext):
+        """Next/previous buttons of /myfiles"""
+        query = update.callback_query
+        user_id = query.from_user.id
+        if user_id not in self.premium_users:
+            await query.answer("❌ Premium feature.")
+            return
+        _, direction, cursor = query.data.split(':', 2)
+        search = context.user_data.get('files_search')
+        total = await self.db.count_user_files(user_id, search)
+        downloaded_at, download_id = cursor.split('|', 1)
+        try:
+            cursor = (datetime.datetime.fromisoformat(downloaded_at), download_id)
+        except ValueError:
+            direction, cursor = 'next', None  # unreadable cursor: back to the first page
+        if direction == 'next':
+            files_text, markup = await self._files_page(user_id, search, total, after=cursor)
+        else:
+            files_text, markup = await self._files_page(user_id, search, total, before=cursor)
+        await query.answer()
+        try:
+            await query.edit_message_text(files_text, reply_markup=markup)
+        except BadRequest:
+            pass  # same page clicked twice: "message is not modified"
+    
+    async def _files_page(self, user_id, search, total, after=None, before=None):
+        """One page of /myfiles, newest first, keyset-paginated on (downloaded_at, download_id)"""
+        limit = self.config.LIST_PAGE_SIZE
+        rows = await self.db.get_user_files_page(user_id, after, before, search, limit + 1)
+        if before is not None:
+            has_prev, has_next = len(rows) > limit, True
+            rows = rows[:limit][::-1]
+        else:
+            has_prev, has_next = after is not None, len(rows) > limit
+            rows = rows[:limit]
+        
         files_text = f"📚 **Your Downloaded Files**\n\n"
-        files_text += f"📊 **Total Files:** {len(user_files)}\n\n"
+        if search:
+            files_text += f"🔎 **Search:** {search}\n"
+        files_text += f"📊 **Total Files:** {total}\n\n"
+        if not rows:
+            files_text += "No files match.\n" if search else "No more files.\n"
         
-        for i, file_info in enumerate(user_files[:5], 1):
-            files_text += f"{i}. 📁 {file_info.get('file_name', 'Unknown')}\n"
-            files_text += f"   📅 {file_info.get('downloaded_at', 'Unknown')}\n\n"
+        for file_info in rows:
+            downloaded_at = file_info.get('downloaded_at')
+            if isinstance(downloaded_at, str):
+                try:
+                    downloaded_at = datetime.datetime.fromisoformat(downloaded_at)
+                except ValueError:
+                    downloaded_at = None
+            if downloaded_at == LEGACY_DATE:
+                downloaded_at = None
+            files_text += f"📁 {file_info.get('file_name', 'Unknown')}\n"
+            files_text += f"   📅 {f'{downloaded_at:%Y-%m-%d %H:%M}' if downloaded_at else 'Unknown'}"
+            if file_info.get('file_size'):
+                files_text += f"  💾 {file_info['file_size']}"
+            files_text += "\n"
+            if file_info.get('part_count'):
+                files_text += f"   🧩 {file_info['part_count']} parts\n"
+            files_text += f"   🔁 /getfile {file_info.get('download_id')}\n\n"
         
-        if len(user_files) > 5:
-            files_text += f"... and {len(user_files) - 5} more files\n"
+        files_text += "💡 **Send any Mega link to add more files!**\n🔎 /myfiles <name> to search"
         
-        files_text += "\n💡 **Send any Mega link to add more files!**"
+        def cursor(row):
+            value = row['downloaded_at']
+            return f"{value if isinstance(value, str) else value.isoformat()}|{row.get('download_id')}"
         
-        await update.message.reply_text(files_text)
+        return files_text, self._page_buttons(
+            'files',
+            cursor(rows[0]) if rows and has_prev else None,
+            cursor(rows[-1]) if rows and has_next else None
+        )
+    
+    async def getfile_command(self, update: Update, context: CallbackContext):
+        """Send a stored file again, all parts included"""
+        user_id = update.effective_user.id
+        
+        if user_id not in self.premium_users:
+            await update.message.reply_text(f"❌ Premium feature. Contact @{self.config.OWNER_USERNAME} for access.")
+            return
+        
+        if not context.args:
+            await update.message.reply_text("Usage: /getfile <download_id>\n\n💡 IDs are listed in /myfiles")
+            return
+        
+        download_id = context.args[0]
+        user_file = await self.db.get_user_file(user_id, download_id)
+        if not user_file:
+            await update.message.reply_text("❌ No stored file with that ID. Check /myfiles.")
+            return
+        
+        parts = []
+        if user_file.get('part_count'):
+            download = await self.db.get_download(download_id) or {}
+            parts = [part['file_id'] for part in download.get('parts') or []]
+        if not user_file.get('file_id') and not parts:
+            await update.message.reply_text("❌ This file was never uploaded to Telegram.")
+            return
+        
+        try:
+            await self._send_file_ids(context.bot, user_id, user_file.get('file_name', 'Unknown'),
+                                      user_file.get('file_size', '?'), user_file.get('file_id'), parts)
+        except BadRequest as e:
+            logger.warning("Stored file %s could not be re-sent: %s", download_id, e)
+            await update.message.reply_text("❌ Telegram no longer has this file. Send the Mega link again.")
+    
+    async def queue_command(self, update: Update, context: CallbackContext):
+        """Show queued downloads with position and ETA"""
+        user_id = update.effective_user.id
+        
+        if user_id not in self.premium_users:
+            await update.message.reply_text(f"❌ Premium feature. Contact @{self.config.OWNER_USERNAME} for access.")
+            return
+        
+        is_admin = user_id == self.config.OWNER_ID or user_id in self.config.ADMINS
+        running = self.queue.running_jobs(None if is_admin else user_id)
+        waiting = self.queue.positions(None if is_admin else user_id)
+        
+        if not running and not waiting:
+            await update.message.reply_text("📭 **Your queue is empty**\n\n💡 Send a Mega link to start a download.")
+            return
+        
+        queue_text = "📥 **Download Queue**\n\n"
+        if is_admin:
+            queue_text += (
+                f"⚙️ **Workers:** {len(self.queue.running)}/{self.config.DOWNLOAD_WORKERS} busy, "
+                f"{self.queue.waiting_count} waiting\n\n"
+            )
+        for job in running:
+            queue_text += f"⬇️ {job.record.get('file_name', 'Unknown')} ({job.record.get('file_size', '?')}) - downloading\n"
+        for job, position, eta in waiting[:20]:
+            queue_text += f"#{position} ⏳ {job.record.get('file_name', 'Unknown')} ({job.record.get('file_size', '?')}) - ETA {format_eta(eta)}\n"
+        if len(waiting) > 20:
+            queue_text += f"\n... and {len(waiting) - 20} more\n"
+        
+        await update.message.reply_text(queue_text)
+    
+    async def history_command(self, update: Update, context: CallbackContext):
+        """Downloads started in the last hours, newest first: /history [hours] [user_id]"""
+        user_id = update.effective_user.id
+        
+        if user_id != self.config.OWNER_ID and user_id not in self.config.ADMINS:
+            await update.message.reply_text("❌ Admin access required.")
+            return
+        
+        try:
+            hours = float(context.args[0]) if context.args else 24
+            target_user = int(context.args[1]) if len(context.args) > 1 else None
+        except ValueError:
+            await update.message.reply_text("Usage: /history [hours] [user_id]")
+            return
+        
+        limit = self.config.LIST_PAGE_SIZE
+        downloads = await self.db.get_downloads_between(
+            datetime.datetime.now() - datetime.timedelta(hours=hours), None, target_user, limit + 1, newest_first=True
+        )
+        who = f" by {target_user}" if target_user is not None else ""
+        history_text = f"🕒 **Downloads in the last {hours:g}h{who}**\n\n"
+        if not downloads:
+            history_text += "Nothing downloaded in this window."
+        icons = {'completed': '✅', 'failed': '❌', 'queued': '⏳', 'downloading': '⬇️'}
+        for download in downloads[:limit]:
+            started = id_timestamp(download['download_id']).astimezone()
+            history_text += (
+                f"{icons.get(download.get('status'), '•')} {started:%m-%d %H:%M}  "
+                f"{download.get('file_name', 'Unknown')} ({download.get('file_size', '?')})"
+                f"  👤 {download.get('user_id')}\n"
+            )
+        if len(downloads) > limit:
+            history_text += "\n... more; narrow it with /history <hours> [user_id]"
+        await update.message.reply_text(history_text)
     
     async def add_channel_command(self, update: Update, context: CallbackContext):
         """Add channel for auto-upload"""
@@ -275,7 +563,7 @@ You haven't downloaded any files yet.
         channel_id = context.args[0]
         channel_name = context.args[1]
         
-        success = self.db.save_channel({
+        success = await self.db.save_channel({
             'channel_id': channel_id,
             'name': channel_name,
             'added_by': user_id,
@@ -300,24 +588,11 @@ You haven't downloaded any files yet.
             return
         
         message = ' '.join(context.args)
-        users_data = self.db.load_local_data('users') if hasattr(self.db, 'local_db') else []
-        
-        broadcast_msg = await update.message.reply_text(f"📢 Broadcasting to {len(users_data)} users...")
+        text = f"📢 **Announcement from Owner:**\n\n{message}\n\n👑 @{self.config.OWNER_USERNAME}"
         
-        success_count = 0
-        for user in users_data:
-            try:
-                await context.bot.send_message(
-                    chat_id=user['user_id'],
-                    text=f"📢 **Announcement from Owner:**\n\n{message}\n\n👑 @{self.config.OWNER_USERNAME}",
-                    parse_mode='HTML'
-                )
-                success_count += 1
-                await asyncio.sleep(0.1)  # Rate limiting
-            except Exception as e:
-                print(f"Failed to send to {user['user_id']}: {e}")
-        
-        await broadcast_msg.edit_text(f"✅ Broadcast completed: {success_count}/{len(users_data)} users received")
+        broadcast_msg = await update.message.reply_text("📢 Starting broadcast...")
+        record = await self.broadcaster.create(text, broadcast_msg)
+        self._start_background(self.broadcaster.run(context.bot, record, broadcast_msg))
     
     async def handle_message(self, update: Update, context: CallbackContext):
         """Handle all text messages including Mega links"""
@@ -333,56 +608,457 @@ You haven't downloaded any files yet.
             )
             return
         
-        # Check if it's a Mega link
-        if 'mega.nz' in message_text:
+        # Check for Mega links: one file, one folder, or a whole list
+        links = extract_mega_links(message_text)
+        folder = parse_mega_folder(links[0]) if len(links) == 1 else None
+        if len(links) > 1:
+            await self.process_link_batch(update, context, links)
+        elif folder and not folder[2]:
+            await self.process_mega_folder(update, context, links[0])
+        elif links:
+            await self.process_mega_link(update, context, links[0])
+        elif 'mega.nz' in message_text:
             await self.process_mega_link(update, context, message_text)
         else:
             await update.message.reply_text("Please send a valid Mega.nz link to download files.")
     
+    async def handle_document(self, update: Update, context: CallbackContext):
+        """Read Mega links from an uploaded .txt list"""
+        user_id = update.effective_user.id
+        document = update.message.document
+        
+        if user_id not in self.premium_users:
+            await update.message.reply_text(f"❌ Premium feature. Contact @{self.config.OWNER_USERNAME} for access.")
+            return
+        
+        if document.file_size and document.file_size > self.config.LINK_LIST_MAX_SIZE:
+            await update.message.reply_text(
+                f"❌ Link lists are limited to {human_size(self.config.LINK_LIST_MAX_SIZE)}."
+            )
+            return
+        
+        telegram_file = await context.bot.get_file(document.file_id)
+        text = bytes(await telegram_file.download_as_bytearray()).decode('utf-8', 'ignore')
+        links = extract_mega_links(text)
+        if not links:
+            await update.message.reply_text("❌ No Mega links found in this file.")
+        elif len(links) == 1 and parse_mega_folder(links[0]) and not parse_mega_folder(links[0])[2]:
+            await self.process_mega_folder(update, context, links[0])
+        else:
+            await self.process_link_batch(update, context, links)
+    
     async def process_mega_link(self, update: Update, context: CallbackContext, mega_link: str):
         """Process Mega download request"""
         user_id = update.effective_user.id
-        user_info = self.db.get_user(user_id) or {}
-        username = user_info.get('username', 'User')
         
+        if not link_id(mega_link):
+            await update.message.reply_text("❌ Invalid Mega link. Send a link like https://mega.nz/file/...#...")
+            return
+        
+        if self.queue.find(user_id, mega_link):
+            await update.message.reply_text("⏳ This link is already in your queue. Use /queue to check it.")
+            return
+        
+        cached = await self._serve_cached(context.bot, user_id, mega_link)
+        if cached:
+            await update.message.reply_text(
+                f"⚡ **Served from cache!**\n\n📁 **File:** {cached.get('file_name', 'Unknown')}\n"
+                f"💾 **Size:** {human_size(cached.get('size_bytes'))}\n\n"
+                "✅ **File saved to your personal storage**"
+            )
+            return
+        
+        status_msg = await update.message.reply_text("🔍 Processing your Mega link...")
         try:
-            status_msg = await update.message.reply_text("🔍 Processing your Mega link...")
-            
-            # Simulate download process
-            await asyncio.sleep(2)
-            await status_msg.edit_text("⬇️ Downloading from Mega... (This is simulation)")
+            mega_file = await self.downloader.get_link_info(mega_link)
+        except Exception as e:
+            await status_msg.edit_text(f"❌ Error processing your request: {str(e)}")
+            return
+        
+        if mega_file.size > self.config.MAX_FILE_SIZE:
+            await status_msg.edit_text(
+                f"❌ File is too large ({human_size(mega_file.size)}). "
+                f"Limit is {human_size(self.config.MAX_FILE_SIZE)}."
+            )
+            return
+        
+        record = await self._queued_record(user_id, mega_link, mega_file)
+        
+        job = await self.queue.submit(record, status_msg)
+        self.stats.record(queued=1)
+        for queued_job, position, eta in self.queue.positions(user_id):
+            if queued_job is job:
+                await status_msg.edit_text(
+                    f"📥 Queued: {mega_file.name} ({human_size(mega_file.size)})\n"
+                    f"🔢 Position: {position}  ⏱ ETA: {format_eta(eta)}\n\n"
+                    "Use /queue to follow your downloads."
+                )
+    
+    async def process_mega_folder(self, update: Update, context: CallbackContext, folder_link: str):
+        """Queue every file of a Mega folder link, smallest first"""
+        user_id = update.effective_user.id
+        
+        status_msg = await update.message.reply_text("🔍 Listing Mega folder...")
+        try:
+            files, folder_name = await self._list_folder(folder_link)
+        except Exception as e:
+            await status_msg.edit_text(f"❌ Error processing your request: {str(e)}")
+            return
+        
+        if not files:
+            await status_msg.edit_text("📭 This folder has no files.")
+            return
+        
+        batch = DownloadBatch(folder_name, status_msg)
+        skipped = await self._enqueue_batch(context.bot, user_id, files, batch)
+        await self._start_batch(batch, "📂", skipped)
+    
+    async def process_link_batch(self, update: Update, context: CallbackContext, links):
+        """Queue many links at once under one status message"""
+        user_id = update.effective_user.id
+        status_msg = await update.message.reply_text(f"🔍 Checking {len(links)} Mega links...")
+        
+        # Drop links already downloaded or queued before asking Mega about them
+        existing = await self.db.get_downloads_for_links(user_id, links)
+        fresh = [
+            link for link in links
+            if not self.queue.find(user_id, link)
+            and existing.get(link, {}).get('status') not in ('completed', 'queued')
+        ]
+        skipped = {'duplicate': len(links) - len(fresh)}
+        
+        # Send cached files by file_id without asking Mega about them
+        unresolved = []
+        for link in fresh:
+            folder = parse_mega_folder(link)
+            if (not folder or folder[2]) and await self._serve_cached(context.bot, user_id, link):
+                skipped['cached'] = skipped.get('cached', 0) + 1
+            else:
+                unresolved.append(link)
+        
+        results = await asyncio.gather(*(self._resolve_link(link) for link in unresolved), return_exceptions=True)
+        files = []
+        for link, result in zip(unresolved, results):
+            if isinstance(result, Exception):
+                logger.info("Skipping batch link %s: %s", link, result)
+                skipped['invalid'] = skipped.get('invalid', 0) + 1
+            else:
+                files.extend(result[0])
+        
+        batch = DownloadBatch(f"{len(links)} links", status_msg)
+        # Links checked against the cache above are not looked up again
+        for reason, count in (await self._enqueue_batch(context.bot, user_id, files, batch, unresolved)).items():
+            skipped[reason] = skipped.get(reason, 0) + count
+        await self._start_batch(batch, "📦", skipped)
+    
+    async def _resolve_link(self, link):
+        """([(mega_link, mega_file)], name) for a file or folder link"""
+        folder = parse_mega_folder(link)
+        if folder and not folder[2]:
+            return await self._list_folder(link)
+        mega_file = await self.downloader.get_link_info(link)
+        return [(link, mega_file)], mega_file.name
+    
+    async def _list_folder(self, folder_link):
+        folder_handle, folder_key, _ = parse_mega_folder(folder_link)
+        files = await self.downloader.list_folder(folder_handle, folder_key)
+        entries = [(folder_file_link(folder_handle, folder_key, f.handle), f) for f in files]
+        return entries, files[0].path.split('/')[0] if files else ''
+    
+    async def _enqueue_batch(self, bot, user_id, files, batch, cache_checked=()):
+        """Queue [(mega_link, mega_file)] smallest first with one bulk insert.
+        
+        Files already in the file_id cache are sent straight away instead,
+        except links in cache_checked, which the caller already found missing.
+        Returns skip counts by reason ('cached' for those sent).
+        """
+        skipped = {}
+        cache_checked = set(cache_checked)
+        existing = await self.db.get_downloads_for_links(user_id, [link for link, _ in files])
+        batch.batch_id = batch_id = uuid.uuid4().hex[:12]
+        new_records = []
+        records = []
+        for mega_link, mega_file in sorted(files, key=lambda entry: entry[1].size):
+            previous = existing.get(mega_link)
+            if mega_file.size > self.config.MAX_FILE_SIZE:
+                reason = 'too_large'
+            elif self.queue.find(user_id, mega_link) or (previous and previous['status'] in ('completed', 'queued')):
+                reason = 'duplicate'
+            elif mega_link not in cache_checked and await self._serve_cached(bot, user_id, mega_link):
+                reason = 'cached'
+            else:
+                reason = None
+            if reason:
+                skipped[reason] = skipped.get(reason, 0) + 1
+                continue
             
-            await asyncio.sleep(3)
-            await status_msg.edit_text("📤 Uploading to channels...")
+            if previous and previous['status'] in RESUMABLE_STATUSES and previous.get('segment_size'):
+                await self.db.update_download_status(previous['download_id'], 'queued')
+                record = previous
+            else:
+                record = self._new_record(user_id, mega_link, mega_file)
+                new_records.append(record)
+            record['batch_id'] = batch_id
+            if parse_mega_folder(mega_link):
+                record['folder_id'] = parse_mega_folder(mega_link)[0]
+                record['folder_path'] = mega_file.path
+            records.append(record)
+        
+        await self.db.log_downloads(new_records)
+        self.batches[batch_id] = batch
+        for record in records:
+            batch.add(await self.queue.submit(record))
+        self.stats.record(queued=len(records))
+        return skipped
+    
+    async def _start_batch(self, batch, icon, skipped):
+        """Report what was queued and keep the batch message updated"""
+        notes = {
+            'duplicate': "already downloaded or queued",
+            'too_large': f"over {human_size(self.config.MAX_FILE_SIZE)}",
+            'invalid': "unreadable links"
+        }
+        skipped_text = f"\n⚡ Sent {skipped['cached']} from cache" if skipped.get('cached') else ""
+        skipped_text += "".join(
+            f"\n⚠️ Skipped {count} ({notes[reason]})" for reason, count in skipped.items()
+            if count and reason in notes
+        )
+        if not batch.jobs:
+            self.batches.pop(batch.batch_id, None)
+            await batch.status_msg.edit_text(f"⏳ Nothing new to download.{skipped_text}")
+            return
+        await batch.status_msg.edit_text(
+            f"{icon} Queued {len(batch.jobs)} files from {batch.name} ({human_size(batch.total_bytes)}){skipped_text}\n\n"
+            "Use /queue to follow your downloads."
+        )
+        meter = SpeedMeter()
+        batch.handle = self.reporter.track(batch.status_msg, lambda: self._batch_text(batch, meter))
+        batch.seal()
+        if batch.complete:
+            await self._finish_batch(batch)
+    
+    def _new_record(self, user_id, mega_link, mega_file):
+        segment_size = self.config.MEGA_SEGMENT_SIZE
+        record = {
+            'download_id': self.db.generate_download_id(),
+            'user_id': user_id,
+            'mega_link': mega_link,
+            'status': 'queued',
+            'queued_at': datetime.datetime.now(),
+            'file_name': mega_file.name,
+            'file_size': human_size(mega_file.size),
+            'size_bytes': mega_file.size,
+            'segment_size': segment_size,
+            'segment_count': len(plan_segments(mega_file.size, segment_size)),
+            'bitmap': None,
+            'chunk_macs': {}
+        }
+        if mega_file.size > self.config.TELEGRAM_MAX_SIZE:
+            record['part_size'] = self.config.SPLIT_PART_SIZE
+            record['parts'] = []
+        return record
+    
+    async def _queued_record(self, user_id, mega_link, mega_file):
+        """Re-queue an interrupted download of this link, or log a new one"""
+        record = await self.db.get_resumable_download(user_id, mega_link)
+        if record:
+            await self.db.update_download_status(record['download_id'], 'queued')
+            return record
+        
+        record = self._new_record(user_id, mega_link, mega_file)
+        
+        # Log the download
+        await self.db.log_download(record)
+        return record
+    
+    def _batch_text(self, batch, meter):
+        failed = f"  ❌ {batch.failed} failed" if batch.failed else ""
+        return progress_text(
+            f"⬇️ Downloading {batch.name}", batch.done_bytes, batch.total_bytes, meter,
+            extra=f"📄 {len(batch.finished)}/{len(batch.jobs)} files{failed}"
+        )
+    
+    async def _finish_batch(self, batch):
+        """Replace the batch progress with a summary once every file is done"""
+        if self.batches.pop(batch.batch_id, None) is None:
+            return
+        await self.reporter.untrack(batch.handle)
+        failed = f" ({batch.failed} failed, send the links again to retry them)" if batch.failed else ""
+        try:
+            await batch.status_msg.edit_text(
+                f"✅ **BATCH COMPLETE!**\n\n📦 **From:** {batch.name}\n"
+                f"📄 **Files:** {batch.succeeded}/{len(batch.jobs)}{failed}\n"
+                f"💾 **Size:** {human_size(batch.total_bytes)}\n\n📁 Use /myfiles to see all your files"
+            )
+        except Exception as e:
+            logger.warning("Batch summary update failed: %s", e)
+    
+    async def _serve_cached(self, bot, user_id, mega_link):
+        """Re-send an earlier upload of this link by file_id and save it for the user.
+        
+        Returns the cache entry, or None when the link is not cached or
+        Telegram no longer accepts the file_id (the caller downloads it).
+        """
+        cached = await self.file_cache.lookup(*link_id(mega_link))
+        if not cached:
+            return None
+        file_name = cached.get('file_name', 'Unknown')
+        file_size = human_size(cached.get('size_bytes'))
+        try:
+            await self._send_file_ids(
+                bot, user_id, file_name, file_size, cached.get('file_id'), cached.get('parts')
+            )
+        except BadRequest as e:
+            logger.warning("Cached file_id for %s rejected: %s", file_name, e)
+            await self.file_cache.forget(cached['cache_key'])
+            return None
+        
+        download_id = self.db.generate_download_id()
+        now = datetime.datetime.now()
+        await self.db.log_download({
+            'download_id': download_id,
+            'user_id': user_id,
+            'mega_link': mega_link,
+            'status': 'completed',
+            'cached': True,
+            'started_at': now,
+            'completed_at': now,
+            'file_name': file_name,
+            'file_size': file_size,
+            'size_bytes': cached.get('size_bytes')
+        })
+        await self.db.save_user_file({
+            'user_id': user_id,
+            'file_name': file_name,
+            'file_size': file_size,
+            'file_id': cached.get('file_id'),
+            'part_count': len(cached.get('parts') or []),
+            'download_id': download_id,
+            'downloaded_at': now,
+            'active': True
+        })
+        await self.file_cache.record_hit(cached['cache_key'])
+        self.stats.record(cache_hits=1)
+        return cached
+    
+    async def _send_file_ids(self, bot, chat_id, file_name, file_size, file_id=None, parts=None):
+        """Send an earlier upload again: one file_id, or every part in order"""
+        if file_id:
+            await send_document(bot, chat_id=chat_id, document=file_id,
+                                caption=f"📁 {file_name}\n💾 {file_size}")
+            return
+        for index, part_file_id in enumerate(parts or []):
+            await send_document(bot, chat_id=chat_id, document=part_file_id,
+                                caption=f"📁 {file_name}\n🧩 Part {index + 1}/{len(parts)}")
+    
+    async def run_download(self, job):
+        """Download a queued job, resuming from its recorded progress"""
+        bot = self.application.bot
+        record = job.record
+        user_id = record['user_id']
+        mega_link = record['mega_link']
+        download_id = record['download_id']
+        user_info = await self.db.get_user(user_id) or {}
+        username = user_info.get('username', 'User')
+        
+        batch = self.batches.get(record.get('batch_id'))
+        status_msg = job.status_msg
+        if batch:
+            status_msg = QuietStatus()  # the batch message reports for all its files
+        elif status_msg is None:
+            status_msg = await bot.send_message(
+                chat_id=user_id,
+                text=f"♻️ Resuming {record.get('file_name', 'your download')}..."
+            )
+        
+        file_path = None
+        kept_in_cache = False
+        cache_key = FileCache.key_for(*link_id(mega_link))
+        state = DownloadState.from_record(record)
+        succeeded = False
+        report = None
+        try:
+            await status_msg.edit_text(f"⬇️ Starting {record.get('file_name', 'download')}...")
+            mega_file = await self.downloader.get_link_info(mega_link)
+            file_name = mega_file.name
+            file_size = human_size(mega_file.size)
+            progress = job.progress = DownloadProgress(mega_file.size)
+            if not batch:
+                report = self._track_download(status_msg, file_name, progress)
+            await self.db.update_download_status(download_id, 'downloading')
             
-            # Simulate file info
-            file_name = "course-file.pdf"
-            file_size = "150MB"
-            download_id = self.db.generate_download_id()
+            async def checkpoint(index, macs):
+                await self.db.update_download_progress(
+                    download_id, state.bitmap.to_b64(), index, DownloadState.encode_macs(macs)
+                )
             
-            # Log the download
-            self.db.log_download({
-                'download_id': download_id,
-                'user_id': user_id,
-                'mega_link': mega_link,
-                'status': 'started',
-                'started_at': 'now()',
-                'file_name': file_name,
-                'file_size': file_size
-            })
+            file_id = None
+            parts = []
+            download_started = time.monotonic()
+            download_seconds = 0
+            if mega_file.size > self.config.TELEGRAM_MAX_SIZE:
+                parts = await self._download_split(record, mega_file, state, progress, checkpoint)
+                download_seconds = time.monotonic() - download_started
+                await self.reporter.untrack(report)
+                await self.file_cache.remember(cache_key, file_name, mega_file.size,
+                                               parts=[part['file_id'] for part in parts])
+            else:
+                file_path = self.file_cache.local_path(cache_key)
+                kept_in_cache = file_path is not None
+                if not file_path:
+                    os.makedirs(self.config.DOWNLOAD_DIR, exist_ok=True)
+                    partial_path = os.path.join(self.config.DOWNLOAD_DIR, f"{download_id}.part")
+                    try:
+                        await self._download_with_accounts(mega_link, mega_file, partial_path,
+                                                           progress, state, checkpoint)
+                    except MegaError:
+                        # Nothing verified on disk (or the file MAC failed), start clean next time
+                        if os.path.exists(partial_path) and state.bitmap.count() == 0:
+                            os.remove(partial_path)
+                        raise
+                    download_seconds = time.monotonic() - download_started
+                    
+                    file_path, kept_in_cache = self.file_cache.store_local(cache_key, partial_path)
+                
+                await self.reporter.untrack(report)
+                await status_msg.edit_text("📤 Uploading to Telegram...")
+                with open_document(file_path, self.config.BOT_API_LOCAL_MODE, file_name) as document, \
+                        upload_stage(mega_file.size):
+                    sent = await send_document(
+                        bot,
+                        chat_id=user_id,
+                        document=document,
+                        filename=file_name,
+                        caption=f"📁 {file_name}\n💾 {file_size}"
+                    )
+                file_id = sent.document.file_id
+                await self.file_cache.remember(cache_key, file_name, mega_file.size, file_id)
             
             # Save to user's storage
-            self.db.save_user_file({
+            await self.db.save_user_file({
                 'user_id': user_id,
                 'file_name': file_name,
                 'file_size': file_size,
+                'file_id': file_id,
+                'part_count': len(parts),
                 'download_id': download_id,
-                'downloaded_at': 'now()',
+                'downloaded_at': datetime.datetime.now(),
                 'active': True
             })
             
             # Update download status
-            self.db.update_download_status(download_id, 'completed')
+            await self.db.update_download_status(download_id, 'completed')
+            
+            posted, channel_count = await self.fanout.run(
+                bot, file_name, file_size, [file_id] if file_id else [part['file_id'] for part in parts]
+            )
+            
+            upload_line = (
+                f"✅ **Sent in {len(parts)} parts** (rejoin them with 7-Zip or `cat`)" if parts else
+                "✅ **File sent to this chat**"
+            )
+            if channel_count:
+                upload_line += f"\n📢 **Posted to {posted}/{channel_count} channels**"
             
             # Success message
             success_text = f"""
@@ -393,53 +1069,257 @@ You haven't downloaded any files yet.
 👤 **Downloaded by:** @{username}
 
 ✅ **File saved to your personal storage**
-✅ **Uploaded to owner's channels**
+{upload_line}
 
 📁 Use /myfiles to see all your files
+🔁 Use /getfile {download_id} to get it again
 
 🎉 **Happy Learning!**
             """
             
             await status_msg.edit_text(success_text)
+            succeeded = True
+            self.stats.record(completed=1, bytes=progress.transferred, download_seconds=download_seconds)
             
         except Exception as e:
+            logger.exception("Download failed for %s", mega_link)
+            self.stats.record(failed=1)
+            await self.db.update_download_status(download_id, 'failed', str(e))
             error_msg = f"❌ Error processing your request: {str(e)}"
-            await update.message.reply_text(error_msg)
+            if state.bitmap.count():
+                error_msg += "\n\n♻️ Send the same link again to resume where it stopped."
+            if not batch:
+                await bot.send_message(chat_id=user_id, text=error_msg)
+        finally:
+            await self.reporter.untrack(report)
+            if batch:
+                batch.finish(job, succeeded)
+                if batch.complete:
+                    await self._finish_batch(batch)
+            if file_path and not kept_in_cache and os.path.exists(file_path):
+                os.remove(file_path)
+    
+    async def _download_split(self, record, mega_file, state, progress, checkpoint):
+        """Download into part files, uploading each part while the rest downloads"""
+        download_id = record['download_id']
+        os.makedirs(self.config.DOWNLOAD_DIR, exist_ok=True)
+        sink = SplitSink(
+            os.path.join(self.config.DOWNLOAD_DIR, download_id),
+            record.get('part_size') or self.config.SPLIT_PART_SIZE,
+            self.config.SPLIT_WINDOW,
+            uploaded=[part['index'] for part in record.get('parts') or []]
+        )
+        download = asyncio.create_task(
+            self._download_with_accounts(record['mega_link'], mega_file, sink, progress, state, checkpoint)
+        )
+        upload = asyncio.create_task(
+            self.uploader.run(self.application.bot, record['user_id'], download_id, mega_file.name, sink)
+        )
+        try:
+            await asyncio.gather(download, upload)
+        except BaseException:
+            for task in (download, upload):
+                task.cancel()
+            await asyncio.gather(download, upload, return_exceptions=True)
+            if state.bitmap.count() == 0:
+                # File MAC failed: the uploaded parts are useless, start over next time
+                sink.remove_files()
+                await self.db.clear_download_parts(download_id)
+            raise
+        
+        download_record = await self.db.get_download(download_id) or {}
+        return download_record.get('parts') or []
+    
+    async def _download_with_accounts(self, mega_link, mega_file, target, progress, state, checkpoint):
+        """Download on whichever Mega account has quota, switching when one runs out"""
+        first = True
+        while True:
+            needed = mega_file.size - state.done_bytes(mega_file.size)
+            account = await self.accounts.acquire(needed)
+            while account is None:
+                wait = self.accounts.wait_time()
+                progress.paused_until = time.time() + wait
+                logger.info("No Mega quota left for %s, waiting %ss", mega_file.name, int(wait))
+                await asyncio.sleep(min(wait, 60))
+                account = await self.accounts.acquire(needed)
+            progress.paused_until = None
+            transferred = progress.transferred
+            IN_FLIGHT.inc('download')
+            try:
+                if account.sid or not first:
+                    mega_file = await self.downloader.get_link_info(mega_link, account.sid)
+                first = False
+                progress.reset()
+                with STAGE_SECONDS.time('download'):
+                    await self.downloader.download(mega_file, target, progress, state, checkpoint)
+                return
+            except MegaQuotaError as e:
+                await self.accounts.exhausted(account, e.retry_after)
+            finally:
+                IN_FLIGHT.dec('download')
+                TRANSFER_BYTES.inc('download', amount=progress.transferred - transferred)
+                await self.accounts.release(account, needed, progress.transferred - transferred)
+    
+    def _track_download(self, status_msg, file_name, progress):
+        """Report a download's progress on its status message"""
+        meter = SpeedMeter()
+        
+        def render():
+            extra = None
+            if progress.paused_until:
+                extra = f"⏸ Mega transfer quota used up, continuing in ~{format_eta(progress.paused_until - time.time())}"
+            return progress_text(f"⬇️ Downloading {file_name}", progress.done, progress.total, meter, extra)
+        
+        return self.reporter.track(status_msg, render)
+    
+    async def post_init(self, application):
+        """Start background work once the application is running"""
+        if not self.db.is_local and self.config.MONGO_HEALTH_INTERVAL:
+            self._start_background(self._database_health_loop())
+        self.application = application
+        self._start_background(self.reporter.run())
+        await self.premium_users.refresh()
+        self._start_background(self.premium_users.run())
+        await self.stats.load()
+        self._start_background(self.stats.run())
+        await self.accounts.load()
+        if self.config.PARTIAL_MAX_AGE:
+            await asyncio.to_thread(self._remove_stale_partials)
+        QUEUE_WAITING.set_function(lambda: self.queue.waiting_count)
+        if self.config.METRICS_LOG_INTERVAL:
+            self._start_background(metrics.log_summary(self.config.METRICS_LOG_INTERVAL))
+        await self.queue.start()
+        await self.resume_broadcasts(application)
+    
+    def _remove_stale_partials(self):
+        """Delete .part and split part files of failed downloads nobody resumed within PARTIAL_MAX_AGE"""
+        if not os.path.isdir(self.config.DOWNLOAD_DIR):
+            return
+        cutoff = time.time() - self.config.PARTIAL_MAX_AGE
+        removed = 0
+        for entry in os.scandir(self.config.DOWNLOAD_DIR):
+            try:
+                if entry.is_file() and is_partial_file(entry.name) and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError as e:
+                logger.warning("Could not remove stale partial download %s: %s", entry.name, e)
+        if removed:
+            # Resuming one of them later re-verifies its segments and fetches them again
+            logger.info("Removed %s partial download files older than %sh", removed, int(self.config.PARTIAL_MAX_AGE / 3600))
+    
+    def _start_background(self, coro):
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+    
+    async def _database_health_loop(self):
+        """Ping MongoDB periodically so outages show up in the logs"""
+        healthy = True
+        while True:
+            await asyncio.sleep(self.config.MONGO_HEALTH_INTERVAL)
+            latency = await self.db.ping()
+            if latency is None and healthy:
+                logger.error("MongoDB health check failed")
+            elif latency is not None and not healthy:
+                logger.info("MongoDB reachable again (%.0f ms)", latency)
+            healthy = latency is not None
+    
+    async def resume_broadcasts(self, application):
+        """Continue broadcasts that were cut off by a restart"""
+        for record in await self.db.get_running_broadcasts():
+            try:
+                status_msg = await application.bot.send_message(
+                    chat_id=record['chat_id'],
+                    text="♻️ Resuming broadcast after a restart..."
+                )
+            except Exception as e:
+                logger.warning("Cannot resume broadcast %s: %s", record['broadcast_id'], e)
+                continue
+            self._start_background(self.broadcaster.run(application.bot, record, status_msg))
+    
+    async def shutdown(self, application):
+        """Release download and database threads"""
+        tasks = list(self.background_tasks)
+        for task in tasks:
+            task.cancel()
+        # Let cancelled jobs checkpoint before the database closes
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.queue.stop()
+        await self.stats.flush()
+        self.downloader.shutdown()
+        self.db.close()
     
     def setup_handlers(self, application):
         """Setup all message handlers"""
+        def timed(callback):
+            return instrument_handler(callback.__name__, callback)
+        
         # Command handlers
-        application.add_handler(CommandHandler("start", self.start))
-        application.add_handler(CommandHandler("help", self.start))
-        application.add_handler(CommandHandler("premium", self.premium_command))
-        application.add_handler(CommandHandler("stats", self.stats_command))
-        application.add_handler(CommandHandler("myfiles", self.myfiles_command))
-        application.add_handler(CommandHandler("add_channel", self.add_channel_command))
-        application.add_handler(CommandHandler("broadcast", self.broadcast_command))
+        application.add_handler(CommandHandler("start", timed(self.start)))
+        application.add_handler(CommandHandler("help", timed(self.start)))
+        application.add_handler(CommandHandler("premium", timed(self.premium_command)))
+        application.add_handler(CallbackQueryHandler(timed(self.premium_page_callback), pattern=r'^premium:'))
+        application.add_handler(CommandHandler("stats", timed(self.stats_command)))
+        application.add_handler(CommandHandler("myfiles", timed(self.myfiles_command)))
+        application.add_handler(CallbackQueryHandler(timed(self.files_page_callback), pattern=r'^files:'))
+        application.add_handler(CommandHandler("getfile", timed(self.getfile_command)))
+        application.add_handler(CommandHandler("queue", timed(self.queue_command)))
+        application.add_handler(CommandHandler("history", timed(self.history_command)))
+        application.add_handler(CommandHandler("add_channel", timed(self.add_channel_command)))
+        application.add_handler(CommandHandler("broadcast", timed(self.broadcast_command)))
+        
+        # .txt documents with one Mega link per line
+        application.add_handler(MessageHandler(
+            filters.Document.FileExtension("txt"),
+            timed(self.handle_document)
+        ))
         
         # Message handler for Mega links
         application.add_handler(MessageHandler(
             filters.TEXT & ~filters.COMMAND, 
-            self.handle_message
+            timed(self.handle_message)
         ))
 
+def build_application(bot):
+    """Telegram application wired to ``bot``'s handlers and lifecycle hooks"""
+    builder = (
+        Application.builder()
+        .token(bot.config.BOT_TOKEN)
+        .concurrent_updates(bot.config.CONCURRENT_UPDATES)
+        .post_init(bot.post_init)
+        .post_shutdown(bot.shutdown)
+    )
+    if bot.config.BOT_API_URL:
+        # Self-hosted Bot API server: 2000MB uploads, files passed by path in local mode
+        builder = (
+            builder
+            .base_url(bot.config.BOT_API_URL)
+            .base_file_url(bot.config.BOT_API_FILE_URL)
+            .local_mode(bot.config.BOT_API_LOCAL_MODE)
+            .read_timeout(bot.config.BOT_API_TIMEOUT)
+            .write_timeout(bot.config.BOT_API_TIMEOUT)
+        )
+    application = builder.build()
+    bot.setup_handlers(application)
+    return application
+
+
 def main():
     try:
         print("🚀 Starting Ultimate Course Bot...")
         
         # Initialize bot
         bot = SimpleCourseBot()
-        
-        # Create application
-        application = Application.builder().token(bot.config.BOT_TOKEN).build()
-        
-        # Setup handlers
-        bot.setup_handlers(application)
+        application = build_application(bot)
         
         # Start bot
         print("✅ Bot is starting...")
         print(f"👑 Owner ID: {bot.config.OWNER_ID}")
         print(f"🤖 Bot Username: {bot.config.BOT_USERNAME}")
+        if bot.config.BOT_API_URL:
+            print(f"🛰 Bot API server: {bot.config.BOT_API_URL} (local mode: {bot.config.BOT_API_LOCAL_MODE})")
         
         application.run_polling()
         
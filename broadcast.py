@@ -0,0 +1,210 @@
+import asyncio
+import collections
+import datetime
+import logging
+import time
+import uuid
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+from ratelimit import AsyncTokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class BroadcastState:
+    """Which recipients are done, kept compact enough to checkpoint.
+
+    Users are dispatched in user_id order, so everything up to ``cursor``
+    is finished; ``done`` only holds the few finished ids above it while
+    earlier sends are still in flight.
+    """
+
+    def __init__(self, record):
+        self.cursor = record.get('cursor')
+        self.done = set(record.get('done_ids') or [])
+        self.pending = collections.deque()
+        self.counts = {
+            'sent': record.get('sent', 0),
+            'failed': record.get('failed', 0),
+            'blocked': record.get('blocked', 0)
+        }
+
+    @property
+    def processed(self):
+        return sum(self.counts.values())
+
+    def dispatch(self, user_id):
+        """Track a recipient; False if it was already handled before a resume"""
+        self.pending.append(user_id)
+        if user_id in self.done:
+            self._advance()
+            return False
+        return True
+
+    def finish(self, user_id, result):
+        self.counts[result] += 1
+        self.done.add(user_id)
+        self._advance()
+
+    def _advance(self):
+        while self.pending and self.pending[0] in self.done:
+            self.cursor = self.pending.popleft()
+            self.done.discard(self.cursor)
+
+    def snapshot(self):
+        return {'cursor': self.cursor, 'done_ids': sorted(self.done), **self.counts}
+
+
+class Broadcaster:
+    """Streams users from the database and sends to them concurrently.
+
+    A shared token bucket keeps the bot under Telegram's ~30 msg/s limit,
+    RetryAfter pauses the whole bucket, and progress is checkpointed on the
+    broadcast record so an interrupted broadcast resumes where it stopped.
+    """
+
+    def __init__(self, db, config):
+        self.db = db
+        self.config = config
+        self.bucket = AsyncTokenBucket(config.BROADCAST_RATE)
+
+    async def create(self, text, status_msg):
+        """Store a new broadcast and return its record"""
+        record = {
+            'broadcast_id': uuid.uuid4().hex[:12],
+            'text': text,
+            'status': 'running',
+            'created_at': datetime.datetime.now(),
+            'total': await self.db.get_total_users(),
+            'chat_id': status_msg.chat_id,
+            'cursor': None,
+            'done_ids': [],
+            'sent': 0,
+            'failed': 0,
+            'blocked': 0
+        }
+        await self.db.save_broadcast(record)
+        return record
+
+    async def run(self, bot, record, status_msg):
+        """Send the broadcast to every remaining recipient"""
+        state = BroadcastState(record)
+        queue = asyncio.Queue(maxsize=self.config.BROADCAST_CONCURRENCY * 2)
+        started = time.monotonic()
+        first_count = state.processed
+
+        workers = [
+            asyncio.create_task(self._worker(bot, record['text'], queue, state))
+            for _ in range(self.config.BROADCAST_CONCURRENCY)
+        ]
+        reporter = asyncio.create_task(
+            self._report(record, state, status_msg, started, first_count)
+        )
+        tasks = [asyncio.create_task(self._dispatch(state, queue, len(workers))), *workers]
+        try:
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            # Shutting down: keep the record 'running' so startup resumes it
+            for task in tasks:
+                task.cancel()
+            await self.db.update_broadcast(record['broadcast_id'], state.snapshot())
+            raise
+        except Exception as e:
+            # A dead worker or dispatcher would stall the rest; stop, and don't resume on restart
+            logger.exception("Broadcast %s stopped", record['broadcast_id'])
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.db.update_broadcast(record['broadcast_id'], {
+                **state.snapshot(),
+                'status': 'failed',
+                'error': str(e),
+                'completed_at': datetime.datetime.now()
+            })
+            await self._edit(status_msg,
+                f"❌ Broadcast stopped after {state.processed} users: {e}\n"
+                f"✅ Sent: {state.counts['sent']}"
+            )
+            return
+        finally:
+            reporter.cancel()
+
+        await self.db.update_broadcast(record['broadcast_id'], {
+            **state.snapshot(),
+            'status': 'completed',
+            'completed_at': datetime.datetime.now()
+        })
+        counts = state.counts
+        await self._edit(status_msg,
+            f"✅ Broadcast completed: {counts['sent']}/{state.processed} users received\n"
+            f"❌ Failed: {counts['failed']}  🚫 Blocked: {counts['blocked']}"
+        )
+
+    async def _dispatch(self, state, queue, workers):
+        """Queue every remaining recipient, then one stop marker per worker"""
+        async for user_id in self._recipients(state.cursor):
+            if state.dispatch(user_id):
+                await queue.put(user_id)
+        for _ in range(workers):
+            await queue.put(None)
+
+    async def _recipients(self, after_id):
+        """Page through user ids with a keyset cursor"""
+        while True:
+            batch = await self.db.get_user_ids_after(after_id, self.config.BROADCAST_BATCH_SIZE)
+            for user_id in batch:
+                yield user_id
+            if len(batch) < self.config.BROADCAST_BATCH_SIZE:
+                return
+            after_id = batch[-1]
+
+    async def _worker(self, bot, text, queue, state):
+        while True:
+            user_id = await queue.get()
+            if user_id is None:
+                return
+            state.finish(user_id, await self._send(bot, user_id, text))
+
+    async def _send(self, bot, user_id, text):
+        for attempt in range(5):
+            await self.bucket.acquire()
+            try:
+                await bot.send_message(chat_id=user_id, text=text, parse_mode='HTML')
+                return 'sent'
+            except RetryAfter as e:
+                retry_after = getattr(e.retry_after, 'total_seconds', lambda: e.retry_after)()
+                logger.warning("Flood limit hit, pausing broadcast for %ss", retry_after)
+                self.bucket.pause(retry_after)
+            except Forbidden:
+                return 'blocked'
+            except BadRequest as e:
+                logger.info("Broadcast to %s failed: %s", user_id, e)
+                return 'failed'
+            except NetworkError as e:
+                logger.warning("Broadcast to %s failed (%s), retrying", user_id, e)
+                await asyncio.sleep(2 ** attempt)
+            except TelegramError as e:
+                # e.g. ChatMigrated: not worth retrying, and must not kill the worker
+                logger.info("Broadcast to %s failed: %s", user_id, e)
+                return 'failed'
+        return 'failed'
+
+    async def _report(self, record, state, status_msg, started, first_count):
+        """Edit the status message and checkpoint progress periodically"""
+        while True:
+            await asyncio.sleep(self.config.BROADCAST_PROGRESS_INTERVAL)
+            await self.db.update_broadcast(record['broadcast_id'], state.snapshot())
+            rate = (state.processed - first_count) / max(time.monotonic() - started, 1e-6)
+            counts = state.counts
+            await self._edit(status_msg,
+                f"📢 Broadcasting... {state.processed}/{record['total']}\n"
+                f"✅ {counts['sent']}  ❌ {counts['failed']}  🚫 {counts['blocked']}\n"
+                f"⚡ {rate:.1f} msg/s"
+            )
+
+    async def _edit(self, status_msg, text):
+        try:
+            await status_msg.edit_text(text)
+        except Exception as e:
+            logger.warning("Broadcast status update failed: %s", e)
@@ -15,10 +15,48 @@ class Config:
         self.OWNER_USERNAME = os.environ.get('OWNER_USERNAME', 'owner_username')
         self.BOT_USERNAME = os.environ.get('BOT_USERNAME', 'your_bot_username')
         
+        # Self-hosted telegram-bot-api server (empty = public api.telegram.org)
+        self.BOT_API_URL = os.environ.get('BOT_API_URL', '')  # e.g. http://localhost:8081/bot
+        self.BOT_API_FILE_URL = os.environ.get('BOT_API_FILE_URL') or (
+            self.BOT_API_URL.rsplit('/bot', 1)[0] + '/file/bot' if self.BOT_API_URL else ''
+        )
+        # Server started with --local: uploads are passed as file:// paths it reads from our disk
+        self.BOT_API_LOCAL_MODE = bool(self.BOT_API_URL) and os.environ.get('BOT_API_LOCAL_MODE', 'true').lower() == 'true'
+        self.BOT_API_TIMEOUT = float(os.environ.get('BOT_API_TIMEOUT', 600))  # seconds per upload request
+        
         # MongoDB Configuration
         self.MONGO_URI = os.environ.get('MONGO_URI')
         self.DB_NAME = os.environ.get('DB_NAME', 'course_bot')
         
+        # MongoDB Connection Pool / Timeouts
+        self.MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 50))
+        self.MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+        self.MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 60000))
+        self.MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000))
+        self.MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 20000))
+        # Bounds how long startup waits for Atlas before falling back to local storage
+        self.MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+        self.MONGO_RETRY_WRITES = os.environ.get('MONGO_RETRY_WRITES', 'true').lower() == 'true'
+        self.MONGO_HEALTH_INTERVAL = int(os.environ.get('MONGO_HEALTH_INTERVAL', 60))  # seconds, 0 = off
+        self.DB_MAX_WORKERS = int(os.environ.get('DB_MAX_WORKERS', 8))  # threads running DB calls
+        # Download log / progress writes are queued and sent as bulk_write batches
+        # of up to N operations or every N seconds (interval 0 = write immediately)
+        self.MONGO_BULK_SIZE = int(os.environ.get('MONGO_BULK_SIZE', 100))
+        self.MONGO_BULK_INTERVAL = float(os.environ.get('MONGO_BULK_INTERVAL', 1))
+        
+        # Local fallback storage when MongoDB is unavailable: 'sqlite' or legacy 'json'
+        self.LOCAL_DB_BACKEND = os.environ.get('LOCAL_DB_BACKEND', 'sqlite').lower()
+        self.LOCAL_DATA_DIR = os.environ.get('LOCAL_DATA_DIR', 'data')
+        self.LOCAL_DB_PATH = os.environ.get('LOCAL_DB_PATH', os.path.join(self.LOCAL_DATA_DIR, 'local.db'))
+        
+        # JSON backend flush policy: write dirty collections every N seconds
+        # or after N writes, whichever comes first (1 write = flush on every change)
+        self.JSON_FLUSH_INTERVAL = float(os.environ.get('JSON_FLUSH_INTERVAL', 5))
+        self.JSON_FLUSH_WRITES = int(os.environ.get('JSON_FLUSH_WRITES', 100))
+        
+        # Updates handled at once (downloads run inside handlers)
+        self.CONCURRENT_UPDATES = int(os.environ.get('CONCURRENT_UPDATES', 64))
+        
         # Admin User IDs
         admin_ids = os.environ.get('ADMIN_IDS', '')
         self.ADMINS = [int(id.strip()) for id in admin_ids.split(',') if id.strip()]
@@ -27,14 +65,84 @@ class Config:
         if self.OWNER_ID and self.OWNER_ID not in self.ADMINS:
             self.ADMINS.append(self.OWNER_ID)
         
+        # Premium membership is cached in memory and reloaded from the database every N seconds
+        self.PREMIUM_REFRESH_INTERVAL = int(os.environ.get('PREMIUM_REFRESH_INTERVAL', 60))
+        
         # Mega Credentials
         self.MEGA_EMAIL = os.environ.get('MEGA_EMAIL', '')
         self.MEGA_PASSWORD = os.environ.get('MEGA_PASSWORD', '')
         
+        # Mega account pool: "email:password,email2:password2" plus MEGA_EMAIL, and/or anonymous access
+        self.MEGA_ACCOUNTS = [
+            tuple(entry.strip().split(':', 1)) for entry in os.environ.get('MEGA_ACCOUNTS', '').split(',')
+            if ':' in entry
+        ]
+        if self.MEGA_EMAIL and self.MEGA_PASSWORD and self.MEGA_EMAIL not in [e for e, _ in self.MEGA_ACCOUNTS]:
+            self.MEGA_ACCOUNTS.append((self.MEGA_EMAIL, self.MEGA_PASSWORD))
+        self.MEGA_ANONYMOUS = os.environ.get('MEGA_ANONYMOUS', 'true').lower() == 'true' or not self.MEGA_ACCOUNTS
+        # Assumed transfer quota per window when Mega does not report one
+        self.MEGA_ACCOUNT_QUOTA = int(float(os.environ.get('MEGA_ACCOUNT_QUOTA_GB', 5)) * 1024 ** 3)
+        self.MEGA_ANONYMOUS_QUOTA = int(float(os.environ.get('MEGA_ANONYMOUS_QUOTA_GB', 5)) * 1024 ** 3)
+        self.MEGA_QUOTA_WINDOW = float(os.environ.get('MEGA_QUOTA_WINDOW_HOURS', 6)) * 3600
+        self.MEGA_QUOTA_COOLDOWN = int(os.environ.get('MEGA_QUOTA_COOLDOWN', 3600))  # seconds, if Mega gives no wait time
+        
+        # Broadcasts (Telegram allows roughly 30 messages/second per bot)
+        self.BROADCAST_RATE = float(os.environ.get('BROADCAST_RATE', 25))
+        self.BROADCAST_CONCURRENCY = int(os.environ.get('BROADCAST_CONCURRENCY', 10))
+        self.BROADCAST_BATCH_SIZE = int(os.environ.get('BROADCAST_BATCH_SIZE', 500))
+        self.BROADCAST_PROGRESS_INTERVAL = int(os.environ.get('BROADCAST_PROGRESS_INTERVAL', 5))
+        
+        # Mega Download Engine
+        self.MEGA_API_URL = os.environ.get('MEGA_API_URL', 'https://g.api.mega.co.nz')
+        self.DOWNLOAD_DIR = os.environ.get('DOWNLOAD_DIR', 'downloads')
+        self.PARTIAL_MAX_AGE = float(os.environ.get('PARTIAL_MAX_AGE_HOURS', 72)) * 3600  # .part files older are removed at startup, 0 = keep
+        self.MEGA_CONNECTIONS = int(os.environ.get('MEGA_CONNECTIONS', 4))  # parallel ranges per file
+        self.MEGA_MAX_CONNECTIONS = int(os.environ.get('MEGA_MAX_CONNECTIONS', 16))  # across all downloads
+        self.MEGA_SEGMENT_SIZE = int(os.environ.get('MEGA_SEGMENT_SIZE_MB', 8)) * 1024 * 1024
+        self.MEGA_RETRIES = int(os.environ.get('MEGA_RETRIES', 5))
+        self.MEGA_MAX_BANDWIDTH = int(float(os.environ.get('MEGA_MAX_BANDWIDTH_MB', 0)) * 1024 * 1024)  # bytes/s, 0 = no cap
+        
+        # File Cache: uploaded file_ids are always reused; this bounds local copies (0 = keep none)
+        self.FILE_CACHE_DIR = os.environ.get('FILE_CACHE_DIR', os.path.join(self.DOWNLOAD_DIR, 'cache'))
+        self.FILE_CACHE_MAX_SIZE = int(os.environ.get('FILE_CACHE_MAX_MB', 1024)) * 1024 * 1024
+        
+        # Largest .txt link list accepted
+        self.LINK_LIST_MAX_SIZE = int(os.environ.get('LINK_LIST_MAX_KB', 512)) * 1024
+        
+        # Channel fan-out: channels posted to at once after each upload
+        self.CHANNEL_FANOUT_CONCURRENCY = int(os.environ.get('CHANNEL_FANOUT_CONCURRENCY', 5))
+        
+        # Status messages: each is edited at most every N seconds, all edits share one rate
+        self.PROGRESS_INTERVAL = float(os.environ.get('PROGRESS_INTERVAL', 5))
+        self.PROGRESS_EDIT_RATE = float(os.environ.get('PROGRESS_EDIT_RATE', 20))  # edits per second
+        
+        # /stats counters and rollups are written every N seconds
+        self.STATS_FLUSH_INTERVAL = float(os.environ.get('STATS_FLUSH_INTERVAL', 10))
+        
+        # Rows per page in /premium list and /myfiles
+        self.LIST_PAGE_SIZE = int(os.environ.get('LIST_PAGE_SIZE', 20))
+        
+        # Download Queue
+        self.DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', 3))  # jobs running at once
+        self.DOWNLOADS_PER_USER = int(os.environ.get('DOWNLOADS_PER_USER', 1))  # per-user cap
+        self.FOLDER_CONCURRENCY = int(os.environ.get('FOLDER_CONCURRENCY', 3))  # per-user cap for folder files
+        
         # File Size Limits
-        self.TELEGRAM_MAX_SIZE = 50 * 1024 * 1024  # 50MB
+        self.TELEGRAM_MAX_SIZE = (2000 if self.BOT_API_LOCAL_MODE else 50) * 1024 * 1024  # 2000MB local / 50MB
         self.MAX_FILE_SIZE = 5 * 1024 * 1024 * 1024  # 5GB
         
+        # Split Uploads: larger files are cut into parts and uploaded while still downloading
+        self.SPLIT_PART_SIZE = int(os.environ.get('SPLIT_PART_SIZE_MB', 0)) * 1024 * 1024 or self.TELEGRAM_MAX_SIZE - 1024 * 1024
+        self.SPLIT_WINDOW = int(os.environ.get('SPLIT_WINDOW', 3))  # parts kept on disk per download
+        
+        # Replica number (0-1023) baked into download IDs; defaults to a hash of the host name
+        self.NODE_ID = int(os.environ['NODE_ID']) if os.environ.get('NODE_ID') else None
+
+        # Metrics: Prometheus text on METRICS_HOST:METRICS_PORT/metrics and/or a periodic log line (0 = off)
+        self.METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))
+        self.METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+        self.METRICS_LOG_INTERVAL = float(os.environ.get('METRICS_LOG_INTERVAL', 0))
+
         # Heroku Specific
         self.IS_HEROKU = os.environ.get('IS_HEROKU', False)
         
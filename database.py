@@ -1,45 +1,352 @@
 import pymongo
+import asyncio
+import collections
 import datetime
-import random
-import string
-import json
-import os
+import functools
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import InsertOne, UpdateOne
+import metrics
 from config import Config
+from ids import TIME_ID_PATTERN, IdGenerator, default_node_id, id_at
+from local_store import JsonStore, SQLiteStore
+
+FINISHED_STATUSES = ('completed', 'failed')
+# Fields /myfiles shows; list pages fetch only these
+FILE_LIST_FIELDS = {'_id': 0, 'file_name': 1, 'file_size': 1, 'part_count': 1, 'download_id': 1, 'downloaded_at': 1}
+RESUMABLE_STATUSES = ('downloading', 'failed')
+# downloaded_at of files saved before real dates, which stored the text 'now()'
+LEGACY_DATE = datetime.datetime(1970, 1, 1)
+
+# Indexes every query path relies on: collection -> [(name, keys, options)]
+MONGO_INDEXES = {
+    'users': [
+        ('user_id_unique', [('user_id', pymongo.ASCENDING)], {'unique': True}),
+    ],
+    'premium_users': [
+        ('user_id_unique', [('user_id', pymongo.ASCENDING)], {'unique': True}),
+        ('active_user', [('active', pymongo.ASCENDING), ('user_id', pymongo.ASCENDING)], {}),
+    ],
+    'channels': [
+        ('channel_id_unique', [('channel_id', pymongo.ASCENDING)], {'unique': True}),
+    ],
+    'downloads': [
+        ('download_id_unique', [('download_id', pymongo.ASCENDING)], {'unique': True}),
+        ('user_status', [('user_id', pymongo.ASCENDING), ('status', pymongo.ASCENDING)], {}),
+        ('user_link', [('user_id', pymongo.ASCENDING), ('mega_link', pymongo.ASCENDING)], {}),
+        ('user_download', [('user_id', pymongo.ASCENDING), ('download_id', pymongo.ASCENDING)], {}),
+    ],
+    'user_files': [
+        ('user_active_downloaded_id', [
+            ('user_id', pymongo.ASCENDING),
+            ('active', pymongo.ASCENDING),
+            ('downloaded_at', pymongo.DESCENDING),
+            ('download_id', pymongo.DESCENDING)
+        ], {}),
+        ('download_id', [('download_id', pymongo.ASCENDING)], {}),
+    ],
+    'broadcasts': [
+        ('broadcast_id_unique', [('broadcast_id', pymongo.ASCENDING)], {'unique': True}),
+        ('status', [('status', pymongo.ASCENDING)], {}),
+    ],
+    'file_cache': [
+        ('cache_key_unique', [('cache_key', pymongo.ASCENDING)], {'unique': True}),
+    ],
+    'mega_accounts': [
+        ('account_id_unique', [('account_id', pymongo.ASCENDING)], {'unique': True}),
+    ],
+    'counters': [
+        ('name_unique', [('name', pymongo.ASCENDING)], {'unique': True}),
+    ],
+    'stats_rollups': [
+        ('bucket_unique', [('bucket', pymongo.ASCENDING)], {'unique': True}),
+        ('period_start', [('period', pymongo.ASCENDING), ('start', pymongo.ASCENDING)], {}),
+        # Old buckets are removed by MongoDB itself
+        ('expires_at_ttl', [('expires_at', pymongo.ASCENDING)], {'expireAfterSeconds': 0}),
+    ],
+}
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_mongo_client(config):
+    """Return the process-wide MongoClient for config's URI and pool settings"""
+    options = {
+        'maxPoolSize': config.MONGO_MAX_POOL_SIZE,
+        'minPoolSize': config.MONGO_MIN_POOL_SIZE,
+        'maxIdleTimeMS': config.MONGO_MAX_IDLE_TIME_MS,
+        'connectTimeoutMS': config.MONGO_CONNECT_TIMEOUT_MS,
+        'socketTimeoutMS': config.MONGO_SOCKET_TIMEOUT_MS,
+        'serverSelectionTimeoutMS': config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        'retryWrites': config.MONGO_RETRY_WRITES,
+    }
+    cache_key = (config.MONGO_URI, tuple(sorted(options.items())))
+    with _clients_lock:
+        client = _clients.get(cache_key)
+        if client is None:
+            client = pymongo.MongoClient(config.MONGO_URI, **options)
+            _clients[cache_key] = client
+        return client
+
+
+def close_mongo_clients():
+    """Close every shared client (at shutdown)"""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+def paths_overlap(fields, other):
+    """True when a field of one $set is a parent path of a field of the other, e.g. 'a' and 'a.b'"""
+    return any(
+        key != other_key and (other_key.startswith(key + '.') or key.startswith(other_key + '.'))
+        for key in fields for other_key in other
+    )
+
+
+class WriteBuffer:
+    """Write-behind queue for MongoDB inserts and updates.
+    
+    Operations are kept in arrival order per collection and sent as one
+    ordered bulk_write once ``max_ops`` are waiting, every ``interval``
+    seconds, before a read of that collection and on close. Back-to-back
+    $set updates of the same document are merged into one, unless their
+    fields overlap (MongoDB rejects 'a' and 'a.b' in one $set). A batch that
+    fails on the network is put back in front of the queue and retried.
+    """
+    
+    def __init__(self, db, max_ops=100, interval=1.0):
+        self.db = db
+        self.max_ops = max(1, max_ops)
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()  # batches of a collection go out one at a time
+        self.pending = collections.defaultdict(list)  # collection -> [[kind, query or doc, update]]
+        self.size = 0
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._flush_loop, args=(interval,),
+                                       name='mongo-bulk', daemon=True)
+        self.thread.start()
+    
+    def insert(self, collection, doc):
+        self._add(collection, ['insert', dict(doc), None])
+    
+    def update(self, collection, query, update):
+        with self.lock:
+            ops = self.pending[collection]
+            last = ops[-1] if ops else None
+            if (last and last[0] == 'update' and last[1] == query
+                    and set(update) == {'$set'} and set(last[2]) == {'$set'}
+                    and not paths_overlap(last[2]['$set'], update['$set'])):
+                last[2]['$set'].update(update['$set'])
+                return
+        self._add(collection, ['update', query, {op: dict(fields) for op, fields in update.items()}])
+    
+    def _add(self, collection, op):
+        with self.lock:
+            self.pending[collection].append(op)
+            self.size += 1
+            full = self.size >= self.max_ops
+        if full:
+            self.flush()
+    
+    def _flush_loop(self, interval):
+        while not self._stop.wait(interval):
+            self.flush()
+    
+    def flush(self, collection=None):
+        """Send queued operations (of one collection, or all) now"""
+        with self.flush_lock:
+            with self.lock:
+                names = [collection] if collection else list(self.pending)
+                batches = {name: self.pending.pop(name) for name in names if self.pending.get(name)}
+                self.size -= sum(len(ops) for ops in batches.values())
+            for name, ops in batches.items():
+                self._write(name, ops)
+    
+    def _write(self, collection, ops):
+        requests = [
+            InsertOne(arg) if kind == 'insert' else UpdateOne(arg, update)
+            for kind, arg, update in ops
+        ]
+        try:
+            self.db[collection].bulk_write(requests, ordered=True)
+        except pymongo.errors.BulkWriteError as e:
+            # Ordered: everything before the failed op is written, nothing after it
+            failed = e.details['writeErrors'][0]['index']
+            print(f"⚠️ Dropping failed {collection} write: {e.details['writeErrors'][0].get('errmsg')}")
+            self._requeue(collection, ops[failed + 1:])
+        except pymongo.errors.PyMongoError as e:
+            print(f"⚠️ Bulk write to {collection} failed, will retry: {e}")
+            self._requeue(collection, ops)
+    
+    def _requeue(self, collection, ops):
+        if ops:
+            with self.lock:
+                self.pending[collection][:0] = ops
+                self.size += len(ops)
+    
+    def close(self):
+        self._stop.set()
+        self.thread.join()
+        self.flush()
+
 
 class MongoDB:
-    def __init__(self):
-        self.config = Config()
+    def __init__(self, config=None):
+        self.config = config or Config()
         self.client = None
         self.db = None
+        self.writes = None
+        self.index_errors = {}
+        node_id = self.config.NODE_ID
+        self.ids = IdGenerator(default_node_id() if node_id is None else node_id)
         self.connect()
     
     def connect(self):
         """Connect to MongoDB"""
         try:
             if self.config.MONGO_URI:
-                self.client = pymongo.MongoClient(self.config.MONGO_URI)
+                self.client = get_mongo_client(self.config)
+                # MongoClient connects lazily; ping so a dead cluster fails here,
+                # within serverSelectionTimeoutMS, instead of on the first query
+                self.client.admin.command('ping')
                 self.db = self.client[self.config.DB_NAME]
                 print("✅ Connected to MongoDB Atlas successfully")
+                self.ensure_indexes()
+                self.fix_legacy_dates()
+                if self.config.MONGO_BULK_INTERVAL > 0:
+                    self.writes = WriteBuffer(self.db, self.config.MONGO_BULK_SIZE, self.config.MONGO_BULK_INTERVAL)
             else:
                 raise Exception("No MongoDB URI provided")
         except Exception as e:
             print(f"❌ MongoDB connection failed: {e}")
+            self.client = None
+            self.db = None
             self.setup_local_database()
     
+    def ensure_indexes(self):
+        """Create the indexes the bot queries on; safe to run on every start"""
+        self.index_errors = {}
+        for collection, indexes in MONGO_INDEXES.items():
+            for name, keys, options in indexes:
+                try:
+                    self.db[collection].create_index(keys, name=name, **options)
+                except pymongo.errors.PyMongoError as e:
+                    # e.g. duplicate user_id values left from before the unique index
+                    self.index_errors[(collection, name)] = str(e)
+                    print(f"⚠️ Could not create index {collection}.{name}: {e}")
+        if not self.index_errors:
+            print("✅ MongoDB indexes ready")
+    
+    def index_health(self):
+        """List expected indexes with whether each one exists"""
+        try:
+            if hasattr(self, 'local_db'):
+                return self.local_db.index_health()
+            report = []
+            for collection, indexes in MONGO_INDEXES.items():
+                existing = self.db[collection].index_information()
+                for name, keys, options in indexes:
+                    report.append({
+                        'collection': collection,
+                        'index': name,
+                        'ok': name in existing,
+                        'error': self.index_errors.get((collection, name))
+                    })
+            return report
+        except Exception as e:
+            print(f"Error checking indexes: {e}")
+            return []
+    
+    @property
+    def is_local(self):
+        """True when running on the local fallback store"""
+        return hasattr(self, 'local_db')
+    
     def setup_local_database(self):
-        """Setup local database using JSON files"""
-        self.local_db = {
-            'users': [],
-            'channels': [],
-            'premium_users': [],
-            'user_files': [],
-            'downloads': []
-        }
-        
-        if not os.path.exists('data'):
-            os.makedirs('data')
+        """Setup local database (SQLite, or the legacy JSON files)"""
+        if self.config.LOCAL_DB_BACKEND == 'json':
+            self.local_db = JsonStore(
+                self.config.LOCAL_DATA_DIR,
+                flush_interval=self.config.JSON_FLUSH_INTERVAL,
+                flush_writes=self.config.JSON_FLUSH_WRITES
+            )
+            print("⚠️ Using local JSON database")
+        else:
+            self.local_db = SQLiteStore(self.config.LOCAL_DB_PATH)
+            migrated = self.local_db.migrate_json(self.config.LOCAL_DATA_DIR)
+            if migrated:
+                print(f"📦 Migrated {migrated} records from JSON files to SQLite")
+            print("⚠️ Using local SQLite database")
+        self.fix_legacy_dates()
+    
+    def fix_legacy_dates(self):
+        """Give files stored with downloaded_at 'now()' a real date so /myfiles can sort and page them.
         
-        print("⚠️ Using local JSON database")
+        On MongoDB the date comes from the ObjectId; local rows carry no
+        time at all and get LEGACY_DATE, which lists them last.
+        """
+        try:
+            if hasattr(self, 'local_db'):
+                fixed = self.local_db.update('user_files', {'downloaded_at': 'now()'}, {'downloaded_at': LEGACY_DATE})
+            else:
+                legacy = self.db.user_files.find({'downloaded_at': {'$type': 'string'}}, {'_id': 1})
+                updates = [
+                    # generation_time is UTC; other dates are stored as naive local time
+                    UpdateOne({'_id': doc['_id']}, {'$set': {
+                        'downloaded_at': doc['_id'].generation_time.astimezone().replace(tzinfo=None)
+                    }})
+                    for doc in legacy
+                ]
+                fixed = self.db.user_files.bulk_write(updates, ordered=False).modified_count if updates else 0
+            if fixed:
+                print(f"📅 Dated {fixed} files saved before download dates were recorded")
+        except Exception as e:
+            print(f"⚠️ Could not fix legacy file dates: {e}")
+    
+    def ping(self):
+        """Round-trip time to the database in ms, or None if it is unreachable"""
+        if hasattr(self, 'local_db'):
+            return 0.0
+        try:
+            started = time.perf_counter()
+            self.client.admin.command('ping')
+            return (time.perf_counter() - started) * 1000
+        except Exception as e:
+            print(f"⚠️ MongoDB ping failed: {e}")
+            return None
+    
+    def close(self):
+        """Close the database connection"""
+        if hasattr(self, 'local_db'):
+            self.local_db.close()
+        elif self.client:
+            if self.writes:
+                self.writes.close()
+            close_mongo_clients()
+    
+    def _insert(self, collection, doc):
+        """insert_one, through the write buffer when it is on"""
+        if self.writes:
+            self.writes.insert(collection, doc)
+        else:
+            self.db[collection].insert_one(doc)
+    
+    def _update(self, collection, query, update):
+        """update_one, through the write buffer when it is on"""
+        if self.writes:
+            self.writes.update(collection, query, update)
+        else:
+            self.db[collection].update_one(query, update)
+    
+    def _flush_writes(self, collection):
+        """Send buffered writes first so a read sees them"""
+        if self.writes:
+            self.writes.flush(collection)
     
     def save_user(self, user_data):
         """Save or update user information"""
@@ -47,7 +354,7 @@ class MongoDB:
             if hasattr(self, 'local_db'):
                 return self._save_user_local(user_data)
             else:
-                self.db.users.update_one(
+                result = self.db.users.update_one(
                     {'user_id': user_data['user_id']},
                     {
                         '$set': {
@@ -62,6 +369,8 @@ class MongoDB:
                     },
                     upsert=True
                 )
+                if result.upserted_id is not None:
+                    self.increment_counters({'users': 1})
                 return True
         except Exception as e:
             print(f"Error saving user: {e}")
@@ -70,68 +379,65 @@ class MongoDB:
     def _save_user_local(self, user_data):
         """Save user to local JSON"""
         try:
-            users = self.load_local_data('users')
-            existing_user = next((u for u in users if u['user_id'] == user_data['user_id']), None)
-            
-            if existing_user:
-                existing_user.update({
+            created = self.local_db.upsert(
+                'users',
+                {'user_id': user_data['user_id']},
+                {
                     'first_name': user_data['first_name'],
                     'username': user_data.get('username'),
                     'last_activity': datetime.datetime.now().isoformat()
-                })
-            else:
-                user_data['created_at'] = datetime.datetime.now().isoformat()
-                user_data['download_count'] = 0
-                users.append(user_data)
-            
-            self.save_local_data('users', users)
+                },
+                on_insert={
+                    'created_at': datetime.datetime.now().isoformat(),
+                    'download_count': 0
+                }
+            )
+            if created:
+                self.increment_counters({'users': 1})
             return True
         except Exception as e:
             print(f"Error saving user locally: {e}")
             return False
     
     def generate_download_id(self):
-        """Generate unique download ID"""
-        return ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+        """Generate unique, time-ordered download ID"""
+        return self.ids.next_id()
     
     def load_local_data(self, collection):
-        """Load data from local JSON file"""
+        """Load a whole collection from the local store"""
         try:
-            with open(f'data/{collection}.json', 'r') as f:
-                return json.load(f)
-        except:
-            return self.local_db.get(collection, [])
-    
-    def save_local_data(self, collection, data):
-        """Save data to local JSON file"""
-        try:
-            with open(f'data/{collection}.json', 'w') as f:
-                json.dump(data, f, indent=2, default=str)
-            return True
+            return self.local_db.find(collection)
         except Exception as e:
-            print(f"Error saving local data: {e}")
-            return False
+            print(f"Error loading local data: {e}")
+            return []
     
     def get_user(self, user_id):
         """Get user by ID"""
         try:
             if hasattr(self, 'local_db'):
-                users = self.load_local_data('users')
-                for user in users:
-                    if user['user_id'] == user_id:
-                        return user
-                return None
+                return self.local_db.find_one('users', {'user_id': user_id})
             else:
                 return self.db.users.find_one({'user_id': user_id})
         except:
             return None
     
+    def get_users(self, user_ids):
+        """Get many users in one query, as a dict keyed by user ID"""
+        try:
+            query = {'user_id': {'$in': list(user_ids)}}
+            if hasattr(self, 'local_db'):
+                users = self.local_db.find('users', query)
+            else:
+                users = self.db.users.find(query, {'_id': 0})
+            return {user['user_id']: user for user in users}
+        except:
+            return {}
+    
     def get_total_users(self):
         """Get total user count"""
         try:
             if hasattr(self, 'local_db'):
-                users = self.load_local_data('users')
-                return len(users)
+                return self.local_db.count('users')
             else:
                 return self.db.users.count_documents({})
         except:
@@ -141,10 +447,7 @@ class MongoDB:
         """Save premium user"""
         try:
             if hasattr(self, 'local_db'):
-                premium_users = self.load_local_data('premium_users')
-                premium_users = [u for u in premium_users if u['user_id'] != premium_data['user_id']]
-                premium_users.append(premium_data)
-                self.save_local_data('premium_users', premium_users)
+                self.local_db.upsert('premium_users', {'user_id': premium_data['user_id']}, premium_data)
                 return True
             else:
                 self.db.premium_users.update_one(
@@ -161,11 +464,8 @@ class MongoDB:
         """Get premium user"""
         try:
             if hasattr(self, 'local_db'):
-                premium_users = self.load_local_data('premium_users')
-                for user in premium_users:
-                    if user['user_id'] == user_id and user.get('active', True):
-                        return user
-                return None
+                user = self.local_db.find_one('premium_users', {'user_id': user_id})
+                return user if user and user.get('active', True) else None
             else:
                 return self.db.premium_users.find_one({
                     'user_id': user_id,
@@ -175,24 +475,56 @@ class MongoDB:
             return None
     
     def get_all_premium_users(self):
-        """Get all premium users"""
+        """Get all premium users; None if the read failed (not the same as no users)"""
         try:
             if hasattr(self, 'local_db'):
-                return self.load_local_data('premium_users')
+                return self.local_db.find('premium_users', {'active': True})
             else:
                 return list(self.db.premium_users.find({'active': True}))
-        except:
+        except Exception as e:
+            print(f"Error reading premium users: {e}")
+            return None
+    
+    def get_premium_users_page(self, after_id=None, before_id=None, limit=20):
+        """Page of active premium users by user ID (keyset pagination).
+        
+        With before_id the page ends just below it; results come back
+        nearest the cursor first, so a backwards page is in descending order.
+        """
+        try:
+            query = {'active': True}
+            direction = pymongo.ASCENDING
+            if before_id is not None:
+                query['user_id'] = {'$lt': before_id}
+                direction = pymongo.DESCENDING
+            elif after_id is not None:
+                query['user_id'] = {'$gt': after_id}
+            if hasattr(self, 'local_db'):
+                return self.local_db.find('premium_users', query, sort=[('user_id', direction)], limit=limit)
+            else:
+                return list(self.db.premium_users.find(query, {'_id': 0})
+                            .sort('user_id', direction).limit(limit))
+        except Exception as e:
+            print(f"Error listing premium users: {e}")
             return []
     
+    def expire_premium_users(self, now):
+        """Deactivate premium grants that expired before now, returns how many"""
+        try:
+            query = {'active': True, 'expires_at': {'$lt': now}}
+            if hasattr(self, 'local_db'):
+                return self.local_db.update('premium_users', query, {'active': False})
+            else:
+                return self.db.premium_users.update_many(query, {'$set': {'active': False}}).modified_count
+        except Exception as e:
+            print(f"Error expiring premium users: {e}")
+            return 0
+    
     def deactivate_premium_user(self, user_id):
         """Deactivate premium user"""
         try:
             if hasattr(self, 'local_db'):
-                premium_users = self.load_local_data('premium_users')
-                for user in premium_users:
-                    if user['user_id'] == user_id:
-                        user['active'] = False
-                self.save_local_data('premium_users', premium_users)
+                self.local_db.update('premium_users', {'user_id': user_id}, {'active': False})
                 return True
             else:
                 self.db.premium_users.update_one(
@@ -207,10 +539,7 @@ class MongoDB:
         """Save channel"""
         try:
             if hasattr(self, 'local_db'):
-                channels = self.load_local_data('channels')
-                channels = [c for c in channels if c['channel_id'] != channel_data['channel_id']]
-                channels.append(channel_data)
-                self.save_local_data('channels', channels)
+                self.local_db.upsert('channels', {'channel_id': channel_data['channel_id']}, channel_data)
                 return True
             else:
                 self.db.channels.update_one(
@@ -227,7 +556,7 @@ class MongoDB:
         """Get all channels"""
         try:
             if hasattr(self, 'local_db'):
-                return self.load_local_data('channels')
+                return self.local_db.find('channels')
             else:
                 return list(self.db.channels.find({}))
         except:
@@ -237,9 +566,7 @@ class MongoDB:
         """Delete channel"""
         try:
             if hasattr(self, 'local_db'):
-                channels = self.load_local_data('channels')
-                channels = [c for c in channels if c['channel_id'] != channel_id]
-                self.save_local_data('channels', channels)
+                self.local_db.delete('channels', {'channel_id': channel_id})
                 return True
             else:
                 self.db.channels.delete_one({'channel_id': channel_id})
@@ -251,12 +578,10 @@ class MongoDB:
         """Save user file"""
         try:
             if hasattr(self, 'local_db'):
-                user_files = self.load_local_data('user_files')
-                user_files.append(file_data)
-                self.save_local_data('user_files', user_files)
+                self.local_db.insert('user_files', file_data)
                 return True
             else:
-                self.db.user_files.insert_one(file_data)
+                self._insert('user_files', file_data)
                 return True
         except Exception as e:
             print(f"Error saving user file: {e}")
@@ -266,9 +591,10 @@ class MongoDB:
         """Get user files"""
         try:
             if hasattr(self, 'local_db'):
-                user_files = self.load_local_data('user_files')
-                return [f for f in user_files if f['user_id'] == user_id and f.get('active', True)]
+                user_files = self.local_db.find('user_files', {'user_id': user_id})
+                return [f for f in user_files if f.get('active', True)]
             else:
+                self._flush_writes('user_files')
                 return list(self.db.user_files.find({
                     'user_id': user_id,
                     'active': True
@@ -276,47 +602,542 @@ class MongoDB:
         except:
             return []
     
+    def _user_files_query(self, user_id, search=None):
+        query = {'user_id': user_id, 'active': True}
+        if search:
+            query['file_name'] = {'$regex': re.escape(search), '$options': 'i'}
+        return query
+    
+    def get_user_files_page(self, user_id, after=None, before=None, search=None, limit=20):
+        """Page of a user's files, newest first.
+        
+        Keyset pagination on (downloaded_at, download_id), the ID breaking
+        ties between files saved at the same moment. after is the cursor of
+        the last row shown and continues with older files; before pages
+        back towards newer ones and returns them oldest first, nearest the
+        cursor.
+        """
+        try:
+            query = self._user_files_query(user_id, search)
+            direction = pymongo.DESCENDING
+            cursor, operator = after, '$lt'
+            if before is not None:
+                cursor, operator, direction = before, '$gt', pymongo.ASCENDING
+            if cursor is not None:
+                downloaded_at, download_id = cursor
+                query['$or'] = [
+                    {'downloaded_at': {operator: downloaded_at}},
+                    {'downloaded_at': downloaded_at, 'download_id': {operator: download_id}}
+                ]
+            sort = [('downloaded_at', direction), ('download_id', direction)]
+            if hasattr(self, 'local_db'):
+                return self.local_db.find('user_files', query, sort=sort, limit=limit)
+            else:
+                self._flush_writes('user_files')
+                return list(self.db.user_files.find(query, FILE_LIST_FIELDS).sort(sort).limit(limit))
+        except Exception as e:
+            print(f"Error listing user files: {e}")
+            return []
+    
+    def count_user_files(self, user_id, search=None):
+        """Count a user's active files, optionally matching a name search"""
+        try:
+            query = self._user_files_query(user_id, search)
+            if hasattr(self, 'local_db'):
+                return self.local_db.count('user_files', query)
+            else:
+                self._flush_writes('user_files')
+                return self.db.user_files.count_documents(query)
+        except:
+            return 0
+    
+    def get_user_file(self, user_id, download_id):
+        """Get one stored file of a user by its download ID"""
+        try:
+            if hasattr(self, 'local_db'):
+                return self.local_db.find_one('user_files', {
+                    'user_id': user_id, 'download_id': download_id, 'active': True
+                })
+            else:
+                self._flush_writes('user_files')
+                return self.db.user_files.find_one({
+                    'user_id': user_id, 'download_id': download_id, 'active': True
+                })
+        except:
+            return None
+    
     def log_download(self, download_data):
         """Log download"""
         try:
             if hasattr(self, 'local_db'):
-                downloads = self.load_local_data('downloads')
-                downloads.append(download_data)
-                self.save_local_data('downloads', downloads)
+                self.local_db.insert('downloads', download_data)
                 return True
             else:
-                self.db.downloads.insert_one(download_data)
+                self._insert('downloads', download_data)
                 return True
         except Exception as e:
             print(f"Error logging download: {e}")
             return False
     
+    def log_downloads(self, downloads):
+        """Log a batch of downloads in one write"""
+        if not downloads:
+            return True
+        try:
+            if hasattr(self, 'local_db'):
+                self.local_db.insert_many('downloads', downloads)
+                return True
+            else:
+                self.db.downloads.insert_many(downloads, ordered=False)
+                return True
+        except Exception as e:
+            print(f"Error logging downloads: {e}")
+            return False
+    
+    def get_downloads_for_links(self, user_id, mega_links):
+        """Latest download of each of these links by this user, keyed by link"""
+        try:
+            query = {'user_id': user_id, 'mega_link': {'$in': list(mega_links)}}
+            if hasattr(self, 'local_db'):
+                downloads = self.local_db.find('downloads', query)
+            else:
+                self._flush_writes('downloads')
+                downloads = self.db.downloads.find(query).sort('queued_at', pymongo.ASCENDING)
+            return {download['mega_link']: download for download in downloads}
+        except:
+            return {}
+    
     def update_download_status(self, download_id, status, error_message=None):
         """Update download status"""
         try:
             if hasattr(self, 'local_db'):
-                downloads = self.load_local_data('downloads')
-                for download in downloads:
-                    if download.get('download_id') == download_id:
-                        download['status'] = status
-                        download['completed_at'] = datetime.datetime.now().isoformat()
-                        if error_message:
-                            download['error_message'] = error_message
-                self.save_local_data('downloads', downloads)
+                update_data = {'status': status}
+                if status in FINISHED_STATUSES:
+                    update_data['completed_at'] = datetime.datetime.now().isoformat()
+                if error_message:
+                    update_data['error_message'] = error_message
+                self.local_db.update('downloads', {'download_id': download_id}, update_data)
                 return True
             else:
-                update_data = {
-                    'status': status,
-                    'completed_at': datetime.datetime.now()
-                }
+                update_data = {'status': status}
+                if status in FINISHED_STATUSES:
+                    update_data['completed_at'] = datetime.datetime.now()
                 if error_message:
                     update_data['error_message'] = error_message
                 
-                self.db.downloads.update_one(
-                    {'download_id': download_id},
-                    {'$set': update_data}
-                )
+                self._update('downloads', {'download_id': download_id}, {'$set': update_data})
                 return True
         except Exception as e:
             print(f"Error updating download status: {e}")
-            return False
\ No newline at end of file
+            return False
+    
+    def update_download_progress(self, download_id, bitmap, segment_index, chunk_macs):
+        """Record a finished segment: the new bitmap plus that segment's chunk MACs"""
+        try:
+            if hasattr(self, 'local_db'):
+                download = self.local_db.find_one('downloads', {'download_id': download_id}) or {}
+                macs = download.get('chunk_macs') or {}
+                macs[str(segment_index)] = chunk_macs
+                self.local_db.update('downloads', {'download_id': download_id}, {
+                    'bitmap': bitmap,
+                    'chunk_macs': macs,
+                    'updated_at': datetime.datetime.now().isoformat()
+                })
+                return True
+            else:
+                self._update('downloads', {'download_id': download_id}, {'$set': {
+                    'bitmap': bitmap,
+                    f'chunk_macs.{segment_index}': chunk_macs,
+                    'updated_at': datetime.datetime.now()
+                }})
+                return True
+        except Exception as e:
+            print(f"Error updating download progress: {e}")
+            return False
+    
+    def add_download_part(self, download_id, part):
+        """Record an uploaded part of a split download"""
+        try:
+            if hasattr(self, 'local_db'):
+                download = self.local_db.find_one('downloads', {'download_id': download_id}) or {}
+                parts = [p for p in download.get('parts') or [] if p['index'] != part['index']]
+                self.local_db.update('downloads', {'download_id': download_id}, {
+                    'parts': sorted(parts + [part], key=lambda p: p['index']),
+                    'updated_at': datetime.datetime.now().isoformat()
+                })
+                return True
+            else:
+                self._update('downloads', {'download_id': download_id}, {
+                    '$push': {'parts': {'$each': [part], '$sort': {'index': 1}}},
+                    '$set': {'updated_at': datetime.datetime.now()}
+                })
+                return True
+        except Exception as e:
+            print(f"Error recording download part: {e}")
+            return False
+    
+    def clear_download_parts(self, download_id):
+        """Forget uploaded parts so a corrupted split download starts over"""
+        try:
+            if hasattr(self, 'local_db'):
+                self.local_db.update('downloads', {'download_id': download_id}, {
+                    'parts': [], 'bitmap': None, 'chunk_macs': {}
+                })
+                return True
+            else:
+                self._update('downloads', {'download_id': download_id},
+                             {'$set': {'parts': [], 'bitmap': None, 'chunk_macs': {}}})
+                return True
+        except Exception as e:
+            print(f"Error clearing download parts: {e}")
+            return False
+    
+    def get_download(self, download_id):
+        """Get download by ID"""
+        try:
+            if hasattr(self, 'local_db'):
+                return self.local_db.find_one('downloads', {'download_id': download_id})
+            else:
+                self._flush_writes('downloads')
+                return self.db.downloads.find_one({'download_id': download_id})
+        except:
+            return None
+    
+    def get_resumable_download(self, user_id, mega_link):
+        """Get the latest unfinished download of this link by this user"""
+        try:
+            if hasattr(self, 'local_db'):
+                downloads = self.local_db.find('downloads', {
+                    'user_id': user_id,
+                    'status': {'$in': list(RESUMABLE_STATUSES)},
+                    'mega_link': mega_link
+                })
+                matches = [d for d in downloads if d.get('segment_size')]
+                return matches[-1] if matches else None
+            else:
+                self._flush_writes('downloads')
+                return self.db.downloads.find_one(
+                    {
+                        'user_id': user_id,
+                        'mega_link': mega_link,
+                        'status': {'$in': list(RESUMABLE_STATUSES)},
+                        'segment_size': {'$exists': True}
+                    },
+                    sort=[('started_at', pymongo.DESCENDING)]
+                )
+        except:
+            return None
+    
+    def get_downloads_between(self, start, end=None, user_id=None, limit=100, newest_first=False):
+        """Downloads started in [start, end), oldest first unless newest_first; no end = up to now.
+        
+        Download IDs are time-ordered, so this is a range scan on the
+        download_id index with no sort step. Older random IDs can fall
+        inside the range by chance; the pattern drops them before the limit.
+        """
+        try:
+            query = {'download_id': {'$gte': id_at(start), '$regex': TIME_ID_PATTERN}}
+            if end is not None:
+                query['download_id']['$lt'] = id_at(end)
+            if user_id is not None:
+                query['user_id'] = user_id
+            direction = pymongo.DESCENDING if newest_first else pymongo.ASCENDING
+            if hasattr(self, 'local_db'):
+                return self.local_db.find('downloads', query, sort=[('download_id', direction)], limit=limit)
+            else:
+                self._flush_writes('downloads')
+                return list(self.db.downloads.find(query).sort('download_id', direction).limit(limit))
+        except Exception as e:
+            print(f"Error listing downloads: {e}")
+            return []
+    
+    def get_pending_downloads(self):
+        """Get queued downloads plus ones still running when the bot stopped, oldest first"""
+        try:
+            query = {'status': {'$in': ['queued', 'downloading']}}
+            if hasattr(self, 'local_db'):
+                downloads = self.local_db.find('downloads', query, sort=[('queued_at', 1)])
+                return [d for d in downloads if d.get('segment_size')]
+            else:
+                query['segment_size'] = {'$exists': True}
+                self._flush_writes('downloads')
+                return list(self.db.downloads.find(query).sort('queued_at', pymongo.ASCENDING))
+        except:
+            return []
+    
+    def get_user_ids_after(self, after_id=None, limit=500):
+        """Get the next page of user IDs in ascending order (keyset pagination)"""
+        try:
+            query = {'user_id': {'$gt': after_id}} if after_id is not None else {}
+            if hasattr(self, 'local_db'):
+                users = self.local_db.find('users', query, sort=[('user_id', 1)], limit=limit)
+                return [u['user_id'] for u in users]
+            else:
+                cursor = self.db.users.find(query, {'user_id': 1, '_id': 0}) \
+                    .sort('user_id', pymongo.ASCENDING).limit(limit)
+                return [u['user_id'] for u in cursor]
+        except Exception as e:
+            print(f"Error listing users: {e}")
+            return []
+    
+    def save_broadcast(self, broadcast_data):
+        """Save broadcast"""
+        try:
+            if hasattr(self, 'local_db'):
+                self.local_db.upsert('broadcasts', {'broadcast_id': broadcast_data['broadcast_id']}, broadcast_data)
+                return True
+            else:
+                self.db.broadcasts.update_one(
+                    {'broadcast_id': broadcast_data['broadcast_id']},
+                    {'$set': broadcast_data},
+                    upsert=True
+                )
+                return True
+        except Exception as e:
+            print(f"Error saving broadcast: {e}")
+            return False
+    
+    def update_broadcast(self, broadcast_id, fields):
+        """Update broadcast progress/status"""
+        try:
+            if hasattr(self, 'local_db'):
+                self.local_db.update('broadcasts', {'broadcast_id': broadcast_id}, fields)
+                return True
+            else:
+                self.db.broadcasts.update_one({'broadcast_id': broadcast_id}, {'$set': fields})
+                return True
+        except Exception as e:
+            print(f"Error updating broadcast: {e}")
+            return False
+    
+    def get_running_broadcasts(self):
+        """Get broadcasts that have not finished"""
+        try:
+            if hasattr(self, 'local_db'):
+                return self.local_db.find('broadcasts', {'status': 'running'})
+            else:
+                return list(self.db.broadcasts.find({'status': 'running'}))
+        except:
+            return []
+    
+    def get_cached_file(self, cache_key):
+        """Get cached upload by cache key"""
+        try:
+            if hasattr(self, 'local_db'):
+                return self.local_db.find_one('file_cache', {'cache_key': cache_key})
+            else:
+                return self.db.file_cache.find_one({'cache_key': cache_key})
+        except:
+            return None
+    
+    def save_cached_file(self, cache_data):
+        """Save cached upload"""
+        try:
+            if hasattr(self, 'local_db'):
+                self.local_db.upsert('file_cache', {'cache_key': cache_data['cache_key']}, cache_data)
+                return True
+            else:
+                self.db.file_cache.update_one(
+                    {'cache_key': cache_data['cache_key']},
+                    {'$set': cache_data},
+                    upsert=True
+                )
+                return True
+        except Exception as e:
+            print(f"Error saving cached file: {e}")
+            return False
+    
+    def record_cache_hit(self, cache_key):
+        """Count a cache hit"""
+        try:
+            if hasattr(self, 'local_db'):
+                entry = self.local_db.find_one('file_cache', {'cache_key': cache_key}) or {}
+                self.local_db.update('file_cache', {'cache_key': cache_key}, {
+                    'hits': entry.get('hits', 0) + 1,
+                    'last_hit_at': datetime.datetime.now().isoformat()
+                })
+                return True
+            else:
+                self.db.file_cache.update_one(
+                    {'cache_key': cache_key},
+                    {'$inc': {'hits': 1}, '$set': {'last_hit_at': datetime.datetime.now()}}
+                )
+                return True
+        except Exception as e:
+            print(f"Error recording cache hit: {e}")
+            return False
+    
+    def delete_cached_file(self, cache_key):
+        """Delete cached upload"""
+        try:
+            if hasattr(self, 'local_db'):
+                self.local_db.delete('file_cache', {'cache_key': cache_key})
+                return True
+            else:
+                self.db.file_cache.delete_one({'cache_key': cache_key})
+                return True
+        except:
+            return False
+    
+    def get_mega_accounts(self):
+        """Get stored quota state of every Mega account"""
+        try:
+            if hasattr(self, 'local_db'):
+                return self.local_db.find('mega_accounts')
+            else:
+                return list(self.db.mega_accounts.find({}, {'_id': 0}))
+        except:
+            return []
+    
+    def update_mega_account(self, account_id, fields):
+        """Set fields on a Mega account's quota state"""
+        try:
+            if hasattr(self, 'local_db'):
+                self.local_db.upsert('mega_accounts', {'account_id': account_id}, fields)
+                return True
+            else:
+                self.db.mega_accounts.update_one(
+                    {'account_id': account_id},
+                    {'$set': fields},
+                    upsert=True
+                )
+                return True
+        except Exception as e:
+            print(f"Error updating Mega account: {e}")
+            return False
+    
+    def add_mega_usage(self, account_id, used_bytes, window_started):
+        """Add transferred bytes to a Mega account's usage in the window started at window_started"""
+        try:
+            if hasattr(self, 'local_db'):
+                account = self.local_db.find_one('mega_accounts', {'account_id': account_id}) or {}
+                self.local_db.upsert('mega_accounts', {'account_id': account_id}, {
+                    'used': account.get('used', 0) + used_bytes,
+                    'window_started': window_started
+                })
+                return True
+            else:
+                self.db.mega_accounts.update_one(
+                    {'account_id': account_id},
+                    {'$inc': {'used': used_bytes}, '$set': {'window_started': window_started}},
+                    upsert=True
+                )
+                return True
+        except Exception as e:
+            print(f"Error recording Mega usage: {e}")
+            return False
+
+    def get_counters(self):
+        """All-time totals kept by increment_counters"""
+        try:
+            if hasattr(self, 'local_db'):
+                counters = self.local_db.find_one('counters', {'name': 'totals'})
+            else:
+                counters = self.db.counters.find_one({'name': 'totals'}, {'_id': 0})
+            counters = counters or {}
+            counters.pop('name', None)
+            return counters
+        except:
+            return {}
+    
+    def increment_counters(self, increments):
+        """Add to all-time totals, e.g. {'users': 1, 'completed': 1}"""
+        try:
+            if hasattr(self, 'local_db'):
+                counters = self.local_db.find_one('counters', {'name': 'totals'}) or {}
+                self.local_db.upsert('counters', {'name': 'totals'}, {
+                    name: counters.get(name, 0) + value for name, value in increments.items()
+                })
+                return True
+            else:
+                self.db.counters.update_one({'name': 'totals'}, {'$inc': increments}, upsert=True)
+                return True
+        except Exception as e:
+            print(f"Error updating counters: {e}")
+            return False
+    
+    def add_rollups(self, buckets):
+        """Add to per-minute / per-hour buckets: {(period, start, expires_at): increments}"""
+        try:
+            if hasattr(self, 'local_db'):
+                for (period, start, expires_at), increments in buckets.items():
+                    bucket = f"{period}:{start.isoformat()}"
+                    rollup = self.local_db.find_one('stats_rollups', {'bucket': bucket}) or {}
+                    self.local_db.upsert('stats_rollups', {'bucket': bucket}, {
+                        name: rollup.get(name, 0) + value for name, value in increments.items()
+                    }, on_insert={'period': period, 'start': start, 'expires_at': expires_at})
+                return True
+            else:
+                if buckets:
+                    self.db.stats_rollups.bulk_write([
+                        UpdateOne(
+                            {'bucket': f"{period}:{start.isoformat()}"},
+                            {'$inc': increments,
+                             '$setOnInsert': {'period': period, 'start': start, 'expires_at': expires_at}},
+                            upsert=True
+                        )
+                        for (period, start, expires_at), increments in buckets.items()
+                    ], ordered=False)
+                return True
+        except Exception as e:
+            print(f"Error saving stats rollups: {e}")
+            return False
+    
+    def get_rollups(self, period, since):
+        """Buckets of one period starting at or after since, oldest first"""
+        try:
+            query = {'period': period, 'start': {'$gte': since}}
+            if hasattr(self, 'local_db'):
+                return self.local_db.find('stats_rollups', query, sort=[('start', 1)])
+            else:
+                return list(self.db.stats_rollups.find(query, {'_id': 0}).sort('start', pymongo.ASCENDING))
+        except:
+            return []
+    
+    def delete_expired_rollups(self, now):
+        """Drop buckets past their expiry (MongoDB does this with a TTL index)"""
+        try:
+            if hasattr(self, 'local_db'):
+                return self.local_db.delete('stats_rollups', {'expires_at': {'$lt': now}})
+            return 0
+        except:
+            return 0
+
+class AsyncMongoDB:
+    """Awaitable version of MongoDB with the same method names.
+    
+    Every call runs on a bounded thread pool so a slow round-trip never
+    blocks the event loop. Local stores get a single worker so their
+    read-modify-write cycles stay serialized.
+    """
+    
+    # Pure helpers that never touch storage stay synchronous
+    SYNC_METHODS = {'generate_download_id'}
+    
+    def __init__(self, db=None):
+        self.sync = db or MongoDB()
+        workers = 1 if self.sync.is_local else self.sync.config.DB_MAX_WORKERS
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db')
+    
+    def __getattr__(self, name):
+        attr = getattr(self.sync, name)
+        if not callable(attr) or name in self.SYNC_METHODS:
+            return attr
+        
+        @functools.wraps(attr)
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(attr, *args, **kwargs))
+        
+        call = metrics.instrument_db(name, call)
+        setattr(self, name, call)
+        return call
+    
+    @property
+    def is_local(self):
+        return self.sync.is_local
+    
+    def close(self):
+        """Finish queued calls, stop the worker threads and close the database"""
+        self.executor.shutdown(wait=True)
+        self.sync.close()
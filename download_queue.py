@@ -0,0 +1,200 @@
+import asyncio
+import collections
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Throughput assumed per worker until real downloads have been measured
+DEFAULT_SPEED = 5 * 1024 * 1024
+
+
+class Job:
+    """A queued download: its downloads record plus the chat message tracking it"""
+
+    def __init__(self, record, status_msg=None):
+        self.record = record
+        self.status_msg = status_msg
+        self.started_at = None
+        self.progress = None
+
+    @property
+    def download_id(self):
+        return self.record['download_id']
+
+    @property
+    def user_id(self):
+        return self.record['user_id']
+
+    @property
+    def size(self):
+        return self.record.get('size_bytes') or 0
+
+    @property
+    def done_bytes(self):
+        return self.progress.done if self.progress else 0
+
+
+class DownloadBatch:
+    """Aggregate progress of jobs queued together (a folder or a list of links)"""
+
+    def __init__(self, name, status_msg):
+        self.batch_id = None
+        self.name = name
+        self.status_msg = status_msg
+        self.jobs = []
+        self.finished = {}  # download_id -> succeeded
+        self.sealed = False  # set once every job has been added
+
+    def add(self, job):
+        self.jobs.append(job)
+
+    def seal(self):
+        self.sealed = True
+
+    def finish(self, job, succeeded):
+        self.finished[job.download_id] = succeeded
+
+    @property
+    def complete(self):
+        return self.sealed and len(self.finished) == len(self.jobs)
+
+    @property
+    def total_bytes(self):
+        return sum(job.size for job in self.jobs)
+
+    @property
+    def done_bytes(self):
+        return sum(job.size if job.download_id in self.finished else job.done_bytes for job in self.jobs)
+
+    @property
+    def succeeded(self):
+        return sum(self.finished.values())
+
+    @property
+    def failed(self):
+        return len(self.finished) - self.succeeded
+
+
+class DownloadQueue:
+    """Fair download scheduler with global and per-user concurrency caps.
+
+    Waiting jobs are grouped per user and picked round-robin, so a user who
+    queues 40 links gets one turn per cycle like everybody else. The
+    downloads collection is the source of truth: queued and interrupted
+    jobs are reloaded from it on start.
+    """
+
+    def __init__(self, db, config, runner):
+        self.db = db
+        self.config = config
+        self.runner = runner
+        self.waiting = collections.OrderedDict()  # user_id -> deque of jobs, in turn order
+        self.active = collections.Counter()
+        self.running = {}
+        self.condition = asyncio.Condition()
+        self.workers = []
+        self.speed = DEFAULT_SPEED  # bytes/s per worker, moving average
+
+    async def start(self):
+        """Reload unfinished jobs and start the worker pool"""
+        for record in await self.db.get_pending_downloads():
+            self._enqueue(Job(record))
+        self.workers = [
+            asyncio.create_task(self._worker(), name=f'download-worker-{i}')
+            for i in range(self.config.DOWNLOAD_WORKERS)
+        ]
+        if self.waiting:
+            logger.info("Reloaded %s queued downloads", sum(len(q) for q in self.waiting.values()))
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
+    def _enqueue(self, job):
+        self.waiting.setdefault(job.user_id, collections.deque()).append(job)
+
+    async def submit(self, record, status_msg=None):
+        """Add a job and wake a worker"""
+        job = Job(record, status_msg)
+        async with self.condition:
+            self._enqueue(job)
+            self.condition.notify()
+        return job
+
+    def find(self, user_id, mega_link):
+        """Return the queued or running job for this link, if any"""
+        for job in list(self.running.values()) + list(self.waiting.get(user_id, ())):
+            if job.user_id == user_id and job.record.get('mega_link') == mega_link:
+                return job
+        return None
+
+    def _next_job(self):
+        """Take the next job round-robin, skipping users at their cap"""
+        for user_id in list(self.waiting):
+            # Files of one folder link may run side by side
+            folder = self.waiting[user_id][0].record.get('folder_id')
+            cap = self.config.FOLDER_CONCURRENCY if folder else self.config.DOWNLOADS_PER_USER
+            if self.active[user_id] >= cap:
+                continue
+            jobs = self.waiting.pop(user_id)
+            job = jobs.popleft()
+            if jobs:
+                self.waiting[user_id] = jobs  # back of the line for the next turn
+            return job
+        return None
+
+    async def _worker(self):
+        while True:
+            async with self.condition:
+                job = self._next_job()
+                while job is None:
+                    await self.condition.wait()
+                    job = self._next_job()
+                self.active[job.user_id] += 1
+                self.running[job.download_id] = job
+            job.started_at = time.monotonic()
+            try:
+                await self.runner(job)
+                self._record_speed(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Download job %s crashed", job.download_id)
+            finally:
+                async with self.condition:
+                    self.active[job.user_id] -= 1
+                    self.running.pop(job.download_id, None)
+                    self.condition.notify_all()
+
+    def _record_speed(self, job):
+        elapsed = time.monotonic() - job.started_at
+        if job.size and elapsed > 1:
+            self.speed = 0.7 * self.speed + 0.3 * (job.size / elapsed)
+
+    def _dispatch_order(self):
+        """Waiting jobs in the order round-robin will start them"""
+        queues = [list(jobs) for jobs in self.waiting.values()]
+        order = []
+        for turn in range(max((len(q) for q in queues), default=0)):
+            order.extend(q[turn] for q in queues if turn < len(q))
+        return order
+
+    def positions(self, user_id=None):
+        """[(job, position, eta_seconds)] for waiting jobs, optionally one user's"""
+        workers = max(self.config.DOWNLOAD_WORKERS, 1)
+        backlog = sum(job.size for job in self.running.values()) / 2  # assume half done
+        result = []
+        for position, job in enumerate(self._dispatch_order(), 1):
+            backlog += job.size
+            if user_id is None or job.user_id == user_id:
+                result.append((job, position, backlog / (self.speed * workers)))
+        return result
+
+    def running_jobs(self, user_id=None):
+        return [job for job in self.running.values() if user_id is None or job.user_id == user_id]
+
+    @property
+    def waiting_count(self):
+        return sum(len(jobs) for jobs in self.waiting.values())
@@ -0,0 +1,126 @@
+import collections
+import datetime
+import hashlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class FileCache:
+    """Cache of finished Mega downloads.
+
+    Entries are keyed by a hash of the Mega handle and key, so a repeated
+    link is recognised before any Mega or Telegram traffic. The database
+    side remembers the Telegram file_id of the upload; the disk side keeps
+    recent downloads in FILE_CACHE_DIR, evicting least recently used files
+    once FILE_CACHE_MAX_SIZE is exceeded.
+    """
+
+    def __init__(self, db, config):
+        self.db = db
+        self.directory = config.FILE_CACHE_DIR
+        self.max_size = config.FILE_CACHE_MAX_SIZE
+        self.hits = 0
+        self.misses = 0
+        self.files = collections.OrderedDict()  # cache_key -> size, least recent first
+        self.disk_usage = 0
+        if self.max_size:
+            os.makedirs(self.directory, exist_ok=True)
+            self._scan()
+
+    @staticmethod
+    def key_for(handle, key):
+        return hashlib.sha256(f"{handle}:{key}".encode()).hexdigest()
+
+    def _scan(self):
+        """Index files left by earlier runs, oldest access first"""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((stat.st_atime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self.files[name] = size
+            self.disk_usage += size
+        self._evict()
+
+    async def lookup(self, handle, key):
+        """Return the cache entry with Telegram file_ids, counting a miss if there is none.
+
+        A hit is only counted by record_hit() once the cached send worked;
+        a stale entry is counted as a miss by forget().
+        """
+        entry = await self.db.get_cached_file(self.key_for(handle, key))
+        if entry and (entry.get('file_id') or entry.get('parts')):
+            return entry
+        self.misses += 1
+        return None
+
+    async def record_hit(self, cache_key):
+        self.hits += 1
+        await self.db.record_cache_hit(cache_key)
+
+    async def remember(self, cache_key, file_name, size, file_id=None, parts=None):
+        """Store the upload's file_id, or the file_ids of its parts in order"""
+        await self.db.save_cached_file({
+            'cache_key': cache_key,
+            'file_name': file_name,
+            'size_bytes': size,
+            'file_id': file_id,
+            'parts': parts or [],
+            'created_at': datetime.datetime.now(),
+            'hits': 0
+        })
+
+    async def forget(self, cache_key):
+        """Drop an entry Telegram no longer accepts; the request falls back to a download"""
+        self.misses += 1
+        await self.db.delete_cached_file(cache_key)
+
+    def local_path(self, cache_key):
+        """Path of a cached local copy, marking it recently used"""
+        if cache_key not in self.files:
+            return None
+        path = os.path.join(self.directory, cache_key)
+        if not os.path.exists(path):
+            self.disk_usage -= self.files.pop(cache_key)
+            return None
+        self.files.move_to_end(cache_key)
+        os.utime(path)
+        return path
+
+    def store_local(self, cache_key, path):
+        """Move a finished download into the cache; returns (path, cached)"""
+        size = os.path.getsize(path)
+        if not self.max_size or size > self.max_size:
+            return path, False
+        cached_path = os.path.join(self.directory, cache_key)
+        os.replace(path, cached_path)
+        self.disk_usage += size - self.files.pop(cache_key, 0)
+        self.files[cache_key] = size
+        self._evict(keep=cache_key)
+        return cached_path, True
+
+    def _evict(self, keep=None):
+        while self.disk_usage > self.max_size and self.files:
+            cache_key, size = next(iter(self.files.items()))
+            if cache_key == keep:
+                break
+            self.files.pop(cache_key)
+            self.disk_usage -= size
+            try:
+                os.remove(os.path.join(self.directory, cache_key))
+            except OSError as e:
+                logger.warning("Could not evict cached file %s: %s", cache_key, e)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': 100.0 * self.hits / total if total else 0.0,
+            'disk_files': len(self.files),
+            'disk_usage': self.disk_usage
+        }
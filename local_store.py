@@ -0,0 +1,540 @@
+import atexit
+import datetime
+import json
+import os
+import re
+import sqlite3
+import threading
+
+# Per collection: the unique key (None = no natural key) and the fields
+# copied into real columns so they can be indexed and filtered in SQL.
+SCHEMAS = {
+    'users': {'key': 'user_id', 'columns': ['user_id']},
+    'premium_users': {'key': 'user_id', 'columns': ['user_id', 'active']},
+    'channels': {'key': 'channel_id', 'columns': ['channel_id']},
+    'user_files': {'key': None, 'columns': ['user_id', 'download_id', 'active', 'downloaded_at', 'file_name']},
+    'downloads': {'key': 'download_id', 'columns': ['download_id', 'user_id', 'status', 'started_at', 'mega_link']},
+    'broadcasts': {'key': 'broadcast_id', 'columns': ['broadcast_id', 'status']},
+    'file_cache': {'key': 'cache_key', 'columns': ['cache_key']},
+    'mega_accounts': {'key': 'account_id', 'columns': ['account_id']},
+    'counters': {'key': 'name', 'columns': ['name']},
+    'stats_rollups': {'key': 'bucket', 'columns': ['bucket', 'period', 'start', 'expires_at']},
+}
+
+# Secondary indexes beyond the unique key
+INDEXES = {
+    'premium_users': [('active', 'user_id')],
+    'stats_rollups': [('period', 'start'), ('expires_at',)],
+    'user_files': [('user_id', 'active', 'downloaded_at', 'download_id'), ('download_id',)],
+    'downloads': [('user_id', 'status'), ('status',), ('user_id', 'mega_link'), ('user_id', 'download_id')],
+}
+
+
+def json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+def json_doc(doc):
+    """A document as it reads back from disk, datetimes as ISO strings"""
+    return json.loads(json.dumps(doc, default=json_default))
+
+
+# Comparison operators understood by both stores, with their SQL form
+OPERATORS = {'$gt': '>', '$gte': '>=', '$lt': '<', '$lte': '<=', '$ne': '!='}
+
+
+def _compare(value, operator, bound):
+    if operator == '$ne':
+        return value != bound
+    if value is None:
+        return False
+    if operator == '$gt':
+        return value > bound
+    if operator == '$gte':
+        return value >= bound
+    if operator == '$lt':
+        return value < bound
+    return value <= bound
+
+
+def regex_pattern(expected):
+    """Python pattern for a {'$regex': ..., '$options': ...} query"""
+    flags = '(?i)' if 'i' in expected.get('$options', '') else ''
+    return flags + expected['$regex']
+
+
+def regexp(pattern, value):
+    return value is not None and re.search(pattern, str(value)) is not None
+
+
+def matches(doc, query):
+    """Check a document against an equality / $in / range / $regex / $or query"""
+    for field, expected in (query or {}).items():
+        if field == '$or':
+            if not any(matches(doc, alternative) for alternative in expected):
+                return False
+            continue
+        value = doc.get(field)
+        if isinstance(expected, dict):
+            for operator, bound in expected.items():
+                if operator == '$options':
+                    continue
+                if operator == '$regex':
+                    if not regexp(regex_pattern(expected), value):
+                        return False
+                elif operator == '$in':
+                    if value not in [json_value(item) for item in bound]:
+                        return False
+                elif not _compare(value, operator, json_value(bound)):
+                    return False
+        elif value != json_value(expected):
+            return False
+    return True
+
+
+def json_value(value):
+    """Datetimes are stored as ISO strings locally; compare them that way"""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def sort_docs(docs, sort):
+    """Sort documents by [(field, direction)], None values first"""
+    for field, direction in reversed(sort or []):
+        docs.sort(key=lambda doc: (doc.get(field) is not None, doc.get(field)),
+                  reverse=direction < 0)
+    return docs
+
+
+class JsonStore:
+    """Legacy store: one data/<collection>.json file per collection.
+
+    Each collection is read from disk once and kept in memory as a dict
+    keyed by its id. Writes only touch memory and mark the collection
+    dirty; dirty collections are written back with an atomic rename after
+    ``flush_writes`` writes, every ``flush_interval`` seconds, and on close.
+    ``flush_writes=1`` gives the old write-every-change durability.
+    """
+
+    def __init__(self, data_dir='data', flush_interval=0, flush_writes=1):
+        self.data_dir = data_dir
+        self.flush_writes = max(1, flush_writes)
+        self.lock = threading.RLock()
+        self.collections = {}
+        self.dirty = set()
+        self.pending_writes = 0
+        self._next_id = 0
+        self._closed = False
+        self._stop = threading.Event()
+        os.makedirs(data_dir, exist_ok=True)
+        if flush_interval > 0:
+            threading.Thread(target=self._flush_loop, args=(flush_interval,),
+                             name='json-flush', daemon=True).start()
+        atexit.register(self.close)
+
+    def _path(self, collection):
+        return os.path.join(self.data_dir, f'{collection}.json')
+
+    def load(self, collection):
+        """Read a collection straight from its file"""
+        try:
+            with open(self._path(collection), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def save(self, collection, docs):
+        """Write a collection to its file via temp file + rename"""
+        path = self._path(collection)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(docs, f, indent=2, default=json_default)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _doc_id(self, collection, doc):
+        key = SCHEMAS.get(collection, {}).get('key')
+        if key and doc.get(key) is not None:
+            return doc[key]
+        self._next_id += 1
+        return ('#', self._next_id)
+
+    def _docs(self, collection):
+        docs = self.collections.get(collection)
+        if docs is None:
+            docs = {}
+            for doc in self.load(collection):
+                docs[self._doc_id(collection, doc)] = doc
+            self.collections[collection] = docs
+        return docs
+
+    def _candidates(self, collection, query):
+        """Use the id dict for key lookups, scan otherwise"""
+        docs = self._docs(collection)
+        key = SCHEMAS.get(collection, {}).get('key')
+        if key and key in (query or {}):
+            if not isinstance(query[key], dict):
+                doc = docs.get(query[key])
+                return [doc] if doc is not None else []
+            if set(query[key]) == {'$in'}:
+                return [docs[value] for value in query[key]['$in'] if value in docs]
+        return list(docs.values())
+
+    def _written(self, collection):
+        self.dirty.add(collection)
+        self.pending_writes += 1
+        if self.pending_writes >= self.flush_writes:
+            self.flush()
+
+    def _flush_loop(self, interval):
+        while not self._stop.wait(interval):
+            self.flush()
+
+    def flush(self):
+        """Write every dirty collection back to disk"""
+        with self.lock:
+            for collection in list(self.dirty):
+                try:
+                    self.save(collection, list(self.collections[collection].values()))
+                    self.dirty.discard(collection)
+                except Exception as e:
+                    print(f"Error flushing {collection}: {e}")
+            self.pending_writes = 0
+
+    def find(self, collection, query=None, sort=None, limit=None, skip=0):
+        with self.lock:
+            docs = [doc for doc in self._candidates(collection, query) if matches(doc, query)]
+        docs = sort_docs(docs, sort)[skip:]
+        return [dict(doc) for doc in (docs[:limit] if limit else docs)]
+
+    def find_one(self, collection, query):
+        with self.lock:
+            doc = next((doc for doc in self._candidates(collection, query) if matches(doc, query)), None)
+            return dict(doc) if doc is not None else None
+
+    def count(self, collection, query=None):
+        with self.lock:
+            if not query:
+                return len(self._docs(collection))
+            return sum(1 for doc in self._candidates(collection, query) if matches(doc, query))
+
+    def insert(self, collection, doc):
+        with self.lock:
+            self._docs(collection)[self._doc_id(collection, doc)] = json_doc(doc)
+            self._written(collection)
+
+    def insert_many(self, collection, docs):
+        with self.lock:
+            target = self._docs(collection)
+            for doc in docs:
+                target[self._doc_id(collection, doc)] = json_doc(doc)
+            self._written(collection)
+
+    def upsert(self, collection, query, fields, on_insert=None):
+        with self.lock:
+            existing = next((doc for doc in self._candidates(collection, query) if matches(doc, query)), None)
+            if existing is not None:
+                existing.update(json_doc(fields))
+            else:
+                doc = json_doc({**query, **(on_insert or {}), **fields})
+                self._docs(collection)[self._doc_id(collection, doc)] = doc
+            self._written(collection)
+            return existing is None
+
+    def update(self, collection, query, fields):
+        with self.lock:
+            matched = 0
+            fields = json_doc(fields)
+            for doc in self._candidates(collection, query):
+                if matches(doc, query):
+                    doc.update(fields)
+                    matched += 1
+            if matched:
+                self._written(collection)
+            return matched
+
+    def delete(self, collection, query):
+        with self.lock:
+            docs = self._docs(collection)
+            doomed = [doc_id for doc_id, doc in docs.items() if matches(doc, query)]
+            for doc_id in doomed:
+                del docs[doc_id]
+            if doomed:
+                self._written(collection)
+            return len(doomed)
+
+    def index_health(self):
+        """Key lookups use the in-memory id dicts; there are no other indexes"""
+        return [
+            {'collection': collection, 'index': f'{schema["key"]} (memory)', 'ok': True, 'error': None}
+            for collection, schema in SCHEMAS.items() if schema['key']
+        ]
+
+    def close(self):
+        """Stop the flush timer and write out anything still dirty"""
+        with self.lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._stop.set()
+            self.flush()
+
+
+class SQLiteStore:
+    """Indexed local store on SQLite in WAL mode.
+
+    Documents are kept as JSON, with key and lookup fields mirrored into
+    indexed columns, so lookups by user_id / download_id / channel_id are
+    index seeks and every write touches one row in one transaction.
+    """
+
+    def __init__(self, path='data/local.db'):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.create_function('REGEXP', 2, regexp, deterministic=True)
+        self._create_schema()
+
+    def _create_schema(self):
+        with self.lock:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+            for collection, schema in SCHEMAS.items():
+                self.conn.execute(
+                    f'CREATE TABLE IF NOT EXISTS {collection} '
+                    f'(id INTEGER PRIMARY KEY AUTOINCREMENT, doc TEXT NOT NULL)'
+                )
+                self._ensure_columns(collection, schema['columns'])
+                if schema['key']:
+                    self.conn.execute(
+                        f'CREATE UNIQUE INDEX IF NOT EXISTS {collection}_{schema["key"]}_key '
+                        f'ON {collection} ({schema["key"]})'
+                    )
+                for fields in INDEXES.get(collection, []):
+                    self.conn.execute(
+                        f'CREATE INDEX IF NOT EXISTS {collection}_{"_".join(fields)}_idx '
+                        f'ON {collection} ({", ".join(fields)})'
+                    )
+
+    def _ensure_columns(self, collection, columns):
+        """Add columns introduced by newer schemas and backfill them from doc"""
+        existing = {row[1] for row in self.conn.execute(f'PRAGMA table_info({collection})')}
+        for column in columns:
+            if column not in existing:
+                self.conn.execute(f'ALTER TABLE {collection} ADD COLUMN {column}')
+                self.conn.execute(
+                    f"UPDATE {collection} SET {column} = json_extract(doc, '$.{column}')"
+                )
+
+    @staticmethod
+    def _column_value(value):
+        return json_value(value)
+
+    def _row_values(self, collection, doc):
+        return [self._column_value(doc.get(column)) for column in SCHEMAS[collection]['columns']]
+
+    def _where(self, collection, query):
+        """Split a query into SQL on indexed columns and a residual filter"""
+        columns = SCHEMAS[collection]['columns']
+        clauses, params, residual = [], [], {}
+        for field, expected in (query or {}).items():
+            if field == '$or':
+                alternatives = [self._where(collection, alternative) for alternative in expected]
+                if any(rest for _, _, rest in alternatives):
+                    residual[field] = expected
+                else:
+                    clauses.append('(' + ' OR '.join(
+                        f'({where[len(" WHERE "):]})' if where else '1' for where, _, _ in alternatives
+                    ) + ')' if alternatives else '0')
+                    for _, alternative_params, _ in alternatives:
+                        params.extend(alternative_params)
+            elif field not in columns:
+                residual[field] = expected
+            elif isinstance(expected, dict):
+                for operator, bound in expected.items():
+                    if operator == '$options':
+                        continue
+                    if operator == '$regex':
+                        clauses.append(f'{field} REGEXP ?')  # SQLite calls regexp(pattern, value)
+                        params.append(regex_pattern(expected))
+                    elif operator == '$in':
+                        values = [self._column_value(v) for v in bound]
+                        if not values:
+                            clauses.append('0')
+                        else:
+                            clauses.append(f'{field} IN ({", ".join("?" * len(values))})')
+                            params.extend(values)
+                    else:
+                        clauses.append(f'{field} {OPERATORS[operator]} ?')
+                        params.append(self._column_value(bound))
+            elif expected is None:
+                clauses.append(f'{field} IS NULL')
+            else:
+                clauses.append(f'{field} = ?')
+                params.append(self._column_value(expected))
+        where = f' WHERE {" AND ".join(clauses)}' if clauses else ''
+        return where, params, residual
+
+    def _select(self, collection, query, limit=None, sort=None, skip=0):
+        where, params, residual = self._where(collection, query)
+        columns = SCHEMAS[collection]['columns']
+        in_sql = all(field in columns for field, _ in sort or [])
+        order = ', '.join(f'{field} {"DESC" if direction < 0 else "ASC"}' for field, direction in sort or [])
+        sql = f'SELECT id, doc FROM {collection}{where} ORDER BY {order + ", " if in_sql and order else ""}id'
+        if in_sql and not residual and (limit or skip):
+            sql += f' LIMIT {int(limit) if limit else -1} OFFSET {int(skip)}'
+            skip = 0
+        rows = []
+        for row_id, raw in self.conn.execute(sql, params):
+            doc = json.loads(raw)
+            if matches(doc, residual):
+                rows.append((row_id, doc))
+                if in_sql and limit and len(rows) >= skip + limit:
+                    break
+        if not in_sql:
+            row_ids = {id(doc): row_id for row_id, doc in rows}
+            rows = [(row_ids[id(doc)], doc) for doc in sort_docs([doc for _, doc in rows], sort)]
+        rows = rows[skip:]
+        return rows[:limit] if limit else rows
+
+    def _write(self, collection, row_id, doc):
+        columns = SCHEMAS[collection]['columns']
+        assignments = ', '.join(f'{column} = ?' for column in columns)
+        self.conn.execute(
+            f'UPDATE {collection} SET doc = ?, {assignments} WHERE id = ?',
+            [json.dumps(doc, default=json_default)] + self._row_values(collection, doc) + [row_id]
+        )
+
+    def _insert(self, collection, doc):
+        columns = SCHEMAS[collection]['columns']
+        self.conn.execute(
+            f'INSERT INTO {collection} (doc, {", ".join(columns)}) '
+            f'VALUES (?{", ?" * len(columns)})',
+            [json.dumps(doc, default=json_default)] + self._row_values(collection, doc)
+        )
+
+    def find(self, collection, query=None, sort=None, limit=None, skip=0):
+        with self.lock:
+            return [doc for _, doc in self._select(collection, query, limit, sort, skip)]
+
+    def find_one(self, collection, query):
+        with self.lock:
+            rows = self._select(collection, query, limit=1)
+            return rows[0][1] if rows else None
+
+    def count(self, collection, query=None):
+        with self.lock:
+            where, params, residual = self._where(collection, query)
+            if residual:
+                return len(self._select(collection, query))
+            return self.conn.execute(f'SELECT COUNT(*) FROM {collection}{where}', params).fetchone()[0]
+
+    def insert(self, collection, doc):
+        with self.lock:
+            self._insert(collection, doc)
+
+    def insert_many(self, collection, docs):
+        """Insert docs in one transaction"""
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                for doc in docs:
+                    self._insert(collection, doc)
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def upsert(self, collection, query, fields, on_insert=None):
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self._select(collection, query, limit=1)
+                if rows:
+                    row_id, doc = rows[0]
+                    doc.update(fields)
+                    self._write(collection, row_id, doc)
+                else:
+                    self._insert(collection, {**query, **(on_insert or {}), **fields})
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            return not rows
+
+    def update(self, collection, query, fields):
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self._select(collection, query)
+                for row_id, doc in rows:
+                    doc.update(fields)
+                    self._write(collection, row_id, doc)
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            return len(rows)
+
+    def delete(self, collection, query):
+        with self.lock:
+            rows = self._select(collection, query)
+            if rows:
+                ids = [row_id for row_id, _ in rows]
+                self.conn.execute(
+                    f'DELETE FROM {collection} WHERE id IN ({", ".join("?" * len(ids))})', ids
+                )
+            return len(rows)
+
+    def index_health(self):
+        """List expected indexes with whether each one exists"""
+        with self.lock:
+            existing = {row[0] for row in self.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index'"
+            )}
+        report = []
+        for collection, schema in SCHEMAS.items():
+            names = [f'{collection}_{schema["key"]}_key'] if schema['key'] else []
+            names += [f'{collection}_{"_".join(fields)}_idx' for fields in INDEXES.get(collection, [])]
+            report += [{'collection': collection, 'index': name, 'ok': name in existing, 'error': None}
+                       for name in names]
+        return report
+
+    def migrate_json(self, data_dir='data'):
+        """One-shot import of the legacy data/<collection>.json files"""
+        with self.lock:
+            if self.conn.execute("SELECT 1 FROM meta WHERE name = 'json_migrated'").fetchone():
+                return 0
+            source = JsonStore(data_dir)
+            imported = 0
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                for collection, schema in SCHEMAS.items():
+                    key = schema['key']
+                    for doc in source.load(collection):
+                        if key and doc.get(key) is not None:
+                            rows = self._select(collection, {key: doc[key]}, limit=1)
+                            if rows:
+                                self._write(collection, rows[0][0], doc)
+                                continue
+                        self._insert(collection, doc)
+                        imported += 1
+                self.conn.execute(
+                    "INSERT INTO meta (name, value) VALUES ('json_migrated', ?)",
+                    [datetime.datetime.now().isoformat()]
+                )
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            return imported
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import time
+
+from mega_downloader import MegaError
+from utils import format_eta, human_size
+
+logger = logging.getLogger(__name__)
+
+ANONYMOUS = 'anonymous'
+
+
+class MegaAccount:
+    """Transfer quota bookkeeping for one Mega login (or anonymous access)"""
+
+    def __init__(self, account_id, quota, email=None, password=None):
+        self.account_id = account_id
+        self.email = email
+        self.password = password
+        self.sid = None
+        self.quota = quota
+        self.used = 0
+        self.window_started = time.time()
+        self.reserved = 0  # bytes promised to downloads still running
+        self.blocked_until = 0.0
+
+    @property
+    def anonymous(self):
+        return self.email is None
+
+    @property
+    def remaining(self):
+        return self.quota - self.used - self.reserved
+
+    def blocked(self, now):
+        return self.blocked_until > now
+
+
+class AccountPool:
+    """Spreads Mega downloads over several accounts by remaining quota.
+
+    Each account's usage is counted per MEGA_QUOTA_WINDOW and stored in the
+    mega_accounts collection, so a restart does not forget an exhausted
+    account. A download asks for an account big enough for what it still
+    has to fetch; when Mega reports the quota as spent anyway (-17, 509 or
+    a 'tl' wait), the account is blocked for the time Mega gave and the
+    download moves on to the next one.
+    """
+
+    def __init__(self, db, config, downloader):
+        self.db = db
+        self.config = config
+        self.downloader = downloader
+        self.window = config.MEGA_QUOTA_WINDOW
+        self.cooldown = config.MEGA_QUOTA_COOLDOWN
+        self.lock = asyncio.Lock()
+        self.accounts = [
+            MegaAccount(email.lower(), config.MEGA_ACCOUNT_QUOTA, email, password)
+            for email, password in config.MEGA_ACCOUNTS
+        ]
+        if config.MEGA_ANONYMOUS:
+            self.accounts.append(MegaAccount(ANONYMOUS, config.MEGA_ANONYMOUS_QUOTA))
+
+    async def load(self):
+        """Restore usage and blocks recorded before a restart"""
+        stored = {doc['account_id']: doc for doc in await self.db.get_mega_accounts()}
+        for account in self.accounts:
+            doc = stored.get(account.account_id)
+            if doc:
+                account.used = doc.get('used', 0)
+                account.window_started = doc.get('window_started', account.window_started)
+                account.blocked_until = doc.get('blocked_until', 0.0)
+
+    async def _roll_window(self, account, now):
+        if now - account.window_started < self.window:
+            return
+        account.used = 0
+        account.window_started = now
+        await self.db.update_mega_account(account.account_id, {'used': 0, 'window_started': now})
+
+    async def acquire(self, size):
+        """Reserve ``size`` bytes on the account with the most quota left.
+
+        Returns None while every account is blocked or too low on quota;
+        wait_time() says when to try again.
+        """
+        async with self.lock:
+            now = time.time()
+            for account in self.accounts:
+                await self._roll_window(account, now)
+            candidates = sorted(
+                (account for account in self.accounts if not account.blocked(now)),
+                key=lambda account: account.remaining, reverse=True
+            )
+            for account in candidates:
+                if account.remaining < size and account.used + account.reserved > 0:
+                    break  # sorted: nobody else has room either
+                if not account.anonymous and account.sid is None and not await self._login(account):
+                    continue
+                account.reserved += size
+                return account
+            return None
+
+    async def _login(self, account):
+        try:
+            account.sid = await self.downloader.login(account.email, account.password)
+        except MegaError as e:
+            logger.warning("Mega login failed for %s: %s", account.email, e)
+            account.blocked_until = time.time() + self.cooldown
+            return False
+        try:
+            quota = await self.downloader.get_transfer_quota(account.sid)
+        except MegaError as e:
+            logger.warning("Could not read transfer quota of %s: %s", account.email, e)
+            quota = None
+        if quota:
+            account.quota, account.used = quota
+            await self.db.update_mega_account(account.account_id, {
+                'used': account.used, 'window_started': account.window_started
+            })
+        logger.info("Logged in to Mega as %s (%s of %s used)", account.email,
+                    human_size(account.used), human_size(account.quota))
+        return True
+
+    async def release(self, account, size, transferred):
+        """Return a reservation and count what was actually fetched"""
+        account.reserved -= size
+        if transferred:
+            account.used += transferred
+            # The window start goes with the usage so a restart keeps counting the same window
+            await self.db.add_mega_usage(account.account_id, transferred, account.window_started)
+
+    async def exhausted(self, account, retry_after=None):
+        """Block an account Mega refused for quota"""
+        account.blocked_until = time.time() + (retry_after or self.cooldown)
+        logger.warning("Mega quota exhausted on %s, blocked for %ss",
+                       account.account_id, int(retry_after or self.cooldown))
+        await self.db.update_mega_account(account.account_id, {'blocked_until': account.blocked_until})
+
+    def wait_time(self):
+        """Seconds until some account should have quota again"""
+        now = time.time()
+        waits = [
+            account.blocked_until - now if account.blocked(now) else
+            account.window_started + self.window - now
+            for account in self.accounts
+        ]
+        return max(min(waits, default=self.cooldown), 1)
+
+    def status(self):
+        """One line per account for /stats"""
+        now = time.time()
+        lines = []
+        for account in self.accounts:
+            line = f"{account.account_id}: {human_size(account.used)} / {human_size(account.quota)}"
+            if account.blocked(now):
+                line += f" (blocked {format_eta(account.blocked_until - now)})"
+            lines.append(line)
+        return lines
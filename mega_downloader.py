@@ -0,0 +1,916 @@
+import asyncio
+import base64
+import bisect
+import copy
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from Crypto.Cipher import AES
+from Crypto.Util import Counter
+
+from ratelimit import BandwidthLimiter
+
+logger = logging.getLogger(__name__)
+
+FILE_LINK_RE = re.compile(
+    r'mega(?:\.co)?\.nz/(?:file/([\w-]+)#([\w-]+)|#!([\w-]+)!([\w-]+))'
+)
+FOLDER_LINK_RE = re.compile(
+    r'mega(?:\.co)?\.nz/(?:folder/([\w-]+)#([\w-]+)(?:/file/([\w-]+))?|#F!([\w-]+)!([\w-]+)(?:!([\w-]+))?)'
+)
+MEGA_URL_RE = re.compile(r'(?:https?://)?(?:www\.)?mega(?:\.co)?\.nz/[^\s<>"\']+')
+FOLDER_CACHE_TTL = 300  # seconds a folder listing is reused for its files
+
+BLOCK_SIZE = 64 * 1024  # read size for streamed ranges
+
+
+class MegaError(Exception):
+    """Raised when Mega returns an error or bad data"""
+
+
+class MegaQuotaError(MegaError):
+    """Transfer quota exceeded (API error -17 or HTTP 509) for the account in use"""
+
+    def __init__(self, message="Mega transfer quota exceeded", retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def base64_url_decode(data):
+    data += '=='[(2 - len(data) * 3) % 4:]
+    return base64.urlsafe_b64decode(data.replace(',', ''))
+
+
+def base64_url_encode(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def a32_to_bytes(a):
+    return struct.pack('>%dI' % len(a), *a)
+
+
+def bytes_to_a32(b):
+    if len(b) % 4:
+        b += b'\0' * (4 - len(b) % 4)
+    return struct.unpack('>%dI' % (len(b) // 4), b)
+
+
+def decrypt_attr(attr, key):
+    """Decrypt a node attribute blob (name etc.)"""
+    cipher = AES.new(a32_to_bytes(key), AES.MODE_CBC, b'\0' * 16)
+    text = cipher.decrypt(attr).rstrip(b'\0').decode('utf-8', 'ignore')
+    return json.loads(text[4:]) if text.startswith('MEGA{"') else {}
+
+
+def get_chunks(size):
+    """Yield Mega's MAC chunk boundaries: 128KB growing to 1MB steps"""
+    p = 0
+    s = 0x20000
+    while p + s < size:
+        yield (p, s)
+        p += s
+        if s < 0x100000:
+            s += 0x20000
+    yield (p, size - p)
+
+
+def parse_mega_link(url):
+    """Extract (handle, key) from a Mega file link, or None"""
+    match = FILE_LINK_RE.search(url or '')
+    if not match:
+        return None
+    handle = match.group(1) or match.group(3)
+    key = match.group(2) or match.group(4)
+    return handle, key
+
+
+def parse_mega_folder(url):
+    """Extract (folder_handle, folder_key, file_handle) from a Mega folder link, or None.
+
+    file_handle is set for links to one file inside the folder.
+    """
+    match = FOLDER_LINK_RE.search(url or '')
+    if not match:
+        return None
+    if match.group(1):
+        return match.group(1), match.group(2), match.group(3)
+    return match.group(4), match.group(5), match.group(6)
+
+
+def folder_file_link(folder_handle, folder_key, file_handle):
+    return f"https://mega.nz/folder/{folder_handle}#{folder_key}/file/{file_handle}"
+
+
+def link_id(url):
+    """(handle, key) identifying the file behind a file link or folder file link"""
+    folder = parse_mega_folder(url)
+    if folder and folder[2]:
+        return folder[2], folder[1]
+    return parse_mega_link(url)
+
+
+def extract_mega_links(text):
+    """Every distinct file or folder link in a message, in order"""
+    links = []
+    for match in MEGA_URL_RE.finditer(text or ''):
+        link = match.group(0).rstrip('.,;:!?)]}')
+        if not link.startswith('http'):
+            link = 'https://' + link
+        if (parse_mega_link(link) or parse_mega_folder(link)) and link not in links:
+            links.append(link)
+    return links
+
+
+def decrypt_key(key, master_key):
+    """AES-ECB decrypt a node key (a32 words) with the folder key"""
+    cipher = AES.new(a32_to_bytes(master_key), AES.MODE_ECB)
+    return bytes_to_a32(cipher.decrypt(a32_to_bytes(key)))
+
+
+def raise_api_error(code):
+    if code == -17:  # EOVERQUOTA
+        raise MegaQuotaError()
+    raise MegaError(f"Mega API error {code}")
+
+
+def session_params(sid):
+    return {'sid': sid} if sid else {}
+
+
+def aes_cbc_encrypt_a32(data, key):
+    cipher = AES.new(a32_to_bytes(key), AES.MODE_CBC, b'\0' * 16)
+    return bytes_to_a32(cipher.encrypt(a32_to_bytes(data)))
+
+
+def prepare_key(password):
+    """Password key of v1 accounts (65536 AES rounds)"""
+    words = bytes_to_a32(password)
+    key = (0x93C467E3, 0x7DB0C7A4, 0xD1BE3F81, 0x0152CB56)
+    ciphers = [AES.new(a32_to_bytes((words[j:j + 4] + (0, 0, 0))[:4]), AES.MODE_ECB)
+               for j in range(0, len(words), 4)]
+    data = a32_to_bytes(key)
+    for _ in range(0x10000):
+        for cipher in ciphers:
+            data = cipher.encrypt(data)
+    return bytes_to_a32(data)
+
+
+def string_hash(text, key):
+    """User hash of v1 accounts"""
+    words = bytes_to_a32(text)
+    hashed = [0, 0, 0, 0]
+    for i, word in enumerate(words):
+        hashed[i % 4] ^= word
+    cipher = AES.new(a32_to_bytes(key), AES.MODE_ECB)
+    data = a32_to_bytes(hashed)
+    for _ in range(0x4000):
+        data = cipher.encrypt(data)
+    hashed = bytes_to_a32(data)
+    return base64_url_encode(a32_to_bytes((hashed[0], hashed[2])))
+
+
+def read_mpi(data):
+    """Split one multi-precision integer off the front of data"""
+    length = ((data[0] * 256 + data[1] + 7) // 8) + 2
+    return int.from_bytes(data[2:length], 'big'), data[length:]
+
+
+def decrypt_session_id(csid, privk, master_key):
+    """RSA-decrypt the session id of accounts that log in with csid"""
+    privk = a32_to_bytes(decrypt_key(bytes_to_a32(base64_url_decode(privk)), master_key))
+    p, privk = read_mpi(privk)
+    q, privk = read_mpi(privk)
+    d, privk = read_mpi(privk)
+    encrypted, _ = read_mpi(base64_url_decode(csid))
+    decrypted = pow(encrypted, d, p * q)
+    sid = decrypted.to_bytes((decrypted.bit_length() + 7) // 8, 'big')
+    return base64_url_encode(sid[:43])
+
+
+class MegaFile:
+    """A public Mega file with its decoded key material"""
+
+    def __init__(self, handle, key, size, name, url, path=None):
+        self.handle = handle
+        self.key = key
+        self.size = size
+        self.name = name
+        self.url = url
+        self.path = path or name  # location inside a folder link
+        self.aes_key = a32_to_bytes((key[0] ^ key[4], key[1] ^ key[5],
+                                     key[2] ^ key[6], key[3] ^ key[7]))
+        self.iv = key[4:6]
+        self.meta_mac = key[6:8]
+
+
+class Segment:
+    """A byte range fetched by one connection, aligned to Mega chunks"""
+
+    def __init__(self, index, start, chunks):
+        self.index = index
+        self.start = start
+        self.chunks = chunks
+        self.end = start + sum(size for _, size in chunks)
+
+    @property
+    def length(self):
+        return self.end - self.start
+
+
+def plan_segments(size, segment_size):
+    """Group Mega's MAC chunks into download segments"""
+    segments = []
+    chunks = []
+    start = 0
+    length = 0
+    for chunk in get_chunks(size):
+        chunks.append(chunk)
+        length += chunk[1]
+        if length >= segment_size:
+            segments.append(Segment(len(segments), start, chunks))
+            start += length
+            chunks = []
+            length = 0
+    if chunks and length:
+        segments.append(Segment(len(segments), start, chunks))
+    return segments
+
+
+class ChunkMac:
+    """Incremental CBC-MAC over Mega chunks as plaintext streams in"""
+
+    def __init__(self, aes_key, iv, chunks):
+        self.aes_key = aes_key
+        self.mac_iv = a32_to_bytes((iv[0], iv[1], iv[0], iv[1]))
+        self.sizes = iter([size for _, size in chunks])
+        self.macs = []
+        self._next_chunk()
+
+    def _next_chunk(self):
+        self.remaining = next(self.sizes, 0)
+        self.cipher = AES.new(self.aes_key, AES.MODE_CBC, self.mac_iv)
+        self.pending = b''
+        self.last = b''
+
+    def update(self, data):
+        view = memoryview(data)
+        while len(view):
+            take = min(len(view), self.remaining)
+            self._feed(view[:take])
+            view = view[take:]
+            self.remaining -= take
+            if self.remaining == 0:
+                self._finish_chunk()
+
+    def _feed(self, data):
+        if self.pending:
+            data = self.pending + bytes(data)
+        usable = len(data) - len(data) % 16
+        if usable:
+            self.last = self.cipher.encrypt(data[:usable])[-16:]
+        self.pending = bytes(data[usable:])
+
+    def _finish_chunk(self):
+        if self.pending:
+            self.last = self.cipher.encrypt(self.pending + b'\0' * (16 - len(self.pending)))
+        self.macs.append(self.last)
+        self._next_chunk()
+
+
+def condense_macs(chunk_macs, aes_key):
+    """Fold per-chunk MACs into Mega's 64-bit meta-MAC"""
+    cipher = AES.new(aes_key, AES.MODE_CBC, b'\0' * 16)
+    last = b'\0' * 16
+    for mac in chunk_macs:
+        last = cipher.encrypt(mac)
+    mac = bytes_to_a32(last)
+    return (mac[0] ^ mac[1], mac[2] ^ mac[3])
+
+
+class DownloadProgress:
+    """Thread-safe byte counter shared by the segment workers"""
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.transferred = 0  # bytes actually fetched from Mega, for quota accounting
+        self.paused_until = None  # epoch time while waiting for transfer quota
+        self._lock = threading.Lock()
+
+    def add(self, count):
+        with self._lock:
+            self.done += count
+
+    def transfer(self, count):
+        with self._lock:
+            self.done += count
+            self.transferred += count
+
+    def reset(self):
+        """Forget progress before an attempt re-counts what is on disk"""
+        with self._lock:
+            self.done = 0
+
+    @property
+    def percent(self):
+        return 100.0 * self.done / self.total if self.total else 100.0
+
+
+class ChunkBitmap:
+    """One bit per segment, stored base64-encoded on the download record"""
+
+    def __init__(self, size=0, data=None):
+        self.size = size
+        self.bits = bytearray(data or b'')
+        self.bits.extend(b'\0' * ((size + 7) // 8 - len(self.bits)))
+
+    @classmethod
+    def from_b64(cls, text, size):
+        return cls(size, base64.b64decode(text) if text else None)
+
+    def to_b64(self):
+        return base64.b64encode(bytes(self.bits)).decode()
+
+    def set(self, index):
+        self.bits[index // 8] |= 1 << (index % 8)
+
+    def clear(self, index):
+        self.bits[index // 8] &= ~(1 << (index % 8)) & 0xFF
+
+    def is_set(self, index):
+        return bool(self.bits[index // 8] & (1 << (index % 8)))
+
+    def count(self):
+        return sum(bin(byte).count('1') for byte in self.bits)
+
+
+class DownloadState:
+    """Resume state: which segments are on disk and their chunk MACs"""
+
+    def __init__(self, segment_size, bitmap=None, chunk_macs=None):
+        self.segment_size = segment_size
+        self.bitmap = bitmap or ChunkBitmap()
+        self.chunk_macs = chunk_macs or {}
+
+    @classmethod
+    def from_record(cls, record):
+        """Rebuild state from a downloads document"""
+        count = record.get('segment_count', 0)
+        macs = {}
+        for index, encoded in (record.get('chunk_macs') or {}).items():
+            raw = base64.b64decode(encoded)
+            macs[int(index)] = [raw[i:i + 16] for i in range(0, len(raw), 16)]
+        return cls(record['segment_size'], ChunkBitmap.from_b64(record.get('bitmap'), count), macs)
+
+    @staticmethod
+    def encode_macs(macs):
+        return base64.b64encode(b''.join(macs)).decode()
+
+    def resize(self, count):
+        if self.bitmap.size != count:
+            self.bitmap = ChunkBitmap(count, self.bitmap.bits[:(count + 7) // 8])
+
+    def mark_done(self, index, macs):
+        self.chunk_macs[index] = macs
+        self.bitmap.set(index)
+
+    def clear(self, index):
+        self.chunk_macs.pop(index, None)
+        self.bitmap.clear(index)
+
+    def reset(self):
+        self.bitmap = ChunkBitmap(self.bitmap.size)
+        self.chunk_macs = {}
+
+    def done_bytes(self, size):
+        """Bytes of a ``size`` byte file covered by finished segments"""
+        return sum(
+            segment.length for segment in plan_segments(size, self.segment_size)
+            if segment.index < self.bitmap.size and self.bitmap.is_set(segment.index)
+        )
+
+    def meta_mac(self, aes_key):
+        ordered = [mac for index in sorted(self.chunk_macs) for mac in self.chunk_macs[index]]
+        return condense_macs(ordered, aes_key)
+
+
+class FileSink:
+    """Writes a download into one file at its final offsets"""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    async def open(self, size, segments):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        os.ftruncate(self.fd, size)
+
+    def pwrite(self, data, offset):
+        os.pwrite(self.fd, data, offset)
+
+    def pread(self, length, offset):
+        return os.pread(self.fd, length, offset)
+
+    def available(self, segment):
+        return True
+
+    async def reserve(self, segment):
+        pass
+
+    async def segment_done(self, segment):
+        pass
+
+    async def close(self, complete):
+        if self.fd is None:
+            return
+        if complete:
+            os.fsync(self.fd)
+        os.close(self.fd)
+        self.fd = None
+
+
+class Part:
+    """A run of whole segments small enough to upload as one Telegram file"""
+
+    def __init__(self, index, segments, path):
+        self.index = index
+        self.start = segments[0].start
+        self.end = segments[-1].end
+        self.path = path
+        self.remaining = {segment.index for segment in segments}
+        self.fd = None
+        self.uploaded = False
+
+    @property
+    def size(self):
+        return self.end - self.start
+
+    @property
+    def complete(self):
+        return not self.remaining
+
+
+def is_partial_file(name):
+    """True for files an unfinished download leaves: <id>.part or split parts <id>.001, ..."""
+    suffix = name.rpartition('.')[2]
+    return suffix == 'part' or (len(suffix) == 3 and suffix.isdigit())
+
+
+def plan_parts(segments, part_size, path_prefix):
+    """Group segments into parts of at most part_size bytes (one segment minimum)"""
+    parts = []
+    group = []
+    for segment in segments:
+        if group and segment.end - group[0].start > part_size:
+            parts.append(Part(len(parts), group, f"{path_prefix}.{len(parts) + 1:03d}"))
+            group = []
+        group.append(segment)
+    if group:
+        parts.append(Part(len(parts), group, f"{path_prefix}.{len(parts) + 1:03d}"))
+    return parts
+
+
+class SplitSink:
+    """Writes a download as numbered part files that can be uploaded early.
+
+    Parts are cut on segment boundaries, so a part is finished as soon as
+    its segments are. ``next_part()`` hands finished parts out in order and
+    ``release()`` deletes them once uploaded; segments more than ``window``
+    parts ahead of the upload wait in ``reserve()``, which keeps disk usage
+    at a few parts however large the file is.
+    """
+
+    def __init__(self, path_prefix, part_size, window, uploaded=()):
+        self.path_prefix = path_prefix
+        self.part_size = part_size
+        self.window = max(window, 1)
+        self.uploaded = set(uploaded)
+        self.parts = []
+        self.starts = []
+        self.by_segment = {}
+        self.next_upload = 0
+        self.opened = False
+        self.condition = asyncio.Condition()
+        self._lock = threading.Lock()
+
+    async def open(self, size, segments):
+        if self.opened:
+            return  # a retried download (e.g. on another account) keeps its parts
+        self.parts = plan_parts(segments, self.part_size, self.path_prefix)
+        self.starts = [part.start for part in self.parts]
+        for part in self.parts:
+            part.uploaded = part.index in self.uploaded
+            for index in part.remaining:
+                self.by_segment[index] = part
+        self._skip_uploaded()
+        async with self.condition:
+            self.opened = True
+            self.condition.notify_all()
+
+    def _part_at(self, offset):
+        return self.parts[bisect.bisect_right(self.starts, offset) - 1]
+
+    def _fd(self, part):
+        with self._lock:
+            if part.fd is None:
+                part.fd = os.open(part.path, os.O_RDWR | os.O_CREAT, 0o644)
+                os.ftruncate(part.fd, part.size)
+            return part.fd
+
+    def pwrite(self, data, offset):
+        part = self._part_at(offset)
+        os.pwrite(self._fd(part), data, offset - part.start)
+
+    def pread(self, length, offset):
+        part = self._part_at(offset)
+        if not os.path.exists(part.path):
+            return b''
+        return os.pread(self._fd(part), length, offset - part.start)
+
+    def available(self, segment):
+        """False for segments whose part was already uploaded and deleted"""
+        return not self.by_segment[segment.index].uploaded
+
+    async def reserve(self, segment):
+        """Wait until the segment's part is inside the upload window"""
+        part = self.by_segment[segment.index]
+        async with self.condition:
+            await self.condition.wait_for(lambda: part.index < self.next_upload + self.window)
+
+    async def segment_done(self, segment):
+        part = self.by_segment[segment.index]
+        part.remaining.discard(segment.index)
+        if part.complete:
+            self._close_part(part)
+            async with self.condition:
+                self.condition.notify_all()
+
+    def _close_part(self, part):
+        with self._lock:
+            if part.fd is not None:
+                os.close(part.fd)
+                part.fd = None
+
+    def _skip_uploaded(self):
+        while self.next_upload < len(self.parts) and self.parts[self.next_upload].uploaded:
+            self.next_upload += 1
+
+    async def next_part(self):
+        """The next finished part in order, or None when every part is uploaded"""
+        async with self.condition:
+            await self.condition.wait_for(
+                lambda: self.opened and (self.next_upload >= len(self.parts)
+                                         or self.parts[self.next_upload].complete)
+            )
+            if self.next_upload >= len(self.parts):
+                return None
+            return self.parts[self.next_upload]
+
+    async def release(self, part):
+        """Drop an uploaded part from disk and let the download move ahead"""
+        part.uploaded = True
+        if os.path.exists(part.path):
+            os.remove(part.path)
+        async with self.condition:
+            self._skip_uploaded()
+            self.condition.notify_all()
+
+    async def close(self, complete):
+        for part in self.parts:
+            self._close_part(part)
+
+    def remove_files(self):
+        for part in self.parts:
+            if os.path.exists(part.path):
+                os.remove(part.path)
+
+
+class MegaClient:
+    """Minimal Mega API client for public links"""
+
+    def __init__(self, api_url, timeout=30):
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+        self.sequence = random.randint(0, 0xFFFFFFFF)
+        self._folders = {}  # folder handle -> (listed_at, files)
+
+    def api_request(self, payload, params=None, retries=5):
+        """POST a single command to the Mega API"""
+        for attempt in range(retries):
+            self.sequence += 1
+            query = {'id': self.sequence}
+            query.update(params or {})
+            response = requests.post(f"{self.api_url}/cs", params=query,
+                                     data=json.dumps([payload]), timeout=self.timeout)
+            response.raise_for_status()
+            result = response.json()
+            if isinstance(result, int):
+                if result == -3:  # EAGAIN
+                    time.sleep(min(2 ** attempt, 30))
+                    continue
+                raise_api_error(result)
+            result = result[0]
+            if isinstance(result, int) and result < 0:
+                raise_api_error(result)
+            return result
+        raise MegaError("Mega API is busy, try again later")
+
+    def get_public_file(self, handle, key, sid=None):
+        """Resolve a public file link to its size, name and download URL"""
+        key = bytes_to_a32(base64_url_decode(key))
+        if len(key) != 8:
+            raise MegaError("Invalid Mega file key")
+        data = self.api_request({'a': 'g', 'g': 1, 'p': handle, 'ssl': 2}, session_params(sid))
+        if data.get('tl'):
+            raise MegaQuotaError(retry_after=data['tl'])
+        if 'g' not in data:
+            raise MegaError("File is not available for download")
+        mega_file = MegaFile(handle, key, data['s'], None, data['g'])
+        attrs = decrypt_attr(base64_url_decode(data['at']), bytes_to_a32(mega_file.aes_key))
+        mega_file.name = attrs.get('n') or handle
+        return mega_file
+
+    def login(self, email, password):
+        """Log in to a Mega account and return its session id"""
+        email = email.lower()
+        prelogin = self.api_request({'a': 'us0', 'user': email})
+        if prelogin.get('v') == 2:
+            derived = hashlib.pbkdf2_hmac('sha512', password.encode(),
+                                          base64_url_decode(prelogin['s']), 100000, 32)
+            password_key = bytes_to_a32(derived[:16])
+            user_hash = base64_url_encode(derived[16:])
+        else:
+            password_key = prepare_key(password.encode())
+            user_hash = string_hash(email.encode(), password_key)
+
+        data = self.api_request({'a': 'us', 'user': email, 'uh': user_hash})
+        master_key = decrypt_key(bytes_to_a32(base64_url_decode(data['k'])), password_key)
+        if 'tsid' in data:
+            tsid = base64_url_decode(data['tsid'])
+            check = AES.new(a32_to_bytes(master_key), AES.MODE_ECB).encrypt(tsid[:16])
+            if check != tsid[-16:]:
+                raise MegaError("Mega login failed: bad session")
+            return data['tsid']
+        if 'csid' in data:
+            return decrypt_session_id(data['csid'], data['privk'], master_key)
+        raise MegaError("Mega login failed: no session returned")
+
+    def get_transfer_quota(self, sid):
+        """(max transfer bytes, used bytes) reported for an account, or None"""
+        data = self.api_request({'a': 'uq', 'xfer': 1}, session_params(sid))
+        if 'mxfer' not in data:
+            return None
+        return data['mxfer'], data.get('caxfer', 0) + data.get('csxfer', 0)
+
+    def get_folder(self, folder_handle, folder_key):
+        """List every file below a public folder link in one API call"""
+        cached = self._folders.get(folder_handle)
+        if cached and time.monotonic() - cached[0] < FOLDER_CACHE_TTL:
+            return cached[1]
+        master_key = bytes_to_a32(base64_url_decode(folder_key))
+        if len(master_key) != 4:
+            raise MegaError("Invalid Mega folder key")
+        data = self.api_request({'a': 'f', 'c': 1, 'r': 1, 'ca': 1}, params={'n': folder_handle})
+
+        names = {}
+        parents = {}
+        files = []
+        for node in data.get('f', []):
+            if node.get('t') not in (0, 1) or ':' not in node.get('k', ''):
+                continue
+            encrypted = node['k'].split('/')[0].split(':', 1)[1]
+            key = decrypt_key(bytes_to_a32(base64_url_decode(encrypted)), master_key)
+            attr_key = key if node['t'] == 1 else (key[0] ^ key[4], key[1] ^ key[5],
+                                                   key[2] ^ key[6], key[3] ^ key[7])
+            names[node['h']] = decrypt_attr(base64_url_decode(node['a']), attr_key).get('n') or node['h']
+            parents[node['h']] = node.get('p')
+            if node['t'] == 0 and len(key) == 8:
+                files.append(MegaFile(node['h'], key, node.get('s', 0), names[node['h']], None))
+
+        def folder_path(handle):
+            parts = []
+            while handle in names:
+                parts.append(names[handle])
+                handle = parents.get(handle)
+            return '/'.join(reversed(parts))
+
+        for mega_file in files:
+            mega_file.path = folder_path(mega_file.handle)
+        now = time.monotonic()
+        # Drop expired listings so folders seen once are not kept forever
+        for handle in [h for h, (listed_at, _) in self._folders.items() if now - listed_at >= FOLDER_CACHE_TTL]:
+            del self._folders[handle]
+        self._folders[folder_handle] = (now, files)
+        return files
+
+    def get_folder_file(self, folder_handle, folder_key, file_handle, sid=None):
+        """Resolve one file of a folder link, including its download URL"""
+        for listed in self.get_folder(folder_handle, folder_key):
+            if listed.handle == file_handle:
+                mega_file = copy.copy(listed)  # listings are cached and shared
+                break
+        else:
+            raise MegaError("File is no longer in this folder")
+        data = self.api_request({'a': 'g', 'g': 1, 'n': file_handle, 'ssl': 2},
+                                {'n': folder_handle, **session_params(sid)})
+        if data.get('tl'):
+            raise MegaQuotaError(retry_after=data['tl'])
+        if 'g' not in data:
+            raise MegaError("File is not available for download")
+        mega_file.url = data['g']
+        return mega_file
+
+
+class MegaDownloader:
+    """Parallel range downloader that decrypts and writes chunks in place"""
+
+    def __init__(self, config):
+        self.config = config
+        self.client = MegaClient(config.MEGA_API_URL)
+        self.executor = ThreadPoolExecutor(max_workers=config.MEGA_MAX_CONNECTIONS,
+                                           thread_name_prefix='mega')
+        self.bandwidth = BandwidthLimiter(config.MEGA_MAX_BANDWIDTH)
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self._local.session = session
+        return session
+
+    async def get_file_info(self, handle, key, sid=None):
+        """Fetch file metadata without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.client.get_public_file, handle, key, sid)
+
+    async def get_link_info(self, link, sid=None):
+        """Metadata for a file link or a link to a file inside a folder.
+
+        With a session id the download URL is issued to that account, so
+        the transfer counts against its quota.
+        """
+        folder = parse_mega_folder(link)
+        if folder and folder[2]:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, self.client.get_folder_file, *folder, sid)
+        return await self.get_file_info(*parse_mega_link(link), sid)
+
+    async def login(self, email, password):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.client.login, email, password)
+
+    async def get_transfer_quota(self, sid):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.client.get_transfer_quota, sid)
+
+    async def list_folder(self, folder_handle, folder_key):
+        """Files below a folder link, without download URLs"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.client.get_folder,
+                                          folder_handle, folder_key)
+
+    async def download(self, mega_file, target, progress=None, state=None, checkpoint=None):
+        """Download mega_file to target, verifying the file MAC.
+
+        ``target`` is a path or a sink such as SplitSink. With a ``state``
+        from an earlier attempt, segments already marked in its bitmap are
+        re-checked against their stored chunk MACs and only the missing
+        ranges are fetched. ``checkpoint(index, macs)`` is awaited after
+        every finished segment so the caller can persist progress.
+        """
+        loop = asyncio.get_running_loop()
+        sink = FileSink(target) if isinstance(target, (str, os.PathLike)) else target
+        state = state or DownloadState(self.config.MEGA_SEGMENT_SIZE)
+        segments = plan_segments(mega_file.size, state.segment_size)
+        state.resize(len(segments))
+        progress = progress or DownloadProgress(mega_file.size)
+        semaphore = asyncio.Semaphore(self.config.MEGA_CONNECTIONS)
+        stop = threading.Event()
+
+        complete = False
+        await sink.open(mega_file.size, segments)
+        try:
+            pending = await self._verify_done_segments(mega_file, segments, state, sink, progress)
+
+            async def run(segment):
+                await sink.reserve(segment)
+                async with semaphore:
+                    macs = await loop.run_in_executor(
+                        self.executor, self._fetch_with_retry,
+                        mega_file, segment, sink, progress, stop
+                    )
+                state.mark_done(segment.index, macs)
+                if checkpoint:
+                    await checkpoint(segment.index, macs)
+                await sink.segment_done(segment)
+
+            tasks = [asyncio.ensure_future(run(segment)) for segment in pending]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                stop.set()
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            complete = True
+        finally:
+            await sink.close(complete)
+
+        if mega_file.size and state.meta_mac(mega_file.aes_key) != tuple(mega_file.meta_mac):
+            state.reset()
+            raise MegaError("MAC mismatch, file is corrupted")
+        return target
+
+    async def _verify_done_segments(self, mega_file, segments, state, sink, progress):
+        """Re-MAC segments already on disk; return the ones still to fetch"""
+        loop = asyncio.get_running_loop()
+        pending = []
+        for segment in segments:
+            if not state.bitmap.is_set(segment.index):
+                pending.append(segment)
+                continue
+            if not sink.available(segment):
+                # Already handed off (e.g. an uploaded part): trust the stored MACs
+                progress.add(segment.length)
+                continue
+            macs = await loop.run_in_executor(self.executor, self._read_segment_macs,
+                                              mega_file, segment, sink)
+            if macs == state.chunk_macs.get(segment.index):
+                progress.add(segment.length)
+                await sink.segment_done(segment)
+            else:
+                logger.warning("Segment %s of %s failed MAC check, refetching",
+                               segment.index, mega_file.name)
+                state.clear(segment.index)
+                pending.append(segment)
+        return pending
+
+    def _read_segment_macs(self, mega_file, segment, sink):
+        mac = ChunkMac(mega_file.aes_key, mega_file.iv, segment.chunks)
+        offset = segment.start
+        while offset < segment.end:
+            block = sink.pread(min(BLOCK_SIZE, segment.end - offset), offset)
+            if not block:
+                return None
+            mac.update(block)
+            offset += len(block)
+        return mac.macs
+
+    def _fetch_with_retry(self, mega_file, segment, sink, progress, stop):
+        for attempt in range(self.config.MEGA_RETRIES):
+            try:
+                return self._fetch_segment(mega_file, segment, sink, progress, stop)
+            except (requests.RequestException, MegaError) as e:
+                progress.add(-getattr(e, 'received', 0))
+                if stop.is_set() or isinstance(e, MegaQuotaError) or attempt == self.config.MEGA_RETRIES - 1:
+                    raise
+                logger.warning("Segment %s of %s failed (%s), retrying",
+                               segment.index, mega_file.name, e)
+                stop.wait(min(2 ** attempt, 30))
+
+    def _fetch_segment(self, mega_file, segment, sink, progress, stop):
+        """Stream one range: decrypt, MAC and pwrite each block as it arrives"""
+        counter = Counter.new(64, prefix=a32_to_bytes(mega_file.iv),
+                              initial_value=segment.start // 16)
+        decryptor = AES.new(mega_file.aes_key, AES.MODE_CTR, counter=counter)
+        mac = ChunkMac(mega_file.aes_key, mega_file.iv, segment.chunks)
+        url = f"{mega_file.url}/{segment.start}-{segment.end - 1}"
+        offset = segment.start
+
+        try:
+            with self._session().get(url, stream=True, timeout=60) as response:
+                if response.status_code == 509:
+                    raise MegaQuotaError()
+                response.raise_for_status()
+                for block in response.iter_content(BLOCK_SIZE):
+                    if stop.is_set():
+                        raise MegaError("Download cancelled")
+                    block = block[:segment.end - offset]
+                    plain = decryptor.decrypt(block)
+                    sink.pwrite(plain, offset)
+                    mac.update(plain)
+                    offset += len(plain)
+                    progress.transfer(len(plain))
+                    self.bandwidth.consume(len(block))
+                    if offset >= segment.end:
+                        break
+            if offset != segment.end:
+                raise MegaError(f"Short read at {offset} (expected {segment.end})")
+        except (requests.RequestException, MegaError) as e:
+            e.received = offset - segment.start
+            raise
+        return mac.macs
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
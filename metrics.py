@@ -0,0 +1,274 @@
+import asyncio
+import bisect
+import contextlib
+import functools
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils import human_size
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+
+class Registry:
+    """Prometheus-style metrics, rendered without any client library.
+
+    Metrics are module-level objects recorded from the hot paths. Until
+    configure() enables the registry (METRICS_PORT or METRICS_LOG_INTERVAL
+    set), recording returns at once and the instrument_* wrappers hand back
+    the original callable, so the disabled layer costs next to nothing.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.enabled = False
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Text exposition format, as served on /metrics"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self.values = {}  # tuple of label values -> value
+        self.lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return [f"{self.name}{_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        if not REGISTRY.enabled:
+            return
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def total(self):
+        with self.lock:
+            return sum(self.values.values())
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), function=None):
+        super().__init__(name, help, labels)
+        self.function = function
+
+    def set_function(self, function):
+        """Read the value from ``function()`` at scrape time"""
+        self.function = function
+
+    def inc(self, *labels, amount=1):
+        if not REGISTRY.enabled:
+            return
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def get(self, *labels):
+        if self.function:
+            return self.function()
+        return self.values.get(labels, 0)
+
+    def samples(self):
+        if self.function:
+            return [f"{self.name} {self.function()}"]
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        if not REGISTRY.enabled:
+            return
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                # one slot per bucket plus +Inf, then sum
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self.lock:
+            items = sorted((key, list(counts)) for key, counts in self.values.items())
+        lines = []
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {counts[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+HANDLER_SECONDS = Histogram('bot_handler_seconds', 'Telegram handler latency', ['handler'])
+HANDLER_ERRORS = Counter('bot_handler_errors_total', 'Handlers that raised', ['handler'])
+DB_CALLS = Counter('bot_db_calls_total', 'Database calls', ['method'])
+DB_SECONDS = Histogram('bot_db_call_seconds', 'Database call latency, including executor wait', ['method'])
+STAGE_SECONDS = Histogram('bot_stage_seconds', 'Duration of download and upload stages', ['stage'])
+TRANSFER_BYTES = Counter('bot_transfer_bytes_total', 'Bytes downloaded from Mega / uploaded to Telegram',
+                         ['direction'])
+IN_FLIGHT = Gauge('bot_in_flight', 'Downloads and uploads running now', ['stage'])
+QUEUE_WAITING = Gauge('bot_queue_waiting', 'Download jobs waiting for a worker')
+
+
+@contextlib.contextmanager
+def upload_stage(size):
+    """Track one upload to Telegram: in flight, duration and, if it succeeds, bytes"""
+    IN_FLIGHT.inc('upload')
+    try:
+        with STAGE_SECONDS.time('upload'):
+            yield
+        TRANSFER_BYTES.inc('upload', amount=size)
+    finally:
+        IN_FLIGHT.dec('upload')
+
+
+def instrument_handler(name, callback):
+    """Time a Telegram handler callback and count its failures"""
+    if not REGISTRY.enabled:
+        return callback
+
+    @functools.wraps(callback)
+    async def handler(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+
+    return handler
+
+
+def instrument_db(name, call):
+    """Count and time an awaitable database method"""
+    if not REGISTRY.enabled:
+        return call
+
+    @functools.wraps(call)
+    async def timed(*args, **kwargs):
+        DB_CALLS.inc(name)
+        started = time.perf_counter()
+        try:
+            return await call(*args, **kwargs)
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - started, name)
+
+    return timed
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def configure(config):
+    """Enable recording and serve /metrics when the config asks for it"""
+    REGISTRY.enabled = bool(config.METRICS_PORT or config.METRICS_LOG_INTERVAL)
+    if not config.METRICS_PORT:
+        return None
+    server = ThreadingHTTPServer((config.METRICS_HOST, config.METRICS_PORT), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info("Metrics on http://%s:%s/metrics", config.METRICS_HOST, server.server_address[1])
+    return server
+
+
+async def log_summary(interval):
+    """Log throughput and activity every ``interval`` seconds"""
+    last = (TRANSFER_BYTES.values.copy(), DB_CALLS.total(), _handler_calls())
+    while True:
+        await asyncio.sleep(interval)
+        current = (TRANSFER_BYTES.values.copy(), DB_CALLS.total(), _handler_calls())
+        down = current[0].get(('download',), 0) - last[0].get(('download',), 0)
+        up = current[0].get(('upload',), 0) - last[0].get(('upload',), 0)
+        logger.info(
+            "📈 %s handler calls, %s db calls, %s downloading / %s uploading, "
+            "%s waiting, ⬇️ %s/s ⬆️ %s/s",
+            current[2] - last[2], current[1] - last[1],
+            IN_FLIGHT.get('download'), IN_FLIGHT.get('upload'), QUEUE_WAITING.get(),
+            human_size(down / interval), human_size(up / interval)
+        )
+        last = current
+
+
+def _handler_calls():
+    with HANDLER_SECONDS.lock:
+        return sum(sum(counts[:-1]) for counts in HANDLER_SECONDS.values.values())
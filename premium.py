@@ -0,0 +1,108 @@
+import asyncio
+import datetime
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def expiry_timestamp(value):
+    """expires_at as stored (datetime, ISO string or None) -> epoch seconds or None"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    return value.timestamp()
+
+
+class PremiumCache:
+    """In-memory premium membership, synced from the premium_users collection.
+
+    Access checks are a dict lookup plus an expiry comparison, with no
+    database round trip. The set is loaded at startup and reloaded every
+    PREMIUM_REFRESH_INTERVAL seconds, so grants made by another replica show
+    up within one interval; the refresh also deactivates expired grants.
+    Owner and admins always count as premium.
+    """
+
+    def __init__(self, db, config):
+        self.db = db
+        self.interval = config.PREMIUM_REFRESH_INTERVAL
+        self.staff = [config.OWNER_ID] + [admin for admin in config.ADMINS if admin != config.OWNER_ID]
+        self.members = {}  # user_id -> expiry epoch seconds, None = never
+
+    def __contains__(self, user_id):
+        if user_id in self.staff:
+            return True
+        if user_id not in self.members:
+            return False
+        expires = self.members[user_id]
+        return expires is None or expires > time.time()
+
+    def __iter__(self):
+        """Staff first, then members with active grants"""
+        yield from self.staff
+        for user_id in list(self.members):
+            if user_id not in self.staff and user_id in self:
+                yield user_id
+
+    @property
+    def count(self):
+        """Premium users that are not owner or admins"""
+        return sum(1 for user_id in self if user_id not in self.staff)
+
+    def expires_at(self, user_id):
+        expires = self.members.get(user_id)
+        return datetime.datetime.fromtimestamp(expires) if expires else None
+
+    async def load(self):
+        """Replace the cached set with the active grants in the database.
+
+        A failed read keeps the current set rather than revoking everyone.
+        """
+        docs = await self.db.get_all_premium_users()
+        if docs is None:
+            logger.warning("Premium users could not be read, keeping %s cached grants", len(self.members))
+            return None
+        members = {}
+        for doc in docs:
+            try:
+                members[doc['user_id']] = expiry_timestamp(doc.get('expires_at'))
+            except (KeyError, ValueError) as e:
+                logger.warning("Skipping malformed premium record %s: %s", doc, e)
+        self.members = members
+        return len(members)
+
+    async def refresh(self):
+        expired = await self.db.expire_premium_users(datetime.datetime.now())
+        if expired:
+            logger.info("Deactivated %s expired premium grants", expired)
+        await self.load()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning("Premium refresh failed: %s", e)
+
+    async def grant(self, user_id, added_by, expires_at=None):
+        """Give premium access, optionally until ``expires_at``"""
+        saved = await self.db.save_premium_user({
+            'user_id': user_id,
+            'added_by': added_by,
+            'added_date': datetime.datetime.now(),
+            'expires_at': expires_at,
+            'active': True,
+            'downloads_count': 0
+        })
+        if saved:
+            self.members[user_id] = expiry_timestamp(expires_at)
+        return saved
+
+    async def revoke(self, user_id):
+        removed = await self.db.deactivate_premium_user(user_id)
+        if removed:
+            self.members.pop(user_id, None)
+        return removed
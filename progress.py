@@ -0,0 +1,138 @@
+import asyncio
+import collections
+import itertools
+import logging
+import time
+
+from telegram.error import RetryAfter
+
+from ratelimit import AsyncTokenBucket
+from utils import format_eta, human_size
+
+logger = logging.getLogger(__name__)
+
+
+class SpeedMeter:
+    """Throughput over a moving window of (time, bytes done) samples"""
+
+    def __init__(self, window=20.0):
+        self.window = window
+        self.samples = collections.deque()
+
+    def sample(self, done, now=None):
+        now = time.monotonic() if now is None else now
+        self.samples.append((now, done))
+        while len(self.samples) > 2 and now - self.samples[0][0] > self.window:
+            self.samples.popleft()
+
+    @property
+    def speed(self):
+        """Bytes per second across the window, 0 until two samples exist"""
+        if len(self.samples) < 2:
+            return 0.0
+        (start, first), (end, last) = self.samples[0], self.samples[-1]
+        return max(last - first, 0) / (end - start) if end > start else 0.0
+
+    def eta(self, remaining):
+        speed = self.speed
+        return remaining / speed if speed else None
+
+
+def progress_text(title, done, total, meter, extra=None):
+    """Standard progress block: sizes, percent, speed and ETA"""
+    meter.sample(done)
+    percent = 100.0 * done / total if total else 100.0
+    lines = [title]
+    if extra:
+        lines.append(extra)
+    lines.append(f"📊 {human_size(done)} / {human_size(total)} ({percent:.0f}%)")
+    eta = meter.eta(total - done)
+    if eta is not None:
+        lines.append(f"⚡ {human_size(meter.speed)}/s  ⏱ ETA {format_eta(eta)}")
+    return '\n'.join(lines)
+
+
+class ProgressReporter:
+    """One loop that edits every tracked status message.
+
+    Jobs never edit messages themselves: they register a ``render``
+    callable and the loop pulls fresh text from it, so any number of
+    progress updates between two edits coalesce into one. Each message is
+    edited at most once per ``interval`` and only when its text changed,
+    and all edits share a token bucket that backs off on RetryAfter.
+    """
+
+    def __init__(self, interval=5.0, edits_per_second=20, tick=1.0):
+        self.interval = interval
+        self.tick = min(tick, interval)
+        self.bucket = AsyncTokenBucket(edits_per_second)
+        self.tracked = {}  # handle -> [message, render, last_text, last_edit]
+        self.editing = {}  # handle -> task of the edit in progress
+        self.sending = set()  # handles whose edit is past the bucket and on the wire
+        self.handles = itertools.count()
+
+    def track(self, message, render):
+        """Start reporting for ``message``; returns a handle for untrack()"""
+        handle = next(self.handles)
+        self.tracked[handle] = [message, render, None, time.monotonic()]
+        return handle
+
+    async def untrack(self, handle):
+        """Stop reporting for ``handle``; once this returns no progress edit can land.
+
+        An edit still waiting for a token is cancelled and one already sent
+        is waited for, so completion or error text edited in afterwards is
+        never overwritten by a stale percentage.
+        """
+        self.tracked.pop(handle, None)
+        edit = self.editing.get(handle)
+        if edit is None:
+            return
+        if handle not in self.sending:
+            edit.cancel()
+        await asyncio.wait([edit])
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            now = time.monotonic()
+            for handle, entry in list(self.tracked.items()):
+                message, render, last_text, last_edit = entry
+                if now - last_edit < self.interval:
+                    continue
+                try:
+                    text = render()
+                except Exception as e:
+                    logger.warning("Progress render failed: %s", e)
+                    continue
+                entry[3] = now
+                if text == last_text:
+                    continue
+                edit = self.editing[handle] = asyncio.create_task(self._edit(handle, message, text))
+                try:
+                    await asyncio.wait([edit])
+                except asyncio.CancelledError:
+                    edit.cancel()
+                    raise
+                finally:
+                    self.editing.pop(handle, None)
+                if not edit.cancelled() and edit.result() and handle in self.tracked:
+                    entry[2] = text
+
+    async def _edit(self, handle, message, text):
+        await self.bucket.acquire()
+        if handle not in self.tracked:
+            return False  # untracked while waiting for a token
+        self.sending.add(handle)
+        try:
+            await message.edit_text(text)
+            return True
+        except RetryAfter as e:
+            retry_after = getattr(e.retry_after, 'total_seconds', lambda: e.retry_after)()
+            logger.warning("Flood limit hit on progress edits, pausing for %ss", retry_after)
+            self.bucket.pause(retry_after)
+        except Exception as e:
+            logger.warning("Progress update failed: %s", e)
+        finally:
+            self.sending.discard(handle)
+        return False
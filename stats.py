@@ -0,0 +1,123 @@
+import asyncio
+import collections
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+# How long each rollup period is kept
+RETENTION = {
+    'minute': datetime.timedelta(days=2),
+    'hour': datetime.timedelta(days=90),
+}
+SPARKS = '▁▂▃▄▅▆▇█'
+
+
+def sparkline(values):
+    top = max(values, default=0)
+    if not top:
+        return SPARKS[0] * len(values)
+    return ''.join(SPARKS[min(int(value / top * len(SPARKS)), len(SPARKS) - 1)] for value in values)
+
+
+def bucket_start(value):
+    return datetime.datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+class StatsRecorder:
+    """Incremental bot statistics for /stats.
+
+    Events (downloads queued, completed, failed, bytes, cache hits) are
+    summed in memory and written every STATS_FLUSH_INTERVAL seconds: once
+    into the all-time counters document and once into the current minute
+    and hour rollup buckets. /stats then reads one counters document and
+    at most 60 + 24 buckets, whatever the size of the other collections.
+    Counts whose write fails stay pending and go out with the next flush.
+    """
+
+    def __init__(self, db, config):
+        self.db = db
+        self.interval = config.STATS_FLUSH_INTERVAL
+        self.totals = collections.Counter()  # last flushed all-time totals
+        self.pending = collections.Counter()
+        self.pending_buckets = collections.defaultdict(collections.Counter)
+
+    async def load(self):
+        """Read the counters, seeding the user total with one count on first run"""
+        self.totals = collections.Counter(await self.db.get_counters())
+        if 'users' not in self.totals:
+            users = await self.db.get_total_users()
+            await self.db.increment_counters({'users': users})
+            self.totals['users'] = users
+
+    def record(self, **increments):
+        """Count an event, e.g. record(completed=1, bytes=size, download_seconds=12.5)"""
+        minute = datetime.datetime.now().replace(second=0, microsecond=0)
+        self.pending.update(increments)
+        for period, start in (('minute', minute), ('hour', minute.replace(minute=0))):
+            # In UTC: MongoDB's TTL monitor reads naive datetimes as UTC
+            expires_at = start.astimezone(datetime.timezone.utc) + RETENTION[period]
+            self.pending_buckets[(period, start, expires_at)].update(increments)
+
+    async def flush(self):
+        pending, self.pending = self.pending, collections.Counter()
+        buckets, self.pending_buckets = self.pending_buckets, collections.defaultdict(collections.Counter)
+        if pending and not await self._written(self.db.increment_counters(dict(pending))):
+            self.pending.update(pending)
+        if buckets and not await self._written(self.db.add_rollups({key: dict(counts) for key, counts in buckets.items()})):
+            for key, counts in buckets.items():
+                self.pending_buckets[key].update(counts)
+        # Re-read so counts from other replicas show up too
+        self.totals = collections.Counter(await self.db.get_counters())
+
+    @staticmethod
+    async def _written(write):
+        """Await a database write, False when it failed"""
+        try:
+            return await write
+        except Exception as e:
+            logger.warning("Stats write failed: %s", e)
+            return False
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+                await self.db.delete_expired_rollups(datetime.datetime.now(datetime.timezone.utc))
+            except Exception as e:
+                logger.warning("Stats flush failed: %s", e)
+
+    @property
+    def current(self):
+        """All-time totals including events not flushed yet"""
+        return self.totals + self.pending
+
+    async def summary(self):
+        """Totals plus last-hour and last-24h figures for /stats"""
+        await self.flush()
+        totals = self.totals
+        now = datetime.datetime.now().replace(second=0, microsecond=0)
+        minutes = await self.db.get_rollups('minute', now - datetime.timedelta(minutes=59))
+        hours = await self.db.get_rollups('hour', now.replace(minute=0) - datetime.timedelta(hours=23))
+
+        last_hour = collections.Counter()
+        for bucket in minutes:
+            last_hour.update({name: value for name, value in bucket.items() if isinstance(value, (int, float))})
+        hourly = collections.Counter()
+        for bucket in hours:
+            hourly[bucket_start(bucket['start'])] = bucket.get('bytes', 0)
+        first_hour = now.replace(minute=0) - datetime.timedelta(hours=23)
+        trend = [hourly[first_hour + datetime.timedelta(hours=i)] for i in range(24)]
+
+        return {'totals': totals, 'last_hour': last_hour, 'trend': sparkline(trend)}
+
+
+def failure_rate(counts):
+    finished = counts.get('completed', 0) + counts.get('failed', 0)
+    return 100.0 * counts.get('failed', 0) / finished if finished else 0.0
+
+
+def average_speed(counts):
+    seconds = counts.get('download_seconds', 0)
+    return counts.get('bytes', 0) / seconds if seconds else 0.0
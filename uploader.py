@@ -0,0 +1,142 @@
+import asyncio
+import contextlib
+import logging
+import os
+import pathlib
+import shutil
+import tempfile
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from metrics import upload_stage
+from utils import human_size
+
+logger = logging.getLogger(__name__)
+
+
+async def send_document(bot, retries=5, **kwargs):
+    """send_document that waits out flood limits and retries network errors"""
+    document = kwargs.get('document')
+    for attempt in range(retries):
+        if hasattr(document, 'seek'):
+            document.seek(0)  # a failed attempt may have read part of it
+        try:
+            return await bot.send_document(**kwargs)
+        except RetryAfter as e:
+            retry_after = getattr(e.retry_after, 'total_seconds', lambda: e.retry_after)()
+            logger.warning("Flood limit hit while uploading, waiting %ss", retry_after)
+            await asyncio.sleep(retry_after)
+        except (BadRequest, Forbidden):
+            raise  # permanent (bad file_id, no such chat, too big): retrying won't help
+        except NetworkError as e:
+            if attempt == retries - 1:
+                raise
+            logger.warning("Upload failed (%s), retrying", e)
+            await asyncio.sleep(2 ** attempt)
+    raise NetworkError("Upload kept hitting the flood limit")
+
+
+@contextlib.contextmanager
+def open_document(path, local_mode=False, filename=None):
+    """What send_document should get for a file on disk.
+
+    A local Bot API server reads the file itself, so it is passed as a
+    path (a file:// reference, nothing is streamed); otherwise the file is
+    opened and uploaded as multipart data. The server names the document
+    after the file, so ``filename`` is provided through a hard link.
+    """
+    if not local_mode:
+        with open(path, 'rb') as document:
+            yield document
+        return
+    if not filename or filename == os.path.basename(path):
+        yield pathlib.Path(path).resolve()
+        return
+    link_dir = tempfile.mkdtemp(prefix='upload-', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        link = os.path.join(link_dir, os.path.basename(filename))
+        try:
+            os.link(path, link)
+        except OSError:
+            link = path
+        yield pathlib.Path(link).resolve()
+    finally:
+        shutil.rmtree(link_dir, ignore_errors=True)
+
+
+def part_name(file_name, index):
+    """file.zip -> file.zip.001, the naming split tools and 7-Zip understand"""
+    return f"{file_name}.{index + 1:03d}"
+
+
+class PartUploader:
+    """Uploads the parts of a split download as the SplitSink finishes them"""
+
+    def __init__(self, db, local_mode=False):
+        self.db = db
+        self.local_mode = local_mode
+
+    async def run(self, bot, chat_id, download_id, file_name, sink, on_upload=None):
+        """Upload every remaining part in order; returns the number uploaded"""
+        uploaded = 0
+        while True:
+            part = await sink.next_part()
+            if part is None:
+                return uploaded
+            name = part_name(file_name, part.index)
+            with open_document(part.path, self.local_mode, name) as document, upload_stage(part.size):
+                sent = await send_document(
+                    bot,
+                    chat_id=chat_id,
+                    document=document,
+                    filename=name,
+                    caption=f"📁 {file_name}\n🧩 Part {part.index + 1}/{len(sink.parts)} ({human_size(part.size)})"
+                )
+            await self.db.add_download_part(download_id, {
+                'index': part.index,
+                'file_name': name,
+                'size_bytes': part.size,
+                'file_id': sent.document.file_id
+            })
+            await sink.release(part)
+            uploaded += 1
+            if on_upload:
+                await on_upload(part)
+
+
+class ChannelFanout:
+    """Posts an uploaded document to every registered channel by file_id.
+
+    The file is only uploaded once (to the user's chat); each channel then
+    costs one small send_document per file_id. Channels are served
+    concurrently up to CHANNEL_FANOUT_CONCURRENCY, parts in order within
+    a channel, and send_document retries flood waits and network errors.
+    """
+
+    def __init__(self, db, config):
+        self.db = db
+        self.semaphore = asyncio.Semaphore(config.CHANNEL_FANOUT_CONCURRENCY)
+
+    async def run(self, bot, file_name, file_size, file_ids):
+        """Returns (posted, total) channel counts"""
+        channels = await self.db.get_channels()
+        if not channels or not file_ids:
+            return 0, len(channels)
+        results = await asyncio.gather(*(
+            self._post(bot, channel, file_name, file_size, file_ids) for channel in channels
+        ))
+        return sum(results), len(channels)
+
+    async def _post(self, bot, channel, file_name, file_size, file_ids):
+        async with self.semaphore:
+            try:
+                for index, file_id in enumerate(file_ids):
+                    caption = f"📁 {file_name}\n💾 {file_size}"
+                    if len(file_ids) > 1:
+                        caption += f"\n🧩 Part {index + 1}/{len(file_ids)}"
+                    await send_document(bot, chat_id=channel['channel_id'], document=file_id, caption=caption)
+                return True
+            except (BadRequest, Forbidden, NetworkError) as e:
+                logger.warning("Posting %s to channel %s failed: %s",
+                               file_name, channel.get('name', channel['channel_id']), e)
+                return False
@@ -0,0 +1,17 @@
+def human_size(num_bytes):
+    """Format a byte count for status messages"""
+    size = float(num_bytes or 0)
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f}{unit}" if unit == 'B' else f"{size:.1f}{unit}"
+        size /= 1024
+
+
+def format_eta(seconds):
+    """Format a duration like 1h 05m / 4m 10s / 12s"""
+    seconds = int(max(seconds or 0, 0))
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds}s"